@@ -1,11 +1,39 @@
 from abc import ABC, abstractmethod
-from typing import Any, Generic, Type, TypeVar
+from typing import Any, Generic, Optional, Self, Type, TypeVar
 
 from app import const
 from app.exceptions import NeedMoreBytesError, WrongBencodeFormatError
 
 T = TypeVar("T")
 
+_INTEGER_START = const.INTEGER_START[0]
+_LIST_START = const.LIST_START[0]
+_DICT_START = const.DICT_START[0]
+_BENCODE_END = const.BENCODE_END[0]
+_DIGITS = frozenset(b"0123456789")
+_MAX_LENGTH_DIGITS = 20
+
+
+class _Source:
+    """One decoded buffer: `raw` for bytes.find, `view` for copy-free slicing"""
+
+    __slots__ = ("raw", "view", "size")
+
+    def __init__(self, raw_bytes: bytes) -> None:
+        if not isinstance(raw_bytes, bytes):
+            raw_bytes = bytes(raw_bytes)
+        self.raw: bytes = raw_bytes
+        self.view: memoryview = memoryview(raw_bytes)
+        self.size: int = len(raw_bytes)
+
+    def error(self, name: str, index: int) -> WrongBencodeFormatError:
+        return WrongBencodeFormatError(
+            f"{name}.from_bytes(): index = {index} raw_bytes = {self.raw[index:index + 32]!r}"
+        )
+
+    def remainder(self, index: int) -> bytes:
+        return bytes(self.view[index:])
+
 
 class Bencode(ABC, Generic[T]):  # noqa: WPS214
     def __init__(self, data: T) -> None:
@@ -13,7 +41,7 @@ class Bencode(ABC, Generic[T]):  # noqa: WPS214
             raise TypeError(f"{self.name}: type(data) = {type(data)} data = {data}")
         self.data: T = data
 
-        self._raw_bytes: bytes = self._to_bytes()
+        self._raw_bytes: Optional[bytes | memoryview] = None
 
     def __repr__(self) -> str:
         return f"{self.name}({self.data})"
@@ -23,6 +51,15 @@ class Bencode(ABC, Generic[T]):  # noqa: WPS214
 
     @property
     def to_bytes(self) -> bytes:
+        span = self.span
+        if isinstance(span, memoryview):
+            span = self._raw_bytes = bytes(span)
+        return span
+
+    @property
+    def span(self) -> bytes | memoryview:
+        if self._raw_bytes is None:
+            self._raw_bytes = self._to_bytes()
         return self._raw_bytes
 
     @property
@@ -39,23 +76,32 @@ class Bencode(ABC, Generic[T]):  # noqa: WPS214
 
     @classmethod
     def from_bytes(cls, raw_bytes: bytes) -> tuple[bytes, "BencodeAny"]:
-        if len(raw_bytes) < 1:  # noqa: WPS204
+        source = _Source(raw_bytes)
+        index, result = cls._decode(source, 0)
+        return source.remainder(index), result
+
+    @classmethod
+    def _decode(cls, source: _Source, index: int) -> tuple[int, "BencodeAny"]:
+        if index >= source.size:
             raise NeedMoreBytesError
-        if raw_bytes[:1] == const.INTEGER_START:  # noqa: WPS204
-            return Integer.from_bytes(raw_bytes)
-        if raw_bytes[:1] == const.LIST_START:
-            return List.from_bytes(raw_bytes)
-        if raw_bytes[:1] == const.DICT_START:
-            return Dict.from_bytes(raw_bytes)
-        if chr(raw_bytes[0]).isdigit():
-            return String.from_bytes(raw_bytes)
-        raise WrongBencodeFormatError(
-            f"Bencode.from_bytes(): raw_bytes = {raw_bytes!r}"
-        )
+        first = source.raw[index]
+        if first == _INTEGER_START:
+            return Integer._decode(source, index)
+        if first == _LIST_START:
+            return List._decode(source, index)
+        if first == _DICT_START:
+            return Dict._decode(source, index)
+        if first in _DIGITS:
+            return String._decode(source, index)
+        raise source.error("Bencode", index)
 
     @abstractmethod
     def _to_bytes(self) -> bytes: ...
 
+    def _with_span(self, span: memoryview) -> Self:
+        self._raw_bytes = span
+        return self
+
 
 BencodeAny = Bencode[Any]
 
@@ -78,27 +124,33 @@ class String(Bencode[bytes]):
         return f'"{line}"'
 
     @classmethod
-    def from_bytes(cls, raw_bytes: bytes) -> tuple[bytes, "String"]:  # noqa: WPS238
-        if len(raw_bytes) < 2:
+    def from_bytes(cls, raw_bytes: bytes) -> tuple[bytes, "String"]:
+        source = _Source(raw_bytes)
+        index, result = cls._decode(source, 0)
+        return source.remainder(index), result
+
+    @classmethod
+    def _decode(cls, source: _Source, index: int) -> tuple[int, "String"]:  # noqa: WPS238
+        if index >= source.size:
             raise NeedMoreBytesError
-        if not chr(raw_bytes[0]).isdigit():
-            raise WrongBencodeFormatError(
-                f"String.from_bytes(): raw_bytes = {raw_bytes!r}"
-            )
-        length_str = ""
-        index = 0
-        while index < len(raw_bytes) and chr(raw_bytes[index]).isdigit():
-            length_str += chr(raw_bytes[index])
-            index += 1
-        length = int(length_str)
-        if index + length > len(raw_bytes):
+        if source.raw[index] not in _DIGITS:
+            raise source.error("String", index)
+        delimiter = source.raw.find(
+            const.STRING_DELIMITER, index, index + _MAX_LENGTH_DIGITS + 1
+        )
+        if delimiter < 0:
+            length_bytes = source.raw[index : index + _MAX_LENGTH_DIGITS + 1]
+            if length_bytes.isdigit() and len(length_bytes) <= _MAX_LENGTH_DIGITS:
+                raise NeedMoreBytesError
+            raise source.error("String", index)
+        length_bytes = source.raw[index:delimiter]
+        if not length_bytes.isdigit():
+            raise source.error("String", index)
+        end = delimiter + 1 + int(length_bytes)
+        if end > source.size:
             raise NeedMoreBytesError
-        if raw_bytes[index : index + 1] != const.STRING_DELIMITER:
-            raise WrongBencodeFormatError(
-                f"String.from_bytes(): raw_bytes = {raw_bytes!r}"
-            )
-        result = raw_bytes[index + 1 : index + 1 + length]
-        return raw_bytes[index + 1 + length :], String(result)
+        result = String(bytes(source.view[delimiter + 1 : end]))
+        return end, result._with_span(source.view[index:end])
 
     def _to_bytes(self) -> bytes:
         length_prefix = str(len(self.data)).encode()
@@ -119,32 +171,25 @@ class Integer(Bencode[int]):
         return str(self.data)
 
     @classmethod
-    def from_bytes(
-        cls, raw_bytes: bytes
-    ) -> tuple[bytes, "Integer"]:  # noqa: WPS231, WPS238
-        if len(raw_bytes) < 3:
-            raise NeedMoreBytesError
-        if raw_bytes[:1] != const.INTEGER_START:
-            raise WrongBencodeFormatError(
-                f"Integer.from_bytes(): raw_bytes = {raw_bytes!r}"
-            )
+    def from_bytes(cls, raw_bytes: bytes) -> tuple[bytes, "Integer"]:
+        source = _Source(raw_bytes)
+        index, result = cls._decode(source, 0)
+        return source.remainder(index), result
 
-        result_str = ""
-        index = 1
-        while index < len(raw_bytes):
-            if raw_bytes[index : index + 1] == const.BENCODE_END:
-                break
-            result_str += chr(raw_bytes[index])
-            index += 1
-        if index >= len(raw_bytes):
+    @classmethod
+    def _decode(cls, source: _Source, index: int) -> tuple[int, "Integer"]:
+        if index >= source.size:
+            raise NeedMoreBytesError
+        if source.raw[index] != _INTEGER_START:
+            raise source.error("Integer", index)
+        end = source.raw.find(const.BENCODE_END, index + 1)
+        if end < 0:
             raise NeedMoreBytesError
         try:
-            result = int(result_str)
+            result = int(source.raw[index + 1 : end])
         except ValueError:
-            raise WrongBencodeFormatError(
-                f"Integer.from_bytes(): raw_bytes = {raw_bytes!r}"
-            )
-        return raw_bytes[index + 1 :], Integer(result)
+            raise source.error("Integer", index)
+        return end + 1, Integer(result)._with_span(source.view[index : end + 1])
 
     def _to_bytes(self) -> bytes:
         return const.INTEGER_START + str(self.data).encode() + const.BENCODE_END
@@ -167,29 +212,28 @@ class List(Bencode[list[BencodeAny]]):
         return "[{}]".format(",".join(result))
 
     @classmethod
-    def from_bytes(cls, raw_bytes: bytes) -> tuple[bytes, "BencodeAny"]:  # noqa: WPS238
-        if len(raw_bytes) < 2:
-            raise NeedMoreBytesError
-        if raw_bytes[:1] != const.LIST_START:
-            raise WrongBencodeFormatError(
-                f"List.from_bytes(): raw_bytes = {raw_bytes!r}"
-            )
+    def from_bytes(cls, raw_bytes: bytes) -> tuple[bytes, "List"]:
+        source = _Source(raw_bytes)
+        index, result = cls._decode(source, 0)
+        return source.remainder(index), result
 
-        raw_bytes = raw_bytes[1:]
+    @classmethod
+    def _decode(cls, source: _Source, start: int) -> tuple[int, "List"]:
+        if start >= source.size:
+            raise NeedMoreBytesError
+        if source.raw[start] != _LIST_START:
+            raise source.error("List", start)
+        index = start + 1
         result: list[BencodeAny] = []
-        while len(raw_bytes) > 1 and raw_bytes[:1] != const.BENCODE_END:
-            raw_bytes, elem = Bencode.from_bytes(raw_bytes)
+        while index < source.size and source.raw[index] != _BENCODE_END:
+            index, elem = Bencode._decode(source, index)
             result.append(elem)
-        if len(raw_bytes) < 1:
+        if index >= source.size:
             raise NeedMoreBytesError
-        if raw_bytes[:1] != const.BENCODE_END:
-            raise WrongBencodeFormatError(
-                f"List.from_bytes(): raw_bytes = {raw_bytes!r}"
-            )
-        return raw_bytes[1:], List(result)
+        return index + 1, List(result)._with_span(source.view[start : index + 1])
 
     def _to_bytes(self) -> bytes:
-        elems = b"".join(elem.to_bytes for elem in self.data)
+        elems = b"".join(elem.span for elem in self.data)
         return const.LIST_START + elems + const.BENCODE_END
 
 
@@ -214,31 +258,204 @@ class Dict(Bencode[dict[str, BencodeAny]]):
         return "{{{}}}".format(",".join(result))
 
     @classmethod
-    def from_bytes(cls, raw_bytes: bytes) -> tuple[bytes, "Dict"]:  # noqa: WPS238
-        if len(raw_bytes) < 2:
-            raise NeedMoreBytesError
-        if raw_bytes[:1] != const.DICT_START:
-            raise WrongBencodeFormatError(
-                f"Dict.from_bytes(): raw_bytes = {raw_bytes!r}"
-            )
+    def from_bytes(cls, raw_bytes: bytes) -> tuple[bytes, "Dict"]:
+        source = _Source(raw_bytes)
+        index, result = cls._decode(source, 0)
+        return source.remainder(index), result
 
-        raw_bytes = raw_bytes[1:]
+    @classmethod
+    def _decode(cls, source: _Source, start: int) -> tuple[int, "Dict"]:
+        if start >= source.size:
+            raise NeedMoreBytesError
+        if source.raw[start] != _DICT_START:
+            raise source.error("Dict", start)
+        index = start + 1
         result: dict[str, BencodeAny] = {}
-        while len(raw_bytes) > 1 and raw_bytes[:1] != const.BENCODE_END:
-            raw_bytes, key = String.from_bytes(raw_bytes)
-            raw_bytes, value = Bencode.from_bytes(raw_bytes)
+        while index < source.size and source.raw[index] != _BENCODE_END:
+            index, key = String._decode(source, index)
+            index, value = Bencode._decode(source, index)
             result[key.data.decode()] = value
-        if len(raw_bytes) < 1:
+        if index >= source.size:
             raise NeedMoreBytesError
-        if raw_bytes[:1] != const.BENCODE_END:
-            raise WrongBencodeFormatError(
-                f"Dict.from_bytes(): raw_bytes = {raw_bytes!r}"
-            )
-        return raw_bytes[1:], Dict(result)
+        return index + 1, Dict(result)._with_span(source.view[start : index + 1])
 
     def _to_bytes(self) -> bytes:
-        result: list[bytes] = []
+        result: list[bytes | memoryview] = []
         for key, value in self.data.items():
-            result.append(String(key.encode()).to_bytes)
-            result.append(value.to_bytes)
+            result.append(String(key.encode()).span)
+            result.append(value.span)
         return const.DICT_START + b"".join(result) + const.BENCODE_END
+
+
+class _ListFrame:
+    __slots__ = ("start", "items")
+
+    def __init__(self, start: int) -> None:
+        self.start = start
+        self.items: list[BencodeAny] = []
+
+
+class _DictFrame:
+    __slots__ = ("start", "entries", "key")
+
+    def __init__(self, start: int) -> None:
+        self.start = start
+        self.entries: dict[str, BencodeAny] = {}
+        self.key: Optional[str] = None
+
+
+class BencodeParser:  # noqa: WPS214
+    """Resumable push parser: feed() chunks, get back every completed top-level value"""
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self._index = 0
+        self._stack: list[_ListFrame | _DictFrame] = []
+        self._spans: list[tuple[BencodeAny, int, int]] = []
+        self._string_start = -1
+        self._string_end = -1
+        self._integer_scan = -1
+
+    @property
+    def in_progress(self) -> bool:
+        return len(self._buffer) > 0
+
+    @property
+    def unconsumed(self) -> bytes:
+        return bytes(self._buffer)
+
+    def feed(self, chunk: bytes) -> list[BencodeAny]:
+        self._buffer += chunk
+        result: list[BencodeAny] = []
+        while True:
+            value = self._step()
+            if value is None:
+                return result
+            result.append(value)
+
+    def feed_one(self, chunk: bytes) -> Optional[BencodeAny]:
+        """Stop after the first completed value, leaving the rest in `unconsumed`"""
+        self._buffer += chunk
+        return self._step()
+
+    def close(self) -> None:
+        if self.in_progress:
+            raise NeedMoreBytesError
+
+    def _step(self) -> Optional[BencodeAny]:
+        while True:
+            progressed, value = self._advance()
+            if not progressed:
+                return None
+            if value is not None:
+                top_level = self._complete(value)
+                if top_level is not None:
+                    return top_level
+
+    def _advance(self) -> tuple[bool, Optional[BencodeAny]]:
+        if self._index >= len(self._buffer):
+            return False, None
+        if self._string_start < 0:
+            return self._parse_token()
+        if self._string_end > len(self._buffer):
+            return False, None
+        return True, self._finish_string()
+
+    def _parse_token(  # noqa: WPS212, WPS231
+        self,
+    ) -> tuple[bool, Optional[BencodeAny]]:
+        buffer = self._buffer
+        index = self._index
+        first = buffer[index]
+        frame = self._stack[-1] if self._stack else None
+        if isinstance(frame, _DictFrame) and frame.key is None and first != _BENCODE_END:
+            if first not in _DIGITS:
+                raise self._error(index)
+        if first == _INTEGER_START:
+            end = buffer.find(const.BENCODE_END, max(index + 1, self._integer_scan))
+            if end < 0:
+                self._integer_scan = len(buffer)
+                return False, None
+            self._integer_scan = -1
+            try:
+                data = int(buffer[index + 1 : end])
+            except ValueError:
+                raise self._error(index)
+            self._index = end + 1
+            return True, self._record(Integer(data), index)
+        if first in _DIGITS:
+            delimiter = buffer.find(
+                const.STRING_DELIMITER, index, index + _MAX_LENGTH_DIGITS + 1
+            )
+            if delimiter < 0:
+                length_bytes = buffer[index : index + _MAX_LENGTH_DIGITS + 1]
+                if length_bytes.isdigit() and len(length_bytes) <= _MAX_LENGTH_DIGITS:
+                    return False, None
+                raise self._error(index)
+            length_bytes = buffer[index:delimiter]
+            if not length_bytes.isdigit():
+                raise self._error(index)
+            self._string_start = index
+            self._string_end = delimiter + 1 + int(length_bytes)
+            self._index = delimiter + 1
+            return True, None
+        if first == _LIST_START:
+            self._stack.append(_ListFrame(index))
+            self._index = index + 1
+            return True, None
+        if first == _DICT_START:
+            self._stack.append(_DictFrame(index))
+            self._index = index + 1
+            return True, None
+        if first == _BENCODE_END and frame is not None:
+            self._stack.pop()
+            self._index = index + 1
+            if isinstance(frame, _ListFrame):
+                return True, self._record(List(frame.items), frame.start)
+            if frame.key is not None:
+                raise self._error(index)
+            return True, self._record(Dict(frame.entries), frame.start)
+        raise self._error(index)
+
+    def _finish_string(self) -> BencodeAny:
+        start = self._string_start
+        with memoryview(self._buffer) as view:
+            data = bytes(view[self._index : self._string_end])
+        self._index = self._string_end
+        self._string_start = -1
+        self._string_end = -1
+        return self._record(String(data), start)
+
+    def _record(self, value: BencodeAny, start: int) -> BencodeAny:
+        self._spans.append((value, start, self._index))
+        return value
+
+    def _complete(self, value: BencodeAny) -> Optional[BencodeAny]:
+        if not self._stack:
+            self._attach_spans()
+            return value
+        frame = self._stack[-1]
+        if isinstance(frame, _ListFrame):
+            frame.items.append(value)
+        elif frame.key is None:
+            if not isinstance(value, String):
+                raise self._error(self._index)
+            frame.key = value.data.decode()
+        else:
+            frame.entries[frame.key] = value
+            frame.key = None
+        return None
+
+    def _attach_spans(self) -> None:
+        with memoryview(self._buffer) as buffer_view:
+            view = memoryview(bytes(buffer_view[: self._index]))
+        for node, start, end in self._spans:
+            node._with_span(view[start:end])  # noqa: WPS437
+        self._spans.clear()
+        del self._buffer[: self._index]  # noqa: WPS420
+        self._index = 0
+
+    def _error(self, index: int) -> WrongBencodeFormatError:
+        return WrongBencodeFormatError(
+            f"BencodeParser.feed(): index = {index} buffer = {bytes(self._buffer[index:index + 32])!r}"
+        )
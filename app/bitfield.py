@@ -0,0 +1,57 @@
+from typing import Iterator
+
+
+class Bitfield:
+    """Fixed-size bit set, most significant bit first as in the BITFIELD message"""
+
+    def __init__(self, size: int, raw_bytes: bytes = b"") -> None:
+        self._size = size
+        self._bits = bytearray((size + 7) // 8)
+        self._bits[: len(raw_bytes)] = raw_bytes[: len(self._bits)]
+        self._count = sum(map(int.bit_count, self._bits))
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, index: int) -> bool:
+        return bool(self._bits[index >> 3] & (0x80 >> (index & 7)))
+
+    def __iter__(self) -> Iterator[int]:
+        """Indices of the set bits"""
+        for byte_index, byte in enumerate(self._bits):
+            if byte == 0:
+                continue
+            for bit in range(8):
+                index = byte_index * 8 + bit
+                if byte & (0x80 >> bit) and index < self._size:
+                    yield index
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def is_full(self) -> bool:
+        return self._count == self._size
+
+    @property
+    def to_bytes(self) -> bytes:
+        return bytes(self._bits)
+
+    def set(self, index: int) -> bool:
+        """Set a bit, return False if it was already set"""
+        mask = 0x80 >> (index & 7)
+        if self._bits[index >> 3] & mask:
+            return False
+        self._bits[index >> 3] |= mask
+        self._count += 1
+        return True
+
+    def clear(self, index: int) -> bool:
+        """Clear a bit, return False if it was already clear"""
+        mask = 0x80 >> (index & 7)
+        if not self._bits[index >> 3] & mask:
+            return False
+        self._bits[index >> 3] &= ~mask & 0xFF
+        self._count -= 1
+        return True
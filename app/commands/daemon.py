@@ -0,0 +1,56 @@
+import asyncio
+import json
+import os
+import signal
+from typing import Optional
+
+from app.daemon.api import ControlServer, Message, send_request
+from app.daemon.session import Session
+from app.logging_config import get_logger
+from app.shared import SharedResources
+
+logger = get_logger(__name__)
+
+
+def daemon(
+    socket_path: str,
+    directory: str,
+    max_peers: int,
+    download_rate: Optional[float] = None,
+    peer_rate: Optional[float] = None,
+) -> str:
+    asyncio.run(_daemon(socket_path, directory, max_peers, download_rate, peer_rate))
+    return ""
+
+
+def control(socket_path: str, request: Message) -> str:
+    for key in ("torrent", "output"):
+        # The daemon resolves paths against its own working directory
+        if request.get(key) is not None:
+            request[key] = os.path.abspath(request[key])
+    return json.dumps(asyncio.run(send_request(socket_path, request)), indent=2)
+
+
+async def _daemon(
+    socket_path: str,
+    directory: str,
+    max_peers: int,
+    download_rate: Optional[float],
+    peer_rate: Optional[float],
+) -> None:
+    os.makedirs(directory, exist_ok=True)
+    shared = SharedResources.create(max_peers=max_peers, download_rate=download_rate)
+    session = Session(directory, shared, peer_rate=peer_rate)
+    server = ControlServer(session, socket_path)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop.set)
+    try:
+        await server.start()
+        await stop.wait()
+        logger.info("Daemon: shutting down, part files are kept for the next start")
+    finally:
+        await server.close()
+        await session.close()
+        await shared.close()
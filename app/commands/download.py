@@ -1,10 +1,29 @@
 import asyncio
-from typing import Optional
+import os
+import sys
+import tempfile
+from typing import BinaryIO, Callable, Optional
 
+from app.const import LISTEN_PORT, RESUME_SUFFIX, STDOUT_OUTPUT
+from app.exceptions import TrackerError
 from app.logging_config import get_logger
-from app.peer.peer import Peer, peer_to_str
+from app.magnet_link import MagnetLink
+from app.ordered_writer import OrderedWriter
+from app.range_server import RangeServer
+from app.rate_limit import RateLimits, nested_bucket
+from app.peer.manager import ConnectionManager
+from app.peer.metadata import fetch_torrent_file
+from app.peer.pool import PeerPool
 from app.pieces import Pieces
+from app.seeding.block_cache import BlockCache
+from app.seeding.server import SeedServer
+from app.recheck import recheck as recheck_pieces
+from app.resume import ResumeFile
+from app.shared import SharedResources
+from app.storage import PARTIAL_SUFFIX, FileReader, Storage
 from app.torrent_file import TorrentFile
+from app.tracker.announce import Announcer
+from app.tracker.models import AnnounceEvent, TransferStats
 
 logger = get_logger(__name__)
 
@@ -17,46 +36,284 @@ def download_piece(output: str, torrent_filename: str, piece_index: int) -> str:
     return ""
 
 
-def download(output: str, torrent_filename: str) -> str:
+def download(
+    output: str,
+    torrent_filename: str,
+    recheck: bool = False,
+    sequential: bool = False,
+    serve_port: Optional[int] = None,
+    rates: RateLimits = RateLimits(),
+) -> str:
     with open(torrent_filename, "rb") as file:
         content_bytes = file.read()
     torrent_file = TorrentFile.from_bytes(content_bytes)
-    asyncio.run(_download(output, torrent_file=torrent_file))
+    asyncio.run(
+        _download(
+            output,
+            torrent_file=torrent_file,
+            recheck=recheck,
+            sequential=sequential,
+            serve_port=serve_port,
+            rates=rates,
+        )
+    )
+    return ""
+
+
+def magnet_download_piece(output: str, magnet: str, piece_index: int) -> str:
+    asyncio.run(_magnet_download(output, magnet, piece_index=piece_index))
+    return ""
+
+
+def magnet_download(output: str, magnet: str) -> str:
+    asyncio.run(_magnet_download(output, magnet))
     return ""
 
 
-async def _download(  # noqa: WPS210
-    output_file: str, torrent_file: TorrentFile, piece_index: Optional[int] = None
+async def _magnet_download(output_file: str, magnet: str, piece_index: Optional[int] = None) -> None:
+    magnet_link = MagnetLink(magnet)
+    # Peers that delivered the metadata go on with the download over the same connections
+    pool = PeerPool(magnet_link.info_hash)
+    try:
+        torrent_file = await fetch_torrent_file(magnet_link.info_hash, magnet_link.tiers, pool)
+        await _download(output_file, torrent_file=torrent_file, piece_index=piece_index, pool=pool)
+    finally:
+        await pool.close()
+
+
+async def _download(  # noqa: WPS211
+    output_file: str,
+    torrent_file: TorrentFile,
+    piece_index: Optional[int] = None,
+    recheck: bool = False,
+    pool: Optional[PeerPool] = None,
+    sequential: bool = False,
+    serve_port: Optional[int] = None,
+    shared: Optional[SharedResources] = None,
+    on_pieces: Optional[Callable[[Pieces], None]] = None,
+    rates: RateLimits = RateLimits(),
 ) -> None:
-    peers = {
-        peer_to_str(ip, port): Peer(ip, port, torrent_file.info_hash)
-        for ip, port in torrent_file.get_peers()  # noqa: WPS221
-    }
-    pieces = Pieces(torrent_file=torrent_file, piece_index=piece_index)
-    tasks: set[asyncio.Task[None]] = set(
-        [
-            asyncio.create_task(peer.communicate(pieces), name=peername)
-            for peername, peer in peers.items()
-        ]
+    if output_file == STDOUT_OUTPUT:
+        try:
+            await _stream(
+                sys.stdout.buffer,
+                torrent_file,
+                piece_index=piece_index,
+                pool=pool,
+                sequential=sequential,
+                rates=rates,
+            )
+        except BrokenPipeError:
+            logger.warning("stdout was closed before the download finished")
+            # Python flushes stdout once more at exit, which would fail the same way
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return
+    if piece_index is not None:
+        with Storage(output_file, torrent_file.piece_size(piece_index)) as storage:
+            pieces = Pieces(torrent_file=torrent_file, storage=storage, piece_index=piece_index)
+            await _run(pieces, torrent_file, seed_server=None, pool=pool, rates=rates)
+        return
+    resume = ResumeFile(
+        output_file + RESUME_SUFFIX, torrent_file.info_hash, len(torrent_file.piece_hashes)
     )
-    while not pieces.is_done:
-        done_tasks, tasks = await asyncio.wait(
-            tasks, return_when=asyncio.FIRST_COMPLETED
+    marked, trusted = resume.load(output_file + PARTIAL_SUFFIX)
+    files = torrent_file.files if torrent_file.is_multi_file else None
+    range_server: Optional[RangeServer] = None
+    try:
+        with Storage(output_file, torrent_file.length, keep_partial=True, files=files) as storage:
+            if recheck or not trusted:
+                to_check = range(len(marked)) if recheck else list(marked)
+                marked = await recheck_pieces(storage.read, torrent_file, to_check)
+                logger.info(f"Recheck: {marked.count} of {len(to_check)} pieces are good")
+            pieces = Pieces(
+                torrent_file=torrent_file,
+                storage=storage,
+                already_verified=marked,
+                sequential=sequential or serve_port is not None,
+                hash_executor=shared.hash_executor if shared is not None else None,
+            )
+            if on_pieces is not None:
+                on_pieces(pieces)
+            pieces.watch_verified(
+                lambda _: resume.save_soon(pieces.verified, storage.partial_path)
+            )
+            if serve_port is not None:
+                range_server = RangeServer(torrent_file, storage.read, pieces)
+                await range_server.start("127.0.0.1", serve_port)
+            # Torrents sharing a process cannot each listen on the seeding port
+            seed_server = None
+            if shared is None:
+                seed_server = await _start_seeding(torrent_file, pieces, storage, rates)
+            try:
+                await _run(pieces, torrent_file, seed_server, pool, shared, rates)
+            finally:
+                if seed_server is not None:
+                    await seed_server.close()
+                resume.save(pieces.verified, storage.partial_path)
+        resume.remove()
+        if range_server is not None:
+            await _keep_serving(range_server, output_file, torrent_file)
+    finally:
+        if range_server is not None:
+            await range_server.close()
+
+
+async def _keep_serving(range_server: RangeServer, output_file: str, torrent_file: TorrentFile) -> None:
+    """Serve the complete file until interrupted, playback may well outlast the download"""
+    files = torrent_file.files if torrent_file.is_multi_file else None
+    # Switched before the first await: the part file it was reading is renamed by now
+    with FileReader(output_file, torrent_file.length, files) as reader:
+        range_server.set_reader(reader.read)
+        logger.info(f"Download complete, still serving on port {range_server.port} until interrupted")
+        await asyncio.Event().wait()
+
+
+async def _stream(
+    sink: BinaryIO,
+    torrent_file: TorrentFile,
+    piece_index: Optional[int] = None,
+    pool: Optional[PeerPool] = None,
+    sequential: bool = False,
+    rates: RateLimits = RateLimits(),
+) -> None:
+    """Download into a scratch file and write pieces to sink in order as they verify"""
+    if piece_index is None:
+        wanted = range(len(torrent_file.piece_hashes))
+        length = torrent_file.length
+    else:
+        wanted = range(piece_index, piece_index + 1)
+        length = torrent_file.piece_size(piece_index)
+    with tempfile.TemporaryDirectory(prefix="stream-") as directory:
+        storage = Storage(os.path.join(directory, "data"), length)
+        try:
+            pieces = Pieces(
+                torrent_file=torrent_file, storage=storage, piece_index=piece_index, sequential=sequential
+            )
+            writer = OrderedWriter(storage.read, torrent_file, sink, wanted)
+            pieces.watch_verified(writer.piece_verified)
+            writer_task = asyncio.create_task(writer.run(), name="stream writer")
+            download_task = asyncio.create_task(
+                _run(pieces, torrent_file, seed_server=None, pool=pool, rates=rates), name="download"
+            )
+            tasks = {writer_task, download_task}
+            try:
+                done_tasks, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                if writer_task in done_tasks:
+                    # A closed stream ends the download, nobody reads what is left
+                    writer_task.result()
+                await download_task
+                await writer_task
+                logger.info(f"Stream: {writer.written} bytes written")
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            storage.discard()
+
+
+async def _run(
+    pieces: Pieces,
+    torrent_file: TorrentFile,
+    seed_server: Optional[SeedServer],
+    pool: Optional[PeerPool] = None,
+    shared: Optional[SharedResources] = None,
+    rates: RateLimits = RateLimits(),
+) -> None:
+    if pieces.is_done:
+        logger.info("Every piece is already verified")
+        return
+    manager = ConnectionManager(
+        pieces,
+        info_hash=torrent_file.info_hash,
+        budget=shared.connections if shared is not None else None,
+        dial_slots=shared.dial_slots if shared is not None else None,
+        rate_limit=nested_bucket(shared.download_rate if shared is not None else None, rates.download),
+        peer_rate=rates.peer,
+    )
+    if pool is not None:
+        await manager.adopt(pool.take_all())
+    announcer = Announcer(
+        info_hash=torrent_file.info_hash,
+        tiers=torrent_file.tiers,
+        stats=lambda: TransferStats(
+            uploaded=seed_server.uploaded if seed_server is not None else 0,
+            downloaded=pieces.downloaded,
+            left=pieces.left,
+        ),
+        on_peers=manager.add_addresses,
+        pool=shared.http_pool if shared is not None else None,
+        udp=shared.udp if shared is not None else None,
+    )
+    try:
+        announcer_task = asyncio.create_task(
+            announcer.run(await _announce_started(announcer)), name="announcer"
         )
-        for done_task in done_tasks:
-            peername = done_task.get_name()
-            if done_task.exception() is not None:
-                logger.error(f"done_task = {done_task}")
-                logger.error(
-                    f"done_task.exception() = {type(done_task.exception())} {done_task.exception()}",
-                    exc_info=done_task.exception(),
-                )
-                raise NotImplementedError
-            pieces.return_in_queue(peername)
-            peer = peers[peername]
-            tasks.add(asyncio.create_task(peer.communicate(pieces), name=peername))
-            logger.info(f"Recreated peer-task {peername}")
-        await asyncio.sleep(0)
-    with open(output_file, "wb") as file:
-        for block in pieces.blocks():
-            file.write(block)
+        try:
+            await _download_to(pieces, manager)
+        finally:
+            announcer_task.cancel()
+            await asyncio.gather(announcer_task, return_exceptions=True)
+        await _announce_completed(announcer)
+    finally:
+        await announcer.close()
+
+
+async def _start_seeding(
+    torrent_file: TorrentFile, pieces: Pieces, storage: Storage, rates: RateLimits
+) -> Optional[SeedServer]:
+    """Serve verified pieces while downloading, the download goes on if the port is taken"""
+    cache = BlockCache(storage.read, torrent_file.piece_length, torrent_file.piece_size)
+    seed_server = SeedServer(
+        info_hash=torrent_file.info_hash,
+        have=pieces.verified,
+        cache=cache,
+        piece_size=torrent_file.piece_size,
+        rate_limit=nested_bucket(None, rates.upload),
+        peer_rate=rates.peer,
+    )
+    try:
+        await seed_server.start("0.0.0.0", LISTEN_PORT)  # noqa: S104
+    except OSError as e:
+        logger.warning(f"Not seeding, cannot listen on port {LISTEN_PORT}: {e}")
+        return None
+    pieces.watch_verified(seed_server.have_piece)
+    return seed_server
+
+
+async def _announce_started(announcer: Announcer) -> float:
+    """Seconds to the next announce, the download goes on with the peers it has if no tracker answers"""
+    try:
+        response = await announcer.announce(AnnounceEvent.STARTED)
+    except (TrackerError, TimeoutError) as e:
+        logger.warning(f"Announce of start failed, announcing again: {e}")
+        return 0
+    return response.next_announce
+
+
+async def _announce_completed(announcer: Announcer) -> None:
+    try:
+        await announcer.announce(AnnounceEvent.COMPLETED)
+    except (TrackerError, TimeoutError) as e:
+        logger.warning(f"Announce of completion failed: {e}")
+
+
+async def _download_to(pieces: Pieces, manager: ConnectionManager) -> None:
+    """Run peers until every piece is verified, peers announced meanwhile join the download"""
+    verifier_task = asyncio.create_task(pieces.run_verifier(), name="verifier")
+    pieces_done_task = asyncio.create_task(pieces.wait_done(), name="pieces done")
+    manager_task = asyncio.create_task(manager.run(), name="connection manager")
+    service_tasks = {verifier_task, pieces_done_task, manager_task}
+    try:
+        done_tasks, _ = await asyncio.wait(service_tasks, return_when=asyncio.FIRST_COMPLETED)
+        if verifier_task in done_tasks:
+            verifier_task.result()
+            logger.error("Piece verifier stopped before the download was done")
+            raise NotImplementedError
+        if manager_task in done_tasks:
+            manager_task.result()
+        await pieces_done_task
+    finally:
+        for task in service_tasks:
+            task.cancel()
+        await asyncio.gather(*service_tasks, return_exceptions=True)
@@ -1,5 +1,6 @@
 import asyncio
 
+from app.const import DIAL_TIMEOUT_SECONDS
 from app.logging_config import get_logger
 from app.peer.peer import Peer
 from app.torrent_file import TorrentFile
@@ -14,5 +15,12 @@ def print_peer_id(filename: str, peer_str: str) -> str:  # noqa: WPS210
 
     ip, port = peer_str.split(":")
     peer = Peer(ip=ip, port=int(port), info_hash=torrent_file.info_hash)
-    peer_id = asyncio.run(peer.handshake())
+    peer_id = asyncio.run(_handshake(peer))
     return f"Peer ID: {peer_id}"
+
+
+async def _handshake(peer: Peer) -> str:
+    try:
+        return await asyncio.wait_for(peer.handshake(), DIAL_TIMEOUT_SECONDS)
+    finally:
+        await peer.close()
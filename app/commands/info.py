@@ -9,6 +9,10 @@ def print_info(filename: str) -> str:
     with open(filename, "rb") as file:
         content_bytes = file.read()
     torrent_file = TorrentFile.from_bytes(content_bytes)
+    return "\n".join(info_lines(torrent_file))
+
+
+def info_lines(torrent_file: TorrentFile) -> list[str]:
     result: list[str] = [
         f"Tracker URL: {torrent_file.announce}",
         f"Length: {torrent_file.length}",
@@ -17,4 +21,7 @@ def print_info(filename: str) -> str:
         "Piece Hashes:",
     ]
     result += list(map(hex20, torrent_file.piece_hashes))
-    return "\n".join(result)
+    if torrent_file.is_multi_file:
+        result.append("Files:")
+        result += [f"{entry.length} {'/'.join(entry.path)}" for entry in torrent_file.files]
+    return result
@@ -3,24 +3,29 @@ import asyncio
 from app.logging_config import get_logger
 from app.magnet_link import MagnetLink
 from app.peer.peer import Peer
+from app.peer.pool import PeerPool
+from app.tracker.announce import fetch_peers
 
 logger = get_logger(__name__)
 
 
-def print_magnet_peer_id(magnet: str) -> str:  # noqa: WPS210
-    magnet_link = MagnetLink(magnet)
-    peers = magnet_link.get_peers()
+def print_magnet_peer_id(magnet: str) -> str:
+    return "\n".join(asyncio.run(_magnet_handshakes(MagnetLink(magnet))))
+
+
+async def _magnet_handshakes(magnet_link: MagnetLink) -> list[str]:
+    """Handshake every peer of the magnet concurrently on one loop, each with its own timeout"""
+    peers = await fetch_peers(magnet_link.info_hash, magnet_link.tiers, left=1)
     logger.info(f"peers = {peers}")
+    pool = PeerPool(magnet_link.info_hash)
     result: list[str] = []
-    for ip, port in peers:
-        peer = Peer(
-            ip=ip,
-            port=int(port),
-            info_hash=magnet_link.info_hash,
-            extension_enabled=True,
-        )
-        peer_id = asyncio.run(peer.handshake())
-        result.append(f"Peer ID: {peer_id}")
-        if peer.extension_id is not None:
-            result.append(f"Peer Metadata Extension ID: {peer.extension_id}")
-    return "\n".join(result)
+    try:
+        for peer in await pool.dial_all(peers):
+            if not isinstance(peer, Peer):
+                continue
+            result.append(f"Peer ID: {pool.peer_id(peer.peername)}")
+            if peer.extension_id is not None:
+                result.append(f"Peer Metadata Extension ID: {peer.extension_id}")
+    finally:
+        await pool.close()
+    return result
@@ -1,4 +1,8 @@
+import asyncio
+
+from app.commands.info import info_lines
 from app.magnet_link import MagnetLink
+from app.peer.metadata import fetch_torrent_file
 
 
 def print_magnet_info(magnet: str) -> str:
@@ -8,3 +12,9 @@ def print_magnet_info(magnet: str) -> str:
         f"Info Hash: {magnet_link.info_hash_hex}",
     ]
     return "\n".join(result)
+
+
+def print_magnet_metadata(magnet: str) -> str:
+    magnet_link = MagnetLink(magnet)
+    torrent_file = asyncio.run(fetch_torrent_file(magnet_link.info_hash, magnet_link.tiers))
+    return "\n".join(info_lines(torrent_file))
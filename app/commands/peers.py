@@ -1,5 +1,8 @@
+import asyncio
+
 from app.logging_config import get_logger
 from app.torrent_file import TorrentFile
+from app.tracker.announce import fetch_peers
 
 logger = get_logger(__name__)
 
@@ -8,5 +11,7 @@ def print_peers(filename: str) -> str:  # noqa: WPS210
     with open(filename, "rb") as file:
         content_bytes = file.read()
     torrent_file = TorrentFile.from_bytes(content_bytes)
-    peers = torrent_file.get_peers()
+    peers = asyncio.run(
+        fetch_peers(torrent_file.info_hash, torrent_file.tiers, left=torrent_file.length)
+    )
     return "\n".join(f"{ip}:{port}" for ip, port in peers)
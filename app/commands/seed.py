@@ -0,0 +1,72 @@
+import asyncio
+
+from app.bitfield import Bitfield
+from app.exceptions import TrackerError
+from app.logging_config import get_logger
+from app.rate_limit import RateLimits, nested_bucket
+from app.recheck import verify_stream
+from app.seeding.block_cache import BlockCache
+from app.seeding.server import SeedServer
+from app.storage import FileReader
+from app.torrent_file import TorrentFile
+from app.tracker.announce import Announcer
+from app.tracker.models import AnnounceEvent, TransferStats
+
+logger = get_logger(__name__)
+
+
+def seed(torrent_filename: str, path: str, port: int, rates: RateLimits = RateLimits()) -> str:
+    with open(torrent_filename, "rb") as file:
+        content_bytes = file.read()
+    torrent_file = TorrentFile.from_bytes(content_bytes)
+    asyncio.run(_seed(torrent_file, path, port, rates))
+    return ""
+
+
+def _check(torrent_file: TorrentFile, reader: FileReader) -> Bitfield:
+    report = verify_stream(reader.read, torrent_file)
+    have = Bitfield(len(torrent_file.piece_hashes))
+    for piece_index in set(range(len(have))) - set(report.bad_pieces):
+        have.set(piece_index)
+    return have
+
+
+async def _seed(torrent_file: TorrentFile, path: str, port: int, rates: RateLimits) -> None:  # noqa: WPS210
+    files = torrent_file.files if torrent_file.is_multi_file else None
+    with FileReader(path, torrent_file.length, files) as reader:
+        if reader.mismatches:
+            logger.error(f"Not the files of the torrent: {reader.mismatches}")
+            raise NotImplementedError
+        have = _check(torrent_file, reader)
+        logger.info(f"Seeding {have.count} of {len(have)} pieces")
+        seed_server = SeedServer(
+            info_hash=torrent_file.info_hash,
+            have=have,
+            cache=BlockCache(reader.read, torrent_file.piece_length, torrent_file.piece_size),
+            piece_size=torrent_file.piece_size,
+            rate_limit=nested_bucket(None, rates.upload),
+            peer_rate=rates.peer,
+        )
+        await seed_server.start("0.0.0.0", port)  # noqa: S104
+        left = sum(
+            torrent_file.piece_size(piece_index)
+            for piece_index in range(len(have))
+            if not have[piece_index]
+        )
+        announcer = Announcer(
+            info_hash=torrent_file.info_hash,
+            tiers=torrent_file.tiers,
+            stats=lambda: TransferStats(uploaded=seed_server.uploaded, left=left),
+            on_peers=lambda _: None,
+            port=seed_server.port,
+        )
+        try:
+            first_delay = 0.0
+            try:
+                first_delay = (await announcer.announce(AnnounceEvent.STARTED)).next_announce
+            except (TrackerError, TimeoutError) as e:
+                logger.warning(f"Announce failed: {e}")
+            await announcer.run(first_delay)
+        finally:
+            await announcer.close()
+            await seed_server.close()
@@ -0,0 +1,28 @@
+from app.logging_config import get_logger
+from app.recheck import verify_stream
+from app.storage import FileReader
+from app.torrent_file import TorrentFile
+
+logger = get_logger(__name__)
+
+
+def print_verify(torrent_filename: str, path: str, workers: int) -> str:
+    with open(torrent_filename, "rb") as file:
+        content_bytes = file.read()
+    torrent_file = TorrentFile.from_bytes(content_bytes)
+    files = torrent_file.files if torrent_file.is_multi_file else None
+    result: list[str] = []
+    with FileReader(path, torrent_file.length, files) as reader:
+        result += [f"Size mismatch: {mismatch}" for mismatch in reader.mismatches]
+        report = verify_stream(reader.read, torrent_file, max_workers=workers)
+    piece_count = len(torrent_file.piece_hashes)
+    if report.bad_pieces:
+        result.append(f"Bad pieces ({len(report.bad_pieces)} of {piece_count}):")
+        result.append(" ".join(map(str, report.bad_pieces)))
+    else:
+        result.append(f"All {piece_count} pieces OK")
+    result.append(
+        f"Hashed {report.hashed_bytes / 1e6:.1f} MB in {report.seconds:.2f} s: "
+        + f"{report.megabytes_per_second:.1f} MB/s with {workers} workers"
+    )
+    return "\n".join(result)
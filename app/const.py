@@ -1,4 +1,4 @@
-from enum import IntEnum, StrEnum, auto
+from enum import IntEnum, StrEnum
 from typing import Awaitable, Callable
 
 
@@ -14,10 +14,15 @@ class Command(StrEnum):
     MAGNET_INFO = "magnet_info"
     MAGNET_DOWNLOAD_PIECE = "magnet_download_piece"
     MAGNET_DOWNLOADE = "magnet_download"
+    SEED = "seed"
+    VERIFY = "verify"
+    DAEMON = "daemon"
+    CTL = "ctl"
 
 
 class MessageType(IntEnum):
-    KEEPALIVE = auto()
+    # A message of length 0 has no id, this one is kept off the wire ids so UNCHOKE is not its alias
+    KEEPALIVE = -1
     CHOKE = 0
     UNCHOKE = 1
     INTERESTED = 2
@@ -44,5 +49,55 @@ BENCODE_END = b"e"
 PIECE_HASH_SIZE_BYTES = 20
 PEER_ID_SIZE_BYTES = 6
 BLOCK_SIZE_BYTES = 16 * 1024
+HANDSHAKE_SIZE_BYTES = 1 + len(BITTORRENT_PROTOCOL) + 8 + 20 + 20
+RECEIVE_CHUNK_BYTES = 256 * 1024
 
-MAX_CONCURRENT_REQUESTS = 5
+MIN_CONCURRENT_REQUESTS = 2
+INITIAL_CONCURRENT_REQUESTS = 5
+MAX_CONCURRENT_REQUESTS = 500
+
+LISTEN_PORT = 6881
+TRACKER_TIMEOUT_SECONDS = 10
+DEFAULT_ANNOUNCE_INTERVAL_SECONDS = 30 * 60
+TRACKER_RETRY_SECONDS = 15
+UDP_TRACKER_RETRY_SECONDS = 3
+UDP_TRACKER_ATTEMPTS = 4
+UDP_CONNECTION_ID_SECONDS = 60
+
+MAX_ACTIVE_PEERS = 30
+MAX_CONCURRENT_DIALS = 8
+DIAL_TIMEOUT_SECONDS = 10
+PEER_BACKOFF_SECONDS = 5
+MAX_PEER_BACKOFF_SECONDS = 10 * 60
+PEER_REPLACE_SECONDS = 30
+
+UPLOAD_SLOTS = 4
+RECHOKE_SECONDS = 10
+OPTIMISTIC_UNCHOKE_ROUNDS = 3
+BLOCK_CACHE_BYTES = 32 * 1024 * 1024
+MAX_REQUEST_BYTES = 128 * 1024
+# A bitfield this size covers 8M pieces, far beyond any torrent in use
+MAX_BITFIELD_BYTES = 1024 * 1024
+# Message id, piece index and offset ahead of the largest block, or a bitfield
+MAX_MESSAGE_BYTES = 1 + max(8 + MAX_REQUEST_BYTES, MAX_BITFIELD_BYTES)
+
+RESUME_SUFFIX = ".resume"
+RESUME_SAVE_SECONDS = 5
+VERIFY_READ_BYTES = 16 * 1024 * 1024
+MAX_OPEN_FILES = 64
+STDOUT_OUTPUT = "-"
+STREAM_WRITE_BYTES = 4 * 1024 * 1024
+SEQUENTIAL_WINDOW_PIECES = 16
+SEQUENTIAL_RAREST_EVERY = 4
+PIECE_DEADLINE_SECONDS = 2
+RANGE_SERVER_CHUNK_BYTES = 256 * 1024
+DAEMON_MAX_PEERS = 500
+DAEMON_SOCKET = "torrent-daemon.sock"
+
+UT_METADATA_ID = 1
+UT_PEX_ID = 2
+CLIENT_VERSION = "natalka112 0.1"
+METADATA_PIECE_BYTES = 16 * 1024
+MAX_METADATA_BYTES = 8 * 1024 * 1024
+METADATA_REQUESTS_PER_PEER = 4
+METADATA_TIMEOUT_SECONDS = 10
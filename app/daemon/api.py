@@ -0,0 +1,99 @@
+import asyncio
+import json
+import os
+from typing import Any, Optional
+
+from app.exceptions import DaemonError
+from app.daemon.session import Session
+from app.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+Message = dict[str, Any]
+
+
+class ControlServer:
+    """Local JSON API of a session on a Unix socket, one request and one reply per line.
+
+    A request is {"command": "add", "torrent": path} with optional "output" path and
+    "download_rate" in bytes per second, {"command": "remove", "info_hash": hex} or
+    {"command": "status"}; the reply is {"ok": true, ...} or {"ok": false, "error": reason}.
+    """
+
+    def __init__(self, session: Session, path: str) -> None:
+        self._session = session
+        self._path = path
+        self._server: Optional[asyncio.Server] = None
+
+    async def start(self) -> None:
+        if os.path.exists(self._path):
+            # Left behind by a daemon that did not shut down
+            os.unlink(self._path)
+        self._server = await asyncio.start_unix_server(self._serve, self._path)
+        os.chmod(self._path, 0o600)
+        logger.info(f"Daemon: listening on {self._path}")
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while line := await reader.readline():
+                writer.write(json.dumps(await self._reply(line)).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError as e:
+            logger.debug(f"Daemon: client gone: {e}")
+        finally:
+            writer.close()
+
+    async def _reply(self, line: bytes) -> Message:
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise DaemonError("A request is a JSON object")
+            return {"ok": True, **await self._handle(request)}
+        except json.JSONDecodeError as e:
+            return {"ok": False, "error": f"Not JSON: {e}"}
+        except DaemonError as e:
+            return {"ok": False, "error": str(e)}
+
+    async def _handle(self, request: Message) -> Message:
+        match request.get("command"):  # noqa: WPS242
+            case "add":
+                torrent = request.get("torrent")
+                if not isinstance(torrent, str):
+                    raise DaemonError("add needs the torrent file path")
+                output = request.get("output")
+                if output is not None and (not isinstance(output, str) or not output):
+                    raise DaemonError("output is a file path")
+                rate = request.get("download_rate")
+                if rate is not None and not _is_rate(rate):
+                    raise DaemonError("download_rate is a positive number of bytes per second")
+                return {"info_hash": self._session.add(torrent, output, rate)}
+            case "remove":
+                await self._session.remove(str(request.get("info_hash")))
+                return {}
+            case "status":
+                return {"torrents": self._session.status()}
+            case command:
+                raise DaemonError(f"Unknown command {command}")
+
+
+def _is_rate(value: Any) -> bool:
+    # bool is an int subclass, true must not pass for one byte per second
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
+
+
+async def send_request(path: str, request: Message) -> Message:
+    """Send one request to the daemon listening on path and return its reply"""
+    reader, writer = await asyncio.open_unix_connection(path)
+    try:
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+        return json.loads(await reader.readline())
+    finally:
+        writer.close()
@@ -0,0 +1,137 @@
+import asyncio
+import os
+from dataclasses import dataclass
+from enum import StrEnum
+from typing import Any, Optional
+
+from app.commands.download import _download  # noqa: WPS450
+from app.exceptions import DaemonError, NeedMoreBytesError, WrongBencodeFormatError
+from app.logging_config import get_logger
+from app.pieces import Pieces
+from app.rate_limit import RateLimits
+from app.shared import SharedResources
+from app.torrent_file import TorrentFile, is_safe_path_part
+
+logger = get_logger(__name__)
+
+
+class TorrentState(StrEnum):
+    DOWNLOADING = "downloading"
+    DONE = "done"
+    FAILED = "failed"
+
+
+@dataclass
+class _Torrent:
+    torrent_file: TorrentFile
+    output: str
+    task: Optional[asyncio.Task[None]] = None
+    pieces: Optional[Pieces] = None
+    state: TorrentState = TorrentState.DOWNLOADING
+    error: Optional[str] = None
+
+    def attach(self, pieces: Pieces) -> None:
+        self.pieces = pieces
+
+
+class Session:
+    """Torrents downloading side by side on one event loop, drawing on shared resources.
+
+    Each torrent is the task of a regular download, so it resumes and rechecks as the
+    download command does. Removing a torrent cancels that task, which keeps the part
+    and resume files for a later add.
+    """
+
+    def __init__(self, directory: str, shared: SharedResources, peer_rate: Optional[float] = None) -> None:
+        self._directory = directory
+        self._shared = shared
+        self._peer_rate = peer_rate
+        self._torrents: dict[str, _Torrent] = dict()
+
+    def add(
+        self, torrent_filename: str, output: Optional[str] = None, download_rate: Optional[float] = None
+    ) -> str:
+        """Start downloading a torrent file, its info hash in hex identifies it from then on.
+
+        A download rate limits this torrent within the global budget of the session.
+        """
+        try:
+            with open(torrent_filename, "rb") as file:
+                torrent_file = TorrentFile.from_bytes(file.read())
+        except OSError as e:
+            raise DaemonError(f"Cannot read {torrent_filename}: {e}") from e
+        except (NeedMoreBytesError, WrongBencodeFormatError, NotImplementedError, ValueError) as e:
+            raise DaemonError(f"{torrent_filename} is not a torrent file: {type(e).__name__} {e}") from e
+        info_hash = torrent_file.info_hash.hex()
+        if info_hash in self._torrents:
+            raise DaemonError(f"{info_hash} is already added")
+        if output is None and not is_safe_path_part(torrent_file.name):
+            raise DaemonError(f"Torrent name {torrent_file.name!r} is not a file name, give an output")
+        output_file = output or os.path.join(self._directory, torrent_file.name)
+        if any(torrent.output == output_file for torrent in self._torrents.values()):
+            raise DaemonError(f"{output_file} is the output of another torrent")
+        torrent = _Torrent(torrent_file=torrent_file, output=output_file)
+        torrent.task = asyncio.create_task(
+            _download(
+                output_file,
+                torrent_file,
+                shared=self._shared,
+                on_pieces=torrent.attach,
+                rates=RateLimits(download=download_rate, peer=self._peer_rate),
+            ),
+            name=f"download {info_hash}",
+        )
+        torrent.task.add_done_callback(lambda task: self._finished(torrent, task))
+        self._torrents[info_hash] = torrent
+        logger.info(f"Daemon: added {torrent_file.name} as {info_hash} into {output_file}")
+        return info_hash
+
+    async def remove(self, info_hash: str) -> None:
+        torrent = self._torrents.pop(info_hash, None)
+        if torrent is None:
+            raise DaemonError(f"No torrent {info_hash}")
+        if torrent.task is not None:
+            torrent.task.cancel()
+            await asyncio.gather(torrent.task, return_exceptions=True)
+        logger.info(f"Daemon: removed {info_hash} in state {torrent.state}")
+
+    def status(self) -> list[dict[str, Any]]:
+        return [self._status(info_hash, torrent) for info_hash, torrent in self._torrents.items()]
+
+    async def close(self) -> None:
+        for info_hash in list(self._torrents):
+            await self.remove(info_hash)
+
+    def _finished(self, torrent: _Torrent, task: asyncio.Task[None]) -> None:
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is None:
+            torrent.state = TorrentState.DONE
+            logger.info(f"Daemon: {torrent.torrent_file.name} is complete")
+            return
+        torrent.state = TorrentState.FAILED
+        torrent.error = f"{type(error).__name__} {error}"
+        logger.warning(f"Daemon: {torrent.torrent_file.name} failed: {torrent.error}")
+
+    def _status(self, info_hash: str, torrent: _Torrent) -> dict[str, Any]:
+        pieces = torrent.pieces
+        piece_count = len(torrent.torrent_file.piece_hashes)
+        if torrent.state == TorrentState.DONE:
+            verified, left = piece_count, 0
+        elif pieces is None:
+            verified, left = 0, torrent.torrent_file.length
+        else:
+            verified, left = pieces.verified.count, pieces.left
+        return {
+            "info_hash": info_hash,
+            "name": torrent.torrent_file.name,
+            "output": torrent.output,
+            "state": str(torrent.state),
+            "pieces": piece_count,
+            "verified": verified,
+            "left": left,
+            "downloaded": pieces.downloaded if pieces is not None else 0,
+            "peers": pieces.peers if pieces is not None and torrent.state == TorrentState.DOWNLOADING else 0,
+            "error": torrent.error,
+        }
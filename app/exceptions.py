@@ -20,3 +20,19 @@ class WrongPacketFormatError(Exception):
 
 class PeerCommunicationError(Exception):
     """PeerCommunicationError"""
+
+
+class TrackerError(Exception):
+    """TrackerError"""
+
+
+class MetadataError(Exception):
+    """MetadataError"""
+
+
+class RangeNotSatisfiableError(Exception):
+    """RangeNotSatisfiableError"""
+
+
+class DaemonError(Exception):
+    """DaemonError"""
@@ -0,0 +1,56 @@
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass
+from itertools import accumulate
+from typing import Iterator
+
+from app.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class FileSegment:
+    file_index: int
+    file_offset: int
+    length: int
+
+
+class FileSpanIndex:
+    """Maps a byte range of the concatenated torrent data to the files it lies in.
+
+    File start offsets are kept in a sorted array, so finding the first file of a range
+    is one bisect, and the rest of the range walks forward from there.
+    """
+
+    def __init__(self, lengths: list[int]) -> None:
+        self._lengths = array("q", lengths)
+        self._starts = array("q", accumulate(lengths, initial=0))
+        self._total = self._starts.pop()
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    @property
+    def total(self) -> int:
+        return self._total
+
+    def start(self, file_index: int) -> int:
+        return self._starts[file_index]
+
+    def segments(self, offset: int, length: int) -> Iterator[FileSegment]:
+        """Pieces of [offset, offset + length) in file order, empty files are skipped"""
+        if offset < 0 or length < 0 or offset + length > self._total:
+            logger.error(f"offset = {offset} length = {length} total = {self._total}")
+            raise NotImplementedError
+        # The last file starting at or before offset; empty files share their start
+        # with the next one, so bisect_right steps over them
+        file_index = bisect_right(self._starts, offset) - 1
+        while length > 0:
+            file_offset = offset - self._starts[file_index]
+            taken = min(length, self._lengths[file_index] - file_offset)
+            if taken > 0:
+                yield FileSegment(file_index=file_index, file_offset=file_offset, length=taken)
+                offset += taken
+                length -= taken
+            file_index += 1
@@ -1,15 +1,25 @@
 import argparse
+import os
 import sys
 
+from app.commands.daemon import control, daemon
 from app.commands.decode import print_decode
-from app.commands.download import download, download_piece
+from app.commands.download import (
+    download,
+    download_piece,
+    magnet_download,
+    magnet_download_piece,
+)
 from app.commands.handshake import print_peer_id
 from app.commands.info import print_info
 from app.commands.magnet_handshake import print_magnet_peer_id
-from app.commands.magnet_info import print_magnet_info
+from app.commands.magnet_info import print_magnet_info, print_magnet_metadata
 from app.commands.peers import print_peers
-from app.const import Command
+from app.commands.seed import seed
+from app.commands.verify import print_verify
+from app.const import DAEMON_MAX_PEERS, DAEMON_SOCKET, LISTEN_PORT, STDOUT_OUTPUT, Command
 from app.logging_config import get_logger, setup_logging
+from app.rate_limit import RateLimits
 
 setup_logging(level="DEBUG", console_logs_target=sys.stderr)
 
@@ -38,12 +48,31 @@ def parse_args() -> argparse.Namespace:  # noqa: WPS213
     subparser.add_argument("peer", help="PeerIP:Port")
 
     subparser = subparsers.add_parser(Command.DOWNLOAD_PIECE, help="Download a piece")
-    subparser.add_argument("-o", "--output", required=True, help="Output piece path")
+    subparser.add_argument("-o", "--output", required=True, help="Output piece path, - for stdout")
     subparser.add_argument("torrent_file", help="Torrent file to work with")
     subparser.add_argument("piece_index", type=int, help="Piece index")
 
     subparser = subparsers.add_parser(Command.DOWNLOAD, help="Download the whole file")
-    subparser.add_argument("-o", "--output", required=True, help="Output file path")
+    subparser.add_argument("-o", "--output", required=True, help="Output file path, - for stdout")
+    subparser.add_argument(
+        "--recheck", action="store_true", help="Hash the partial file instead of trusting the resume file"
+    )
+    subparser.add_argument(
+        "--sequential", action="store_true", help="Download pieces mostly in order, for playback"
+    )
+    subparser.add_argument(
+        "--serve",
+        type=int,
+        metavar="PORT",
+        help="Serve the file over HTTP on localhost while it downloads, implies --sequential",
+    )
+    subparser.add_argument(
+        "--download-rate", type=float, metavar="BYTES_PER_S", help="Cap on the download rate"
+    )
+    subparser.add_argument("--upload-rate", type=float, metavar="BYTES_PER_S", help="Cap on the upload rate")
+    subparser.add_argument(
+        "--peer-rate", type=float, metavar="BYTES_PER_S", help="Cap on each connection, in each direction"
+    )
     subparser.add_argument("torrent_file", help="Torrent file to work with")
 
     subparser = subparsers.add_parser(Command.MAGNET_PARSE, help="Parse magnet link")
@@ -54,6 +83,68 @@ def parse_args() -> argparse.Namespace:  # noqa: WPS213
     )
     subparser.add_argument("magnet_link", help="Magnet-link to work with")
 
+    subparser = subparsers.add_parser(
+        Command.MAGNET_INFO, help="Fetch the torrent info of a magnet link from peers"
+    )
+    subparser.add_argument("magnet_link", help="Magnet-link to work with")
+
+    subparser = subparsers.add_parser(
+        Command.MAGNET_DOWNLOAD_PIECE, help="Download a piece of a magnet link"
+    )
+    subparser.add_argument("-o", "--output", required=True, help="Output piece path, - for stdout")
+    subparser.add_argument("magnet_link", help="Magnet-link to work with")
+    subparser.add_argument("piece_index", type=int, help="Piece index")
+
+    subparser = subparsers.add_parser(
+        Command.MAGNET_DOWNLOADE, help="Download the whole file of a magnet link"
+    )
+    subparser.add_argument("-o", "--output", required=True, help="Output file path, - for stdout")
+    subparser.add_argument("magnet_link", help="Magnet-link to work with")
+
+    subparser = subparsers.add_parser(Command.SEED, help="Seed a downloaded file")
+    subparser.add_argument("--port", type=int, default=LISTEN_PORT, help="Port to listen on")
+    subparser.add_argument("--upload-rate", type=float, metavar="BYTES_PER_S", help="Cap on the upload rate")
+    subparser.add_argument(
+        "--peer-rate", type=float, metavar="BYTES_PER_S", help="Cap on the upload rate of each connection"
+    )
+    subparser.add_argument("torrent_file", help="Torrent file to work with")
+    subparser.add_argument("path", help="Path of the complete file")
+
+    subparser = subparsers.add_parser(Command.VERIFY, help="Check a file against the piece hashes")
+    subparser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="Hashing threads"
+    )
+    subparser.add_argument("torrent_file", help="Torrent file to work with")
+    subparser.add_argument("path", help="Path of the file to check")
+
+    subparser = subparsers.add_parser(
+        Command.DAEMON, help="Download many torrents at once, controlled through a Unix socket"
+    )
+    subparser.add_argument("--socket", default=DAEMON_SOCKET, help="Path of the control socket")
+    subparser.add_argument("--dir", default=".", help="Directory torrents download into by default")
+    subparser.add_argument(
+        "--max-peers", type=int, default=DAEMON_MAX_PEERS, help="Connections across all torrents"
+    )
+    subparser.add_argument(
+        "--download-rate", type=float, metavar="BYTES_PER_S", help="Download budget across all torrents"
+    )
+    subparser.add_argument(
+        "--peer-rate", type=float, metavar="BYTES_PER_S", help="Cap on the download rate of each connection"
+    )
+
+    subparser = subparsers.add_parser(Command.CTL, help="Send a command to a running daemon")
+    subparser.add_argument("--socket", default=DAEMON_SOCKET, help="Path of the control socket")
+    actions = subparser.add_subparsers(dest="action", required=True)
+    action = actions.add_parser("add", help="Start downloading a torrent")
+    action.add_argument("-o", "--output", help="Output path, default the torrent name in --dir")
+    action.add_argument(
+        "--download-rate", type=float, metavar="BYTES_PER_S", help="Cap on this torrent within the budget"
+    )
+    action.add_argument("torrent", help="Torrent file to work with")
+    action = actions.add_parser("remove", help="Stop a torrent, its part file is kept")
+    action.add_argument("info_hash", help="Info hash in hex, as add and status print it")
+    actions.add_parser("status", help="Progress of every torrent")
+
     return parser.parse_args()
 
 
@@ -72,15 +163,42 @@ def main() -> None:
             download_piece(args.output, args.torrent_file, args.piece_index)
             result = ""
         case Command.DOWNLOAD:
-            download(args.output, args.torrent_file)
+            download(
+                args.output,
+                args.torrent_file,
+                recheck=args.recheck,
+                sequential=args.sequential,
+                serve_port=args.serve,
+                rates=RateLimits(download=args.download_rate, upload=args.upload_rate, peer=args.peer_rate),
+            )
             result = ""
         case Command.MAGNET_PARSE:
             result = print_magnet_info(args.magnet_link)
         case Command.MAGNET_HANDSHAKE:
             result = print_magnet_peer_id(args.magnet_link)
+        case Command.MAGNET_INFO:
+            result = print_magnet_metadata(args.magnet_link)
+        case Command.MAGNET_DOWNLOAD_PIECE:
+            result = magnet_download_piece(args.output, args.magnet_link, args.piece_index)
+        case Command.MAGNET_DOWNLOADE:
+            result = magnet_download(args.output, args.magnet_link)
+        case Command.SEED:
+            rates = RateLimits(upload=args.upload_rate, peer=args.peer_rate)
+            result = seed(args.torrent_file, args.path, args.port, rates)
+        case Command.VERIFY:
+            result = print_verify(args.torrent_file, args.path, args.workers)
+        case Command.DAEMON:
+            result = daemon(args.socket, args.dir, args.max_peers, args.download_rate, args.peer_rate)
+        case Command.CTL:
+            request = {key: value for key, value in vars(args).items() if key not in {"command", "socket"}}
+            request["command"] = request.pop("action")
+            result = control(args.socket, request)
         case _:
             logger.error(f"Not implemented command = {args.command}")
             return
+    if getattr(args, "output", None) == STDOUT_OUTPUT:
+        # stdout carried the downloaded data
+        return
     sys.stdout.write(result)
     sys.stdout.write("\n")
 
@@ -0,0 +1,87 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable
+
+from app.bitfield import Bitfield
+from app.const import STREAM_WRITE_BYTES
+from app.logging_config import get_logger
+from app.torrent_file import TorrentFile
+
+logger = get_logger(__name__)
+
+Reader = Callable[[int, int], bytes]
+
+
+class OrderedWriter:
+    """Writes verified pieces to a stream in piece order while the download goes on.
+
+    The watermark is the first piece not written yet: a piece verified past it waits
+    until every piece before it is verified too. Each run of contiguous verified pieces,
+    up to write_bytes, is read back from storage and written on a worker thread, so a
+    slow reader of the stream holds back the writer but not the event loop.
+    """
+
+    def __init__(
+        self,
+        read: Reader,
+        torrent_file: TorrentFile,
+        sink: BinaryIO,
+        pieces: range,
+        write_bytes: int = STREAM_WRITE_BYTES,
+    ) -> None:
+        self._read = read
+        self._torrent_file = torrent_file
+        self._sink = sink
+        self._pieces = pieces
+        self._write_bytes = write_bytes
+        self._verified = Bitfield(len(torrent_file.piece_hashes))
+        self._watermark = pieces.start
+        self._written = 0
+        self._changed = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stream")
+
+    @property
+    def watermark(self) -> int:
+        return self._watermark
+
+    @property
+    def written(self) -> int:
+        """Bytes written to the stream so far"""
+        return self._written
+
+    def piece_verified(self, piece_index: int) -> None:
+        self._verified.set(piece_index)
+        if piece_index == self._watermark:
+            self._changed.set()
+
+    async def run(self) -> None:
+        """Write pieces as the watermark advances, return once the last one is written"""
+        loop = asyncio.get_running_loop()
+        try:
+            while self._watermark < self._pieces.stop:
+                if not self._verified[self._watermark]:
+                    await self._changed.wait()
+                    self._changed.clear()
+                    continue
+                end = self._run_end()
+                self._written += await loop.run_in_executor(self._executor, self._write, self._watermark, end)
+                self._watermark = end
+                logger.debug(f"Stream: {self._written} bytes, watermark at piece {end}")
+        finally:
+            # Not waited for: a write still running would block the event loop until done
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run_end(self) -> int:
+        end = self._watermark
+        size = 0
+        while end < self._pieces.stop and self._verified[end] and size < self._write_bytes:
+            size += self._torrent_file.piece_size(end)
+            end += 1
+        return end
+
+    def _write(self, start: int, end: int) -> int:
+        offset = (start - self._pieces.start) * self._torrent_file.piece_length
+        length = sum(map(self._torrent_file.piece_size, range(start, end)))
+        self._sink.write(self._read(offset, length))
+        self._sink.flush()
+        return length
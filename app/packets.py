@@ -1,17 +1,26 @@
+import struct
 from abc import abstractmethod
-from dataclasses import dataclass
-from typing import final
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Optional, final
 
-from app.bencode import Dict, Integer
+from app.bencode import BencodeAny, Dict, Integer, String
 from app.const import (
     BITTORRENT_PROTOCOL,
     BLOCK_SIZE_BYTES,
+    HANDSHAKE_SIZE_BYTES,
     MessageType,
     StreamExactly,
 )
-from app.exceptions import NeedMoreBytesError, WrongPacketFormatError
+from app.exceptions import (
+    NeedMoreBytesError,
+    TrackerError,
+    WrongBencodeFormatError,
+    WrongPacketFormatError,
+)
 from app.logging_config import get_logger
 from app.service_func import hex20
+from app.tracker.models import PeerAddress, read_compact_peers
 
 logger = get_logger(__name__)
 
@@ -35,7 +44,7 @@ class Payload:
 
     @classmethod
     @abstractmethod
-    def from_bytes(cls, raw_data: bytes) -> "Payload": ...
+    def from_bytes(cls, raw_data: bytes | memoryview) -> "Payload": ...
 
 
 @dataclass
@@ -74,22 +83,24 @@ class HandshakePacket(Packet):
         return hex20(self.peer_id_bytes)
 
     @classmethod
-    async def from_stream(  # noqa: WPS210
-        cls, reader: StreamExactly
-    ) -> "HandshakePacket":
+    async def from_stream(cls, reader: StreamExactly) -> "HandshakePacket":
         protocol_str_length: int = (await reader(1))[0]
         if protocol_str_length != len(BITTORRENT_PROTOCOL):
             raise WrongPacketFormatError
-        protocol_str = await reader(protocol_str_length)
-        if protocol_str != BITTORRENT_PROTOCOL:
+        return cls.from_bytes(bytes([protocol_str_length]) + await reader(HANDSHAKE_SIZE_BYTES - 1))
+
+    @classmethod
+    def from_bytes(cls, raw_data: bytes | memoryview) -> "HandshakePacket":
+        if len(raw_data) != HANDSHAKE_SIZE_BYTES:
+            raise NeedMoreBytesError
+        protocol_end = 1 + len(BITTORRENT_PROTOCOL)
+        if raw_data[0] != len(BITTORRENT_PROTOCOL) or raw_data[1:protocol_end] != BITTORRENT_PROTOCOL:
             raise WrongPacketFormatError
-        reserved_bytes = await reader(8)
+        reserved_bytes = raw_data[protocol_end : protocol_end + 8]
         extension_enabled = (reserved_bytes[5] & 0x10) != 0
-        info_hash = await reader(20)
-        peer_id_bytes = await reader(20)
         return HandshakePacket(
-            info_hash=info_hash,
-            peer_id_bytes=peer_id_bytes,
+            info_hash=bytes(raw_data[protocol_end + 8 : protocol_end + 28]),
+            peer_id_bytes=bytes(raw_data[protocol_end + 28 : protocol_end + 48]),
             extension_enabled=extension_enabled,
         )
 
@@ -97,7 +108,7 @@ class HandshakePacket(Packet):
 @dataclass
 class PeerPacket(Packet):
     message_type: MessageType
-    payload: bytes = b""
+    payload: bytes | memoryview = b""
 
     @property
     def to_bytes(self) -> bytes:
@@ -105,28 +116,42 @@ class PeerPacket(Packet):
         return len(result).to_bytes(4) + result
 
     @classmethod
-    async def from_stream(cls, reader: StreamExactly) -> "PeerPacket":  # noqa: WPS231
+    async def from_stream(cls, reader: StreamExactly) -> "PeerPacket":
         length = int.from_bytes(await reader(4))
         if length == 0:
             return KeepAlivePacket()
         message_type_int = (await reader(1))[0]
-        try:
-            message_type = MessageType(message_type_int)
-        except ValueError:
-            logger.error(f"message_type_int = {message_type_int}")
-            raise WrongPacketFormatError
-        if message_type == MessageType.REQUEST:
-            result_type: type[PeerPacket] = RequestPeerPacket
-        elif message_type == MessageType.PIECE:
-            result_type = PiecePeerPacket
-        elif message_type == MessageType.KEEPALIVE:
-            result_type = KeepAlivePacket
-        elif message_type == MessageType.EXTENDED:
-            result_type = ExtendedPacket
-        else:
-            result_type = PeerPacket
+        message_type = _message_type(message_type_int)
         payload = await reader(length - 1)
-        return result_type(message_type=message_type, payload=payload)
+        return _packet_type(message_type)(message_type=message_type, payload=payload)
+
+    @classmethod
+    def from_buffer(cls, message: memoryview) -> "PeerPacket":
+        """Build a packet from one message without its length prefix, payload is not copied"""
+        if len(message) == 0:
+            return KeepAlivePacket()
+        message_type = _message_type(message[0])
+        return _packet_type(message_type)(message_type=message_type, payload=message[1:])
+
+
+def _message_type(message_type_int: int) -> MessageType:
+    try:
+        return MessageType(message_type_int)
+    except ValueError:
+        logger.error(f"message_type_int = {message_type_int}")
+        raise WrongPacketFormatError
+
+
+def _packet_type(message_type: MessageType) -> type[PeerPacket]:
+    if message_type == MessageType.REQUEST:
+        return RequestPeerPacket
+    if message_type == MessageType.PIECE:
+        return PiecePeerPacket
+    if message_type == MessageType.KEEPALIVE:
+        return KeepAlivePacket
+    if message_type == MessageType.EXTENDED:
+        return ExtendedPacket
+    return PeerPacket
 
 
 @dataclass
@@ -134,6 +159,10 @@ class PeerPacket(Packet):
 class KeepAlivePacket(PeerPacket):
     message_type: MessageType = MessageType.KEEPALIVE
 
+    @property
+    def to_bytes(self) -> bytes:
+        return bytes(4)
+
     @classmethod
     async def from_stream(cls, reader: StreamExactly) -> "KeepAlivePacket":
         return KeepAlivePacket()
@@ -166,7 +195,7 @@ class RequestPayload(Payload):
         return self.offset // BLOCK_SIZE_BYTES
 
     @classmethod
-    def from_bytes(cls, raw_data: bytes) -> "RequestPayload":
+    def from_bytes(cls, raw_data: bytes | memoryview) -> "RequestPayload":
         if len(raw_data) != 12:
             raise NeedMoreBytesError
         piece_index = int.from_bytes(raw_data[:4])
@@ -188,12 +217,30 @@ class RequestPeerPacket(PeerPacket):
         return f"RequestPeerPacket(message_type={self.message_type}, parsed_payload={self.parsed_payload})"
 
 
+# Length prefix, message type, piece index, offset, length of a REQUEST or CANCEL
+_REQUEST_MESSAGE = struct.Struct(">IBIII")
+
+
+def pack_request_into(  # noqa: WPS211
+    buffer: bytearray, position: int, message_type: MessageType, piece_index: int, offset: int, length: int
+) -> int:
+    """Write a whole REQUEST or CANCEL message at position, growing the buffer if needed.
+
+    Returns the position after it, so a batch of requests packs into one reused buffer.
+    """
+    end = position + _REQUEST_MESSAGE.size
+    if len(buffer) < end:
+        buffer.extend(bytes(end - len(buffer)))
+    _REQUEST_MESSAGE.pack_into(buffer, position, _REQUEST_MESSAGE.size - 4, message_type, piece_index, offset, length)
+    return end
+
+
 @dataclass
 @final
 class PiecePayload(Payload):
     piece_index: int
     offset: int
-    block: bytes
+    block: bytes | memoryview
 
     def __repr__(self) -> str:
         return f"PiecePayload(piece_index={self.piece_index}, block_index={self.block_index}, len = {len(self.block)}"
@@ -214,7 +261,7 @@ class PiecePayload(Payload):
         return piece_index_bytes + offset_bytes + self.block
 
     @classmethod
-    def from_bytes(cls, raw_data: bytes) -> "PiecePayload":
+    def from_bytes(cls, raw_data: bytes | memoryview) -> "PiecePayload":
         piece_index = int.from_bytes(raw_data[:4])
         offset = int.from_bytes(raw_data[4:8])
         return PiecePayload(piece_index=piece_index, offset=offset, block=raw_data[8:])
@@ -236,32 +283,139 @@ class PiecePeerPacket(PeerPacket):
 @dataclass
 @final
 class ExtendedPayload(Payload):
-    ut_metadata: int
+    """The extension handshake (BEP 10): extension names to message ids plus peer details"""
+
+    extensions: dict[str, int] = field(default_factory=dict)
+    metadata_size: Optional[int] = None
+    reqq: Optional[int] = None
+    client: Optional[str] = None
+
+    @property
+    def ut_metadata(self) -> Optional[int]:
+        return self.extensions.get("ut_metadata")
+
+    @property
+    def to_bytes(self) -> bytes:
+        fields: dict[str, BencodeAny] = {
+            "m": Dict({name: Integer(message_id) for name, message_id in self.extensions.items()})
+        }
+        if self.metadata_size is not None:
+            fields["metadata_size"] = Integer(self.metadata_size)
+        if self.reqq is not None:
+            fields["reqq"] = Integer(self.reqq)
+        if self.client is not None:
+            fields["v"] = String(self.client.encode())
+        return b"".join([b"\x00", Dict(fields).to_bytes])
+
+    @classmethod
+    def from_bytes(cls, raw_data: bytes | memoryview) -> "ExtendedPayload":
+        if not raw_data or raw_data[0] != 0:
+            raise WrongPacketFormatError
+        try:
+            _, handshake = Dict.from_bytes(bytes(raw_data[1:]))
+        except (NeedMoreBytesError, WrongBencodeFormatError, UnicodeDecodeError):
+            raise WrongPacketFormatError
+        m_dict = handshake.data.get("m")
+        # Id 0 disables an extension; unknown keys and value types are ignored as BEP 10 asks
+        extensions = {
+            name: message_id.data
+            for name, message_id in (m_dict.data.items() if isinstance(m_dict, Dict) else ())
+            if isinstance(message_id, Integer) and 0 < message_id.data < 256
+        }
+        client = handshake.data.get("v")
+        return ExtendedPayload(
+            extensions=extensions,
+            metadata_size=_positive(handshake.data.get("metadata_size")),
+            reqq=_positive(handshake.data.get("reqq")),
+            client=client.data.decode(errors="replace") if isinstance(client, String) else None,
+        )
+
+
+def _positive(value: Optional[BencodeAny]) -> Optional[int]:
+    if isinstance(value, Integer) and value.data > 0:
+        return value.data
+    return None
+
+
+@dataclass
+@final
+class PexPayload(Payload):
+    """A ut_pex message (BEP 11) after its extended message id, IPv4 peers only"""
+
+    added: list[PeerAddress] = field(default_factory=list)
+    dropped: list[PeerAddress] = field(default_factory=list)
+
+    @property
+    def to_bytes(self) -> bytes:
+        return Dict({"added": String(_compact(self.added)), "dropped": String(_compact(self.dropped))}).to_bytes
+
+    @classmethod
+    def from_bytes(cls, raw_data: bytes | memoryview) -> "PexPayload":
+        try:
+            _, message = Dict.from_bytes(bytes(raw_data))
+        except (NeedMoreBytesError, WrongBencodeFormatError, UnicodeDecodeError):
+            raise WrongPacketFormatError
+        added = message.data.get("added")
+        dropped = message.data.get("dropped")
+        try:
+            return PexPayload(
+                added=read_compact_peers(added.data) if isinstance(added, String) else [],
+                dropped=read_compact_peers(dropped.data) if isinstance(dropped, String) else [],
+            )
+        except TrackerError:
+            raise WrongPacketFormatError
+
+
+def _compact(peers: list[PeerAddress]) -> bytes:
+    return b"".join(bytes(map(int, ip.split("."))) + port.to_bytes(2) for ip, port in peers)
+
+
+class MetadataMessageType(IntEnum):
+    REQUEST = 0
+    DATA = 1
+    REJECT = 2
+
+
+@dataclass
+@final
+class MetadataPayload(Payload):
+    """A ut_metadata message (BEP 9) after its extended message id, data follows the dict"""
+
+    msg_type: MetadataMessageType
+    piece: int
+    total_size: Optional[int] = None
+    data: bytes | memoryview = b""
 
     @property
     def to_bytes(self) -> bytes:
-        result = Dict({"m": Dict({"ut_metadata": Integer(1)})})
-        return b"".join([b"\x00", result.to_bytes])
+        fields: dict[str, BencodeAny] = {"msg_type": Integer(self.msg_type), "piece": Integer(self.piece)}
+        if self.total_size is not None:
+            fields["total_size"] = Integer(self.total_size)
+        return Dict(fields).to_bytes + self.data
 
     @classmethod
-    def from_bytes(cls, raw_data: bytes) -> "ExtendedPayload":  # noqa: WPS238
-        logger.error(f"raw_data = {raw_data!r}")
-        if raw_data[0] != 0:
-            logger.error(f"raw_data = {raw_data!r}")
-            raise NotImplementedError
-        remainder, m_dict = Dict.from_bytes(raw_data[1:])
-        if len(remainder) > 0:
-            logger.error(f"raw_data = {raw_data!r}")
-            raise NotImplementedError
-        m_dict_value = m_dict["m"]
-        if not isinstance(m_dict_value, Dict):
-            logger.error(f"m_dict = {m_dict}")
-            raise NotImplementedError
-        ut_metadata = m_dict_value["ut_metadata"]
-        if not isinstance(ut_metadata, Integer):
-            logger.error(f"m_dict = {m_dict}")
-            raise NotImplementedError
-        return ExtendedPayload(ut_metadata=ut_metadata.data)
+    def from_bytes(cls, raw_data: bytes | memoryview) -> "MetadataPayload":
+        try:
+            data, message = Dict.from_bytes(bytes(raw_data))
+        except (NeedMoreBytesError, WrongBencodeFormatError, UnicodeDecodeError):
+            raise WrongPacketFormatError
+        msg_type = message.data.get("msg_type")
+        piece = message.data.get("piece")
+        total_size = message.data.get("total_size")
+        if not isinstance(msg_type, Integer) or not isinstance(piece, Integer):
+            logger.error(f"ut_metadata message = {message}")
+            raise WrongPacketFormatError
+        try:
+            parsed_type = MetadataMessageType(msg_type.data)
+        except ValueError:
+            logger.error(f"ut_metadata msg_type = {msg_type.data}")
+            raise WrongPacketFormatError
+        return MetadataPayload(
+            msg_type=parsed_type,
+            piece=piece.data,
+            total_size=total_size.data if isinstance(total_size, Integer) else None,
+            data=data,
+        )
 
 
 @dataclass
@@ -269,9 +423,22 @@ class ExtendedPayload(Payload):
 class ExtendedPacket(PeerPacket):
     message_type: MessageType = MessageType.EXTENDED
 
+    @property
+    def extended_id(self) -> int:
+        """0 for the extension handshake, otherwise the id the receiver gave the extension"""
+        if not self.payload:
+            raise WrongPacketFormatError
+        return self.payload[0]
+
     @property
     def parsed_payload(self) -> ExtendedPayload:
         return ExtendedPayload.from_bytes(self.payload)
 
+    @property
+    def metadata_payload(self) -> MetadataPayload:
+        return MetadataPayload.from_bytes(self.payload[1:])
+
     def __repr__(self) -> str:
+        if self.extended_id != 0:
+            return f"ExtendedPacket(message_type={self.message_type}, extended_id={self.extended_id})"
         return f"ExtendedPacket(message_type={self.message_type}, parsed_payload={self.parsed_payload})"
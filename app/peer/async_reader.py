@@ -1,20 +1,9 @@
-from asyncio import (
-    FIRST_COMPLETED,
-    CancelledError,
-    Event,
-    Lock,
-    StreamReader,
-    Task,
-    create_task,
-    gather,
-    wait,
-)
-from typing import Any, Callable, Coroutine
+from asyncio import CancelledError, Event, Lock, Task, create_task
 
-from app.const import StreamExactly
 from app.exceptions import ReaderClosedError
 from app.logging_config import get_logger
 from app.packets import HandshakePacket, Packet, PeerPacket
+from app.peer.protocol import PeerProtocol
 
 logger = get_logger(__name__)
 
@@ -22,12 +11,12 @@ logger = get_logger(__name__)
 class AsyncReaderHandler:
     def __init__(
         self,
-        reader: StreamReader,
+        protocol: PeerProtocol,
         peername: str,
         closed_event: Event,
     ):
         self.closed: Event = closed_event
-        self._reader: StreamReader = reader
+        self._protocol: PeerProtocol = protocol
         self._peername: str = peername
         self._lock = Lock()
         self._closure_task: Task[None] = create_task(
@@ -38,58 +27,52 @@ class AsyncReaderHandler:
         return self._peername
 
     async def read_handshake(self) -> HandshakePacket:
-        result = await self._read(HandshakePacket.from_stream)
+        result = await self._read(is_handshake=True)
         if not isinstance(result, HandshakePacket):
             raise NotImplementedError
         return result
 
     async def read_peer(self) -> PeerPacket:
-        result = await self._read(PeerPacket.from_stream)
+        result = await self._read(is_handshake=False)
         if not isinstance(result, PeerPacket):
             raise NotImplementedError
         return result
 
-    async def _read(  # noqa: WPS238
-        self, parser: Callable[[StreamExactly], Coroutine[Any, Any, Packet]]
-    ) -> Packet:
+    def pause(self) -> None:
+        self._protocol.pause_reading()
+
+    def resume(self) -> None:
+        self._protocol.resume_reading()
+
+    async def _read(self, is_handshake: bool) -> Packet:  # noqa: WPS238
         if self.closed.is_set():
             raise ReaderClosedError
 
         async with self._lock:
             try:
-                result = await self._read_actually(parser)
+                if is_handshake:
+                    result: Packet = await self._protocol.read_handshake()
+                else:
+                    result = await self._protocol.read_packet()
             except CancelledError:
-                self.closed.set()
+                # The protocol frames whole messages, so a read cancelled while waiting has
+                # consumed nothing and the connection can go on, e.g. from one phase to the next
                 logger.debug(f"{self}: Read cancelled")
                 raise
             except ReaderClosedError:
+                self.closed.set()
                 raise
             except Exception as e:
                 logger.debug(f"{self}: Reader error: {e}")
                 self.closed.set()
                 raise ReaderClosedError(f"Read failed: {e}") from e
+        if self.closed.is_set():
+            raise ReaderClosedError("Reader closed")
         logger.debug(f"{self}: Read {result}")
         return result
 
-    async def _read_actually(  # noqa: WPS210
-        self, parser: Callable[[StreamExactly], Coroutine[Any, Any, Packet]]
-    ) -> Packet:
-        read_task: Task[Packet] = create_task(parser(self._reader.readexactly))
-        closed_task: Task[bool] = create_task(self.closed.wait())
-
-        tasks: set[Task[Any]] = {read_task, closed_task}
-        done, pending = await wait(tasks, return_when=FIRST_COMPLETED)
-
-        for task in pending:
-            task.cancel()
-        await gather(*pending, return_exceptions=True)
-
-        if closed_task in done:
-            logger.debug(f"{self}: Read cancelled due to closed event")
-            raise ReaderClosedError("Reader closed")
-
-        return await read_task  # This will raise if there was an error
-
     async def _closure_loop(self) -> None:
         await self.closed.wait()
+        # Closing the transport wakes a pending read with ReaderClosedError
+        self._protocol.close()
         logger.debug(f"{self}: Reader closed")
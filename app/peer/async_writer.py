@@ -1,28 +1,21 @@
-from asyncio import (
-    FIRST_COMPLETED,
-    CancelledError,
-    Event,
-    Lock,
-    StreamWriter,
-    Task,
-    create_task,
-    gather,
-    wait,
-)
-from typing import Any
+from asyncio import CancelledError, Event, Lock, Task, create_task
 
 from app.exceptions import WriterClosedError
 from app.logging_config import get_logger
+from app.peer.protocol import PeerProtocol
 
 logger = get_logger(__name__)
 
 
 class AsyncWriterHandler:
-    def __init__(self, writer: StreamWriter, peername: str, closed_event: Event):
+    """Coalesces queued messages: one writelines and one drain per flush"""
+
+    def __init__(self, writer: PeerProtocol, peername: str, closed_event: Event):
         self.closed: Event = closed_event
         self._writer = writer
         self._peername = peername
         self._lock = Lock()
+        self._pending: list[bytes | memoryview] = []
         self._closure_task: Task[None] = create_task(
             self._closure_loop(), name=f"{peername}: AsyncWriterHandler._closure_loop"
         )
@@ -30,40 +23,45 @@ class AsyncWriterHandler:
     def __str__(self) -> str:
         return self._peername
 
-    async def write(self, data: bytes) -> None:  # noqa: WPS238
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
+    def queue(self, data: bytes | memoryview) -> None:
+        if self.closed.is_set():
+            raise WriterClosedError("Writer is closed")
+        self._pending.append(data)
+
+    async def write(self, data: bytes) -> None:
+        self.queue(data)
+        await self.flush()
+
+    async def flush(self) -> None:  # noqa: WPS238
         if self.closed.is_set():
             raise WriterClosedError("Writer is closed")
         async with self._lock:
             try:
-                await self._write_actually(data)
+                await self._flush_actually()
             except CancelledError:
                 self.closed.set()
                 logger.debug(f"{self}: Write cancelled")
                 raise
             except WriterClosedError:
+                self.closed.set()
                 raise
             except Exception as e:
                 logger.debug(f"{self}: Writer error: {e}")
                 self.closed.set()
                 raise WriterClosedError(f"Write failed: {e}") from e
 
-    async def _write_actually(self, data: bytes) -> None:  # noqa: WPS210
-        self._writer.write(data)
-        write_task: Task[None] = create_task(self._writer.drain())
-        closed_task: Task[bool] = create_task(self.closed.wait())
-
-        tasks: set[Task[Any]] = {write_task, closed_task}
-        done, pending = await wait(tasks, return_when=FIRST_COMPLETED)
-
-        for task in pending:
-            task.cancel()
-        await gather(*pending, return_exceptions=True)
-
-        if closed_task in done:
-            logger.debug(f"{self}: Write cancelled due to closed event")
-            raise WriterClosedError("Writer closed")
-
-        return await write_task  # This will raise if there was an error
+    async def _flush_actually(self) -> None:
+        # Messages queued while draining go out with the next round of this loop
+        while self._pending:
+            batch, self._pending = self._pending, []
+            self._writer.writelines(batch)
+            # Closing the transport fails a pending drain with WriterClosedError
+            await self._writer.drain()
+            logger.debug(f"{self}: Flushed {len(batch)} messages")
 
     async def _closure_loop(self) -> None:
         await self.closed.wait()
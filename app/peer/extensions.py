@@ -0,0 +1,71 @@
+from enum import StrEnum
+from typing import Callable, Optional
+
+from app.const import CLIENT_VERSION, UT_METADATA_ID, UT_PEX_ID
+from app.exceptions import WrongPacketFormatError
+from app.logging_config import get_logger
+from app.packets import ExtendedPacket, ExtendedPayload
+
+logger = get_logger(__name__)
+
+ExtensionHandler = Callable[[memoryview], None]
+HandshakeHandler = Callable[[ExtendedPayload], None]
+
+
+class Extension(StrEnum):
+    UT_METADATA = "ut_metadata"
+    UT_PEX = "ut_pex"
+
+
+# Ids we advertise: peers send each extension's messages with these
+LOCAL_IDS: dict[Extension, int] = {
+    Extension.UT_METADATA: UT_METADATA_ID,
+    Extension.UT_PEX: UT_PEX_ID,
+}
+
+
+class ExtensionRegistry:
+    """Extended messages (BEP 10) of one connection, dispatched to handlers by message id.
+
+    Incoming messages carry the ids we advertised, so dispatch is one dict lookup; the
+    ids the peer advertised are only needed to send it something.
+    """
+
+    def __init__(self, on_handshake: HandshakeHandler) -> None:
+        self._on_handshake = on_handshake
+        self._handlers: dict[int, ExtensionHandler] = dict()
+        self._names: dict[int, Extension] = dict()
+        self._remote: dict[str, int] = dict()
+
+    def register(self, extension: Extension, handler: ExtensionHandler) -> None:
+        message_id = LOCAL_IDS[extension]
+        self._handlers[message_id] = handler
+        self._names[message_id] = extension
+
+    @property
+    def handshake(self) -> ExtendedPayload:
+        """Our extension handshake, advertising every registered extension"""
+        return ExtendedPayload(
+            extensions={str(extension): message_id for message_id, extension in self._names.items()},
+            client=CLIENT_VERSION,
+        )
+
+    def remote_id(self, extension: Extension) -> Optional[int]:
+        """Id to send the extension's messages with, None if the peer does not support it"""
+        return self._remote.get(extension)
+
+    def dispatch(self, packet: ExtendedPacket) -> None:
+        message_id = packet.extended_id
+        if message_id == 0:
+            payload = packet.parsed_payload
+            self._remote = payload.extensions
+            self._on_handshake(payload)
+            return
+        handler = self._handlers.get(message_id)
+        if handler is None:
+            logger.debug(f"Extended message {message_id} is not one we advertised, ignored")
+            return
+        try:
+            handler(memoryview(packet.payload)[1:])
+        except WrongPacketFormatError:
+            logger.debug(f"Malformed {self._names[message_id]} message ignored")
@@ -0,0 +1,353 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+from app.const import (
+    DIAL_TIMEOUT_SECONDS,
+    MAX_ACTIVE_PEERS,
+    MAX_CONCURRENT_DIALS,
+    MAX_PEER_BACKOFF_SECONDS,
+    PEER_BACKOFF_SECONDS,
+    PEER_REPLACE_SECONDS,
+)
+from app.logging_config import get_logger
+from app.peer.peer import Peer, peer_to_str
+from app.pieces import Pieces
+from app.rate_limit import TokenBucket, nested_bucket
+
+logger = get_logger(__name__)
+
+Clock = Callable[[], float]
+PeerFactory = Callable[[str, int], Peer]
+
+CORRUPT_PIECE_PENALTY = 4
+REPLACE_FRACTION = 0.25
+
+
+@dataclass
+class PeerRecord:
+    ip: str
+    port: int
+    failures: int = 0
+    errors: int = 0
+    corrupt: int = 0
+    downloaded: int = 0
+    connected_seconds: float = 0
+    retry_at: float = 0
+
+    @property
+    def peername(self) -> str:
+        return peer_to_str(self.ip, self.port)
+
+    @property
+    def score(self) -> float:
+        """Delivered bytes per connected second, divided down by errors and corrupt pieces"""
+        rate = self.downloaded / max(self.connected_seconds, 1)
+        return rate / (1 + self.errors + CORRUPT_PIECE_PENALTY * self.corrupt)
+
+
+class PeerBook:
+    """Known addresses with their history: who to dial next, who to back off, who to drop"""
+
+    def __init__(self, clock: Clock = time.monotonic) -> None:
+        self._clock = clock
+        self._records: dict[str, PeerRecord] = dict()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __getitem__(self, peername: str) -> PeerRecord:
+        return self._records[peername]
+
+    def add(self, ip: str, port: int) -> bool:
+        peername = peer_to_str(ip, port)
+        if peername in self._records:
+            return False
+        self._records[peername] = PeerRecord(ip=ip, port=port)
+        return True
+
+    def candidates(self, exclude: Iterable[str]) -> list[PeerRecord]:
+        """Addresses that may be dialled now, best history first"""
+        now = self._clock()
+        excluded = set(exclude)
+        eligible = [
+            record
+            for peername, record in self._records.items()
+            if peername not in excluded and record.retry_at <= now
+        ]
+        return sorted(eligible, key=lambda record: (-record.score, record.errors))
+
+    def next_retry(self, exclude: Iterable[str]) -> Optional[float]:
+        """Seconds until the next backed-off address becomes eligible"""
+        excluded = set(exclude)
+        pending = [
+            record.retry_at
+            for peername, record in self._records.items()
+            if peername not in excluded
+        ]
+        if not pending:
+            return None
+        return max(min(pending) - self._clock(), 0)
+
+    def connected(self, peername: str, seconds: float, downloaded: int, corrupt: int) -> None:
+        record = self._records[peername]
+        record.connected_seconds += seconds
+        record.downloaded += downloaded
+        record.corrupt = corrupt
+        if downloaded:
+            record.failures = 0
+
+    def failed(self, peername: str) -> None:
+        record = self._records[peername]
+        record.failures += 1
+        record.errors += 1
+        backoff = PEER_BACKOFF_SECONDS * 2 ** (record.failures - 1)
+        record.retry_at = self._clock() + min(backoff, MAX_PEER_BACKOFF_SECONDS)
+
+    def rest(self, peername: str, seconds: float) -> None:
+        """Keep a dropped but healthy address out of the rotation for a while"""
+        self._records[peername].retry_at = self._clock() + seconds
+
+    def worst(self, peernames: Iterable[str]) -> Optional[str]:
+        """The active peer to replace: far below the average of the active ones"""
+        records = [self._records[peername] for peername in peernames]
+        if len(records) < 2:
+            return None
+        mean = sum(record.score for record in records) / len(records)
+        worst = min(records, key=lambda record: record.score)
+        if worst.score >= REPLACE_FRACTION * mean:
+            return None
+        return worst.peername
+
+
+class ConnectionBudget:
+    """Active connections allowed across every torrent of the process.
+
+    Managers take a slot per connection and give it back when it ends; the events they
+    watch are set then, so one waiting for a slot dials as soon as another frees one.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self._limit = limit
+        self._used = 0
+        self._watchers: set[asyncio.Event] = set()
+
+    @property
+    def free(self) -> int:
+        return self._limit - self._used
+
+    def take(self) -> None:
+        self._used += 1
+
+    def give_back(self) -> None:
+        self._used -= 1
+        for watcher in self._watchers:
+            watcher.set()
+
+    def watch(self, event: asyncio.Event) -> None:
+        self._watchers.add(event)
+
+    def unwatch(self, event: asyncio.Event) -> None:
+        self._watchers.discard(event)
+
+
+@dataclass
+class _Connection:
+    peer: Peer
+    started: float
+    unchoked: bool = False
+    counted_bytes: int = 0
+
+
+class ConnectionManager:  # noqa: WPS214, WPS230
+    """Keeps up to max_active peers running with at most max_dialing handshakes at once.
+
+    Failing addresses are retried with exponential backoff, and every replace_seconds the
+    worst-scoring peer makes room for an untried or better candidate.
+    """
+
+    def __init__(  # noqa: WPS211
+        self,
+        pieces: Pieces,
+        info_hash: bytes,
+        max_active: int = MAX_ACTIVE_PEERS,
+        max_dialing: int = MAX_CONCURRENT_DIALS,
+        clock: Clock = time.monotonic,
+        peer_factory: Optional[PeerFactory] = None,
+        budget: Optional[ConnectionBudget] = None,
+        dial_slots: Optional[asyncio.Semaphore] = None,
+        rate_limit: Optional[TokenBucket] = None,
+        peer_rate: Optional[float] = None,
+    ) -> None:
+        self._pieces = pieces
+        self._max_active = max_active
+        self._budget = budget
+        self._dial_slots = dial_slots or asyncio.Semaphore(max_dialing)
+        self._clock = clock
+        self._rate_limit = rate_limit
+        self._peer_rate = peer_rate
+        self._peer_factory = peer_factory or (
+            lambda ip, port: Peer(
+                ip,
+                port,
+                info_hash,
+                extension_enabled=True,
+                on_peers=self.add_addresses,
+                rate_limit=self._peer_rate_limit(),
+            )
+        )
+        self._book = PeerBook(clock)
+        self._connections: dict[str, _Connection] = dict()
+        self._tasks: dict[asyncio.Task[None], str] = dict()
+        self._changed = asyncio.Event()
+        self._last_replace = clock()
+
+    @property
+    def book(self) -> PeerBook:
+        return self._book
+
+    @property
+    def active(self) -> int:
+        return len(self._connections)
+
+    def add_addresses(self, addresses: Iterable[tuple[str, int]]) -> None:
+        added = sum(self._book.add(ip, port) for ip, port in addresses)
+        if added:
+            logger.info(f"{added} new peer addresses, {len(self._book)} known")
+            self._changed.set()
+
+    async def run(self) -> None:
+        if self._budget is not None:
+            self._budget.watch(self._changed)
+        try:
+            while not self._pieces.is_done:
+                self._replace_worst()
+                self._dial()
+                changed_task = asyncio.create_task(self._changed.wait())
+                done, _ = await asyncio.wait(
+                    set(self._tasks) | {changed_task},
+                    timeout=self._next_wakeup(),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                changed_task.cancel()
+                self._changed.clear()
+                for task in done:
+                    if task in self._tasks:
+                        self._finished(task)
+        finally:
+            if self._budget is not None:
+                self._budget.unwatch(self._changed)
+            await self.close()
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        if self._budget is not None:
+            for _ in self._connections:
+                self._budget.give_back()
+        self._connections.clear()
+
+    async def adopt(self, peers: Iterable[Peer]) -> None:
+        """Run connections an earlier phase opened, they skip the handshake"""
+        for peer in peers:
+            ip, port = peer.address
+            self._book.add(ip, port)
+            if peer.peername in self._connections or self._free() <= 0:
+                await peer.close()
+                continue
+            peer.set_rate_limit(self._peer_rate_limit())
+            self._start(peer)
+        self._changed.set()
+
+    def _peer_rate_limit(self) -> Optional[TokenBucket]:
+        return nested_bucket(self._rate_limit, self._peer_rate)
+
+    def _free(self) -> int:
+        free = self._max_active - len(self._connections)
+        if self._budget is not None:
+            free = min(free, self._budget.free)
+        return free
+
+    def _dial(self) -> None:
+        for record in self._book.candidates(exclude=self._connections)[: max(self._free(), 0)]:
+            self._start(self._peer_factory(record.ip, record.port))
+
+    def _start(self, peer: Peer) -> None:
+        if self._budget is not None:
+            self._budget.take()
+        self._connections[peer.peername] = _Connection(peer=peer, started=self._clock())
+        task = asyncio.create_task(self._run_peer(peer), name=peer.peername)
+        self._tasks[task] = peer.peername
+
+    async def _run_peer(self, peer: Peer) -> None:
+        try:
+            async with self._dial_slots:
+                await asyncio.wait_for(peer.connect(self._pieces), DIAL_TIMEOUT_SECONDS)
+            self._connections[peer.peername].unchoked = True
+            await peer.exchange()
+        finally:
+            await peer.close()
+
+    def _finished(self, task: asyncio.Task[None]) -> None:
+        peername = self._tasks.pop(task)
+        connection = self._connections.pop(peername)
+        if self._budget is not None:
+            self._budget.give_back()
+        self._pieces.return_in_queue(peername)
+        self._account(peername, connection)
+        if task.cancelled():
+            self._book.rest(peername, PEER_REPLACE_SECONDS)
+            return
+        error = task.exception()
+        if error is not None:
+            self._book.failed(peername)
+            record = self._book[peername]
+            logger.info(
+                f"{peername}: {type(error).__name__} {error}, "
+                + f"retry in {record.retry_at - self._clock():.0f}s"
+            )
+
+    def _replace_worst(self) -> None:
+        now = self._clock()
+        if now - self._last_replace < PEER_REPLACE_SECONDS:
+            return
+        self._last_replace = now
+        if self._free() > 0:
+            return
+        if not self._book.candidates(exclude=self._connections):
+            return
+        for peername, connection in self._connections.items():
+            self._account(peername, connection)
+        worst = self._book.worst(
+            peername for peername, connection in self._connections.items() if connection.unchoked
+        )
+        if worst is None:
+            return
+        logger.info(f"{worst}: replacing, score {self._book[worst].score:.0f} B/s")
+        for task, peername in self._tasks.items():
+            if peername == worst:
+                task.cancel()
+
+    def _account(self, peername: str, connection: _Connection) -> None:
+        """Move what the connection did since the last call into the peer's record"""
+        now = self._clock()
+        downloaded = connection.peer.downloaded
+        self._book.connected(
+            peername,
+            seconds=now - connection.started,
+            downloaded=downloaded - connection.counted_bytes,
+            corrupt=self._pieces.corrupt_suppliers.get(peername, 0),
+        )
+        connection.started = now
+        connection.counted_bytes = downloaded
+
+    def _next_wakeup(self) -> Optional[float]:
+        wakeups = [PEER_REPLACE_SECONDS - (self._clock() - self._last_replace)]
+        if self._free() > 0:
+            next_retry = self._book.next_retry(exclude=self._connections)
+            if next_retry is not None:
+                wakeups.append(next_retry)
+        return max(min(wakeups), 0)
@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+from typing import Iterable, Optional
+
+from app.const import (
+    MAX_METADATA_BYTES,
+    METADATA_PIECE_BYTES,
+    METADATA_REQUESTS_PER_PEER,
+    METADATA_TIMEOUT_SECONDS,
+)
+from app.exceptions import MetadataError
+from app.logging_config import get_logger
+from app.packets import MetadataMessageType
+from app.peer.peer import Peer, peer_to_str
+from app.peer.pool import PeerPool
+from app.torrent_file import TorrentFile
+from app.tracker.announce import fetch_peers
+
+logger = get_logger(__name__)
+
+
+class MetadataFetcher:
+    """Assembles the info dict (BEP 9) from 16 KiB pieces requested from many peers at once.
+
+    Every peer claims the missing pieces fewest peers are already asked for, so peers
+    work on different pieces while there are some left and race on the last ones. The
+    assembled dict only counts once its SHA-1 is the info hash; otherwise it starts over
+    without the peers that supplied it, since there is no telling which piece was bad.
+    """
+
+    def __init__(self, info_hash: bytes) -> None:
+        self._info_hash = info_hash
+        self._size: Optional[int] = None
+        self._pieces: list[Optional[bytes]] = []
+        self._asked: list[int] = []
+        self._suppliers: list[str] = []
+        self._banned: set[str] = set()
+        self._metadata: Optional[bytes] = None
+        self._done = asyncio.Event()
+
+    @property
+    def size(self) -> Optional[int]:
+        return self._size
+
+    @property
+    def is_done(self) -> bool:
+        return self._done.is_set()
+
+    def is_banned(self, peername: str) -> bool:
+        return peername in self._banned
+
+    @property
+    def metadata(self) -> bytes:
+        if self._metadata is None:
+            raise NotImplementedError
+        return self._metadata
+
+    async def wait(self) -> bytes:
+        await self._done.wait()
+        return self.metadata
+
+    async def fetch_from(self, peer: Peer) -> None:
+        """Request pieces from a connected peer until the metadata is complete"""
+        if peer.peername in self._banned:
+            return
+        if peer.extension_id is None or not self._accept_size(peer):
+            logger.info(f"{peer}: no usable ut_metadata, size {peer.metadata_size}")
+            return
+        claimed: set[int] = set()
+        try:
+            while not self.is_done and peer.peername not in self._banned:
+                while len(claimed) < METADATA_REQUESTS_PER_PEER:
+                    piece = self._claim(exclude=claimed)
+                    if piece is None:
+                        break
+                    claimed.add(piece)
+                    await peer.request_metadata(piece)
+                if not claimed:
+                    # Only when no piece is missing, so the last store finished or restarted it
+                    return
+                message = await asyncio.wait_for(peer.read_metadata(), METADATA_TIMEOUT_SECONDS)
+                if message.msg_type == MetadataMessageType.REJECT:
+                    logger.info(f"{peer}: rejected metadata piece {message.piece}")
+                    return
+                if message.msg_type != MetadataMessageType.DATA or message.piece not in claimed:
+                    continue
+                claimed.discard(message.piece)
+                self._asked[message.piece] -= 1
+                self._store(message.piece, bytes(message.data), peer)
+        finally:
+            for piece in claimed:
+                self._asked[piece] -= 1
+
+    def _accept_size(self, peer: Peer) -> bool:
+        size = peer.metadata_size
+        if size is None or not 0 < size <= MAX_METADATA_BYTES:
+            return False
+        if self._size is None:
+            self._size = size
+            piece_count = -(-size // METADATA_PIECE_BYTES)
+            self._pieces = [None] * piece_count
+            self._asked = [0] * piece_count
+            self._suppliers = [""] * piece_count
+            logger.info(f"Metadata: {size} bytes in {piece_count} pieces")
+        return size == self._size
+
+    def _claim(self, exclude: set[int]) -> Optional[int]:
+        missing = [
+            piece
+            for piece, data in enumerate(self._pieces)
+            if data is None and piece not in exclude
+        ]
+        if not missing:
+            return None
+        piece = min(missing, key=lambda index: self._asked[index])
+        self._asked[piece] += 1
+        return piece
+
+    def _piece_size(self, piece: int) -> int:
+        if self._size is None:
+            raise NotImplementedError
+        return min(METADATA_PIECE_BYTES, self._size - piece * METADATA_PIECE_BYTES)
+
+    def _store(self, piece: int, data: bytes, peer: Peer) -> None:
+        if len(data) != self._piece_size(piece):
+            logger.warning(f"{peer}: metadata piece {piece} has {len(data)} bytes")
+            return
+        if self._pieces[piece] is not None:
+            return
+        self._pieces[piece] = data
+        self._suppliers[piece] = peer.peername
+        if any(stored is None for stored in self._pieces):
+            return
+        metadata = b"".join(stored for stored in self._pieces if stored is not None)
+        if hashlib.sha1(metadata).digest() != self._info_hash:  # noqa: DUO130
+            suppliers = set(self._suppliers)
+            logger.warning(f"Metadata does not match the info hash, dropping {sorted(suppliers)}")
+            self._banned |= suppliers
+            self._pieces = [None] * len(self._pieces)
+            return
+        self._metadata = metadata
+        self._done.set()
+
+
+async def fetch_metadata(
+    info_hash: bytes, addresses: Iterable[tuple[str, int]], pool: Optional[PeerPool] = None
+) -> bytes:
+    """Dial every address at once and fetch from each peer as soon as its handshake is done.
+
+    Connections of the pool are used as they are, and the ones still healthy at the end
+    go back to it for the download.
+    """
+    peer_pool = pool or PeerPool(info_hash)
+    fetcher = MetadataFetcher(info_hash)
+
+    async def fetch_from(ip: str, port: int) -> None:
+        peer = await peer_pool.dial(ip, port)
+        reusable = False
+        try:
+            await fetcher.fetch_from(peer)
+            reusable = True
+        except asyncio.CancelledError:
+            reusable = fetcher.is_done
+            raise
+        finally:
+            if reusable and not fetcher.is_banned(peer.peername):
+                peer_pool.release(peer)
+            else:
+                await peer.close()
+
+    peer_tasks = {
+        asyncio.create_task(fetch_from(ip, port), name=f"metadata {peer_to_str(ip, port)}")
+        for ip, port in addresses
+    }
+    done_task = asyncio.create_task(fetcher.wait(), name="metadata done")
+    try:
+        pending = peer_tasks | {done_task}
+        while not fetcher.is_done and pending != {done_task}:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done - {done_task}:
+                if not task.cancelled() and task.exception() is not None:
+                    logger.info(f"{task.get_name()}: {type(task.exception()).__name__} {task.exception()}")
+    finally:
+        for task in peer_tasks | {done_task}:
+            task.cancel()
+        await asyncio.gather(*peer_tasks, done_task, return_exceptions=True)
+        if pool is None:
+            await peer_pool.close()
+    if not fetcher.is_done:
+        raise MetadataError(f"No peer delivered the metadata of {info_hash.hex()}")
+    return fetcher.metadata
+
+
+async def fetch_torrent_file(
+    info_hash: bytes, tiers: list[list[str]], pool: Optional[PeerPool] = None
+) -> TorrentFile:
+    """Torrent of a magnet link: peers from its trackers, then the info dict from them"""
+    # The size is what the metadata tells, until then any non-zero left will do
+    peers = await fetch_peers(info_hash, tiers, left=1)
+    metadata = await fetch_metadata(info_hash, peers, pool)
+    torrent_file = TorrentFile.from_metadata(metadata, tiers)
+    if torrent_file.info_hash != info_hash:
+        raise NotImplementedError
+    return torrent_file
@@ -3,27 +3,45 @@ from asyncio import (
     Event,
     Task,
     create_task,
-    current_task,
-    open_connection,
+    gather,
+    get_running_loop,
     sleep,
     wait,
 )
-from typing import Optional
+from collections import deque
+from typing import Callable, Optional
 
-from app.const import MAX_CONCURRENT_REQUESTS, MY_ID, MessageType
+from app.const import (
+    BLOCK_SIZE_BYTES,
+    MAX_CONCURRENT_REQUESTS,
+    METADATA_REQUESTS_PER_PEER,
+    MIN_CONCURRENT_REQUESTS,
+    MY_ID,
+    MessageType,
+)
+from app.exceptions import ReaderClosedError
 from app.logging_config import get_logger
 from app.packets import (
     ExtendedPacket,
     ExtendedPayload,
     HandshakePacket,
     KeepAlivePacket,
+    MetadataMessageType,
+    MetadataPayload,
     Packet,
     PeerPacket,
+    PexPayload,
     PiecePeerPacket,
+    pack_request_into,
 )
 from app.peer.async_reader import AsyncReaderHandler
 from app.peer.async_writer import AsyncWriterHandler
-from app.pieces import PieceBlock, Pieces
+from app.peer.extensions import Extension, ExtensionRegistry
+from app.peer.protocol import PeerProtocol
+from app.peer.window import RequestWindow
+from app.pieces import Pieces
+from app.rate_limit import TokenBucket
+from app.tracker.models import PeerAddress
 
 logger = get_logger(__name__)
 
@@ -33,11 +51,24 @@ def peer_to_str(ip: str, port: int) -> str:
 
 
 OptionalPeerPacket = Optional[PeerPacket]
+PeersCallback = Callable[[list[PeerAddress]], None]
+# Choke and interest changes, with no payload
+STATE_MESSAGES = frozenset(
+    (MessageType.CHOKE, MessageType.UNCHOKE, MessageType.INTERESTED, MessageType.NOT_INTERESTED)
+)
 
 
 class Peer:  # noqa: WPS214
-    def __init__(
-        self, ip: str, port: int, info_hash: bytes, extension_enabled: bool = False
+    def __init__(  # noqa: WPS211
+        self,
+        ip: str,
+        port: int,
+        info_hash: bytes,
+        extension_enabled: bool = False,
+        min_requests: int = MIN_CONCURRENT_REQUESTS,
+        max_requests: int = MAX_CONCURRENT_REQUESTS,
+        on_peers: Optional[PeersCallback] = None,
+        rate_limit: Optional[TokenBucket] = None,
     ) -> None:
         self._ip = ip
         self._port = port
@@ -47,26 +78,72 @@ class Peer:  # noqa: WPS214
         self._writer: Optional[AsyncWriterHandler] = None
         self._tasks: set[Task[OptionalPeerPacket]] = set()
         self._read_task: Optional[Task[PeerPacket]] = None
+        self._flush_task: Optional[Task[None]] = None
+        self._changed_task: Optional[Task[None]] = None
+        self._rate_limit = rate_limit
+        self._rate_task: Optional[Task[None]] = None
         self._in_flight = 0
+        self._downloaded = 0
         self._extension_enabled = extension_enabled
         self.closed: Event = Event()
         self._unchoked: bool = False
-        self._extension_id: Optional[int] = None
+        self._metadata_size: Optional[int] = None
+        self._extension_handshake_seen = False
+        self._on_peers = on_peers
+        self._extensions = ExtensionRegistry(on_handshake=self._process_extension_handshake)
+        self._extensions.register(Extension.UT_METADATA, self._process_metadata)
+        self._extensions.register(Extension.UT_PEX, self._process_pex)
+        self._metadata_messages: deque[MetadataPayload] = deque(maxlen=2 * METADATA_REQUESTS_PER_PEER)
+        self._handshake_done = False
+        self._early_bitfield = b""
+        self._early_haves: list[int] = []
+        self._interested: bool = False
+        # Length of every block asked for, to refund its rate tokens if it never comes
+        self._requested: dict[tuple[int, int], int] = dict()
+        self._cancelled: set[tuple[int, int]] = set()
+        self._request_buffer = bytearray()
+        self.pieces: Optional[Pieces] = None
+        self._window = RequestWindow(min_depth=min_requests, max_depth=max_requests)
 
     def __str__(self) -> str:
         return self._peername
 
     @property
     def extension_id(self) -> Optional[int]:
-        return self._extension_id
+        """The peer's ut_metadata message id"""
+        return self._extensions.remote_id(Extension.UT_METADATA)
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self._ip, self._port
+
+    @property
+    def metadata_size(self) -> Optional[int]:
+        """Size of the info dict the peer offers through ut_metadata, from its extension handshake"""
+        return self._metadata_size
+
+    @property
+    def peername(self) -> str:
+        return self._peername
+
+    @property
+    def downloaded(self) -> int:
+        """Bytes of PIECE payloads received on this connection"""
+        return self._downloaded
+
+    @property
+    def request_depth(self) -> int:
+        return self._window.depth
 
     async def handshake(self) -> str:
-        reader, writer = await open_connection(self._ip, self._port)
+        _, protocol = await get_running_loop().create_connection(
+            lambda: PeerProtocol(self._peername), self._ip, self._port
+        )
         self._writer = AsyncWriterHandler(
-            writer, peername=self._peername, closed_event=self.closed
+            protocol, peername=self._peername, closed_event=self.closed
         )
         self._reader = AsyncReaderHandler(
-            reader, peername=self._peername, closed_event=self.closed
+            protocol, peername=self._peername, closed_event=self.closed
         )
         await self._write(
             HandshakePacket(
@@ -76,10 +153,11 @@ class Peer:  # noqa: WPS214
             )
         )
         result = await self._read_handshake()
+        self._handshake_done = True
         if self._extension_enabled:
             self._extension_enabled = result.extension_enabled
         if self._extension_enabled:
-            await self._write(ExtendedPacket(payload=ExtendedPayload(1).to_bytes))
+            await self._write(ExtendedPacket(payload=self._extensions.handshake.to_bytes))
             await self.get_ready(dirty=True)
         return result.peer_id
 
@@ -87,12 +165,18 @@ class Peer:  # noqa: WPS214
         while not self._is_ready():
             peer_response = await self._read_peer()
             if peer_response.message_type == MessageType.BITFIELD:
-                await self._write(PeerPacket(message_type=MessageType.INTERESTED))
+                self._process_bitfield(peer_response)
+                await self._send_interested()
+            elif peer_response.message_type == MessageType.HAVE:
+                self._process_have(peer_response)
+                await self._send_interested()
             elif peer_response.message_type == MessageType.UNCHOKE:
                 self._unchoked = True
+            elif peer_response.message_type == MessageType.CHOKE:
+                self._unchoked = False
             elif isinstance(peer_response, ExtendedPacket):
-                self._extension_id = peer_response.parsed_payload.ut_metadata
-                if dirty:
+                self._extensions.dispatch(peer_response)
+                if dirty and self._extension_handshake_seen:
                     return
             elif isinstance(peer_response, KeepAlivePacket):
                 continue
@@ -100,13 +184,60 @@ class Peer:  # noqa: WPS214
                 logger.error(f"peer_response = {peer_response}")
                 raise NotImplementedError
 
-    async def communicate(self, pieces: Pieces) -> None:  # noqa: WPS217
-        await self.handshake()
+    async def request_metadata(self, piece: int) -> None:
+        extension_id = self.extension_id
+        if extension_id is None:
+            raise NotImplementedError
+        request = MetadataPayload(msg_type=MetadataMessageType.REQUEST, piece=piece)
+        self._queue(ExtendedPacket(payload=bytes([extension_id]) + request.to_bytes))
+        await self._flush()
+
+    async def read_metadata(self) -> MetadataPayload:
+        """Next ut_metadata message, whatever else the peer sends meanwhile is processed"""
+        while not self._metadata_messages:
+            peer_response = await self._read_peer()
+            if peer_response.message_type == MessageType.BITFIELD:
+                self._process_bitfield(peer_response)
+            elif peer_response.message_type == MessageType.HAVE:
+                self._process_have(peer_response)
+            elif peer_response.message_type == MessageType.UNCHOKE:
+                self._unchoked = True
+            elif peer_response.message_type == MessageType.CHOKE:
+                self._unchoked = False
+            elif isinstance(peer_response, ExtendedPacket):
+                self._extensions.dispatch(peer_response)
+            else:
+                logger.debug(f"{self}: {peer_response.message_type} skipped while fetching metadata")
+        return self._metadata_messages.popleft()
+
+    def set_rate_limit(self, rate_limit: Optional[TokenBucket]) -> None:
+        """Budget of a connection opened before the download, it takes effect for the next request"""
+        self._rate_limit = rate_limit
+
+    async def communicate(self, pieces: Pieces) -> None:
+        await self.connect(pieces)
+        await self.exchange()
+
+    async def connect(self, pieces: Pieces) -> None:
+        """Handshake unless the connection is already open, then wait to be unchoked"""
+        self.pieces = pieces
+        pieces.add_peer(self._peername, self._early_bitfield)
+        for piece_index in self._early_haves:
+            pieces.peer_has(self._peername, piece_index)
+        pieces.attach_peer(self._peername, cancel=self._cancel, depth=lambda: self._window.depth)
+        if not self._handshake_done:
+            await self.handshake()
+        elif self._early_bitfield or self._early_haves:
+            await self._send_interested()
         await self.get_ready()
         logger.info(f"{self}: Unchoked")
-        self.pieces = pieces
 
-        await self._fill_writers()
+    async def exchange(self) -> None:
+        """Keep the request window full until every wanted piece is verified"""
+        pieces = self.pieces
+        if pieces is None:
+            raise NotImplementedError
+        self._fill_requests()
         self.read_task = create_task(self._read_peer(), name=f"{self} reader")
         self._tasks.add(self.read_task)
 
@@ -115,7 +246,18 @@ class Peer:  # noqa: WPS214
             self._tasks = tasks
             for done_task in done_tasks:
                 self._process_done_task(done_task)
-            await self._fill_writers()
+            self._fill_requests()
+
+    async def close(self) -> None:
+        self.closed.set()
+        if self._rate_limit is not None:
+            for length in self._requested.values():
+                self._rate_limit.give_back(length)
+        self._requested.clear()
+        for task in self._tasks:
+            task.cancel()
+        await gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
 
     async def _write(self, packet: Packet) -> None:
         if self._writer is None:
@@ -127,50 +269,176 @@ class Peer:  # noqa: WPS214
             raise NotImplementedError
         return await self._reader.read_handshake()
 
-    async def _read_peer(self) -> PeerPacket:
+    async def _read_peer(self, paced: bool = False) -> PeerPacket:
         if self._reader is None:
             raise NotImplementedError
+        if paced and (delay := self._read_delay()):
+            # Messages already framed are not handed out, and the socket is not read either
+            self._reader.pause()
+            try:
+                while delay:
+                    await sleep(delay)
+                    delay = self._read_delay()
+            finally:
+                self._reader.resume()
         return await self._reader.read_peer()
 
-    async def _write_from_queue(self, pieces: Pieces) -> None:
-        request = await pieces.get_request_packet(self._peername)
-        task = current_task()
-        if task is None:
+    async def _send_interested(self) -> None:
+        if self._interested:
+            return
+        self._interested = True
+        self._queue(PeerPacket(message_type=MessageType.INTERESTED))
+        await self._flush()
+
+    def _queue(self, packet: Packet) -> None:
+        self._queue_bytes(packet.to_bytes)
+
+    def _queue_bytes(self, data: bytes) -> None:
+        if self._writer is None:
             raise NotImplementedError
-        task.set_name(f"{task.get_name()}: {request}")
-        await self._write(request)
-
-    async def _fill_writers(self) -> None:
-        while self._in_flight < MAX_CONCURRENT_REQUESTS:
-            self._tasks.add(
-                create_task(
-                    self._write_from_queue(self.pieces),
-                    name=f"{self} writer",
-                )
-            )
+        self._writer.queue(data)
+
+    async def _flush(self) -> None:
+        if self._writer is None:
+            raise NotImplementedError
+        await self._writer.flush()
+
+    def _schedule_flush(self) -> None:
+        if self._writer is None or not self._writer.has_pending:
+            return
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        self._flush_task = create_task(self._flush(), name=f"{self} flush")
+        self._tasks.add(self._flush_task)
+
+    def _process_extension_handshake(self, payload: ExtendedPayload) -> None:
+        self._extension_handshake_seen = True
+        self._metadata_size = payload.metadata_size
+        if payload.reqq is not None:
+            # The peer drops requests beyond its queue, so never keep more in flight
+            self._window.cap(payload.reqq)
+        logger.debug(f"{self}: extensions {payload.extensions} reqq {payload.reqq} client {payload.client}")
+
+    def _process_metadata(self, payload: memoryview) -> None:
+        self._metadata_messages.append(MetadataPayload.from_bytes(payload))
+
+    def _process_pex(self, payload: memoryview) -> None:
+        added = PexPayload.from_bytes(payload).added
+        if added and self._on_peers is not None:
+            self._on_peers(added)
+
+    def _process_bitfield(self, packet: PeerPacket) -> None:
+        if self.pieces is None:
+            # Before a download attaches, e.g. while fetching metadata: replayed by connect
+            self._early_bitfield = bytes(packet.payload)
+            return
+        self.pieces.add_peer(self._peername, packet.payload)
+
+    def _process_have(self, packet: PeerPacket) -> None:
+        piece_index = int.from_bytes(packet.payload[:4])
+        if self.pieces is None:
+            self._early_haves.append(piece_index)
+            return
+        self.pieces.peer_has(self._peername, piece_index)
+
+    def _cancel(self, piece_index: int, offset: int, length: int) -> None:
+        key = (piece_index, offset)
+        if key not in self._requested:
+            return
+        del self._requested[key]
+        self._cancelled.add(key)
+        if self._rate_limit is not None:
+            # Charged again on the reader path should the block arrive anyway
+            self._rate_limit.give_back(length)
+        self._window.forget(key)
+        self._in_flight -= 1
+        logger.debug(f"{self}: CANCEL piece {piece_index} offset {offset}")
+        cancel = bytearray()
+        pack_request_into(cancel, 0, MessageType.CANCEL, piece_index, offset, length)
+        self._queue_bytes(bytes(cancel))
+        self._schedule_flush()
+
+    def _fill_requests(self) -> None:
+        if self.pieces is None:
+            raise NotImplementedError
+        # The whole batch is packed into one reused buffer and queued as one copy of it
+        used = 0
+        while self._unchoked and self._in_flight < self._window.depth and not self._rate_limited():
+            request = self.pieces.next_request(self._peername)
+            if request is None:
+                self._wait_for_blocks(self.pieces)
+                break
+            piece_index, offset, length = request
+            used = pack_request_into(self._request_buffer, used, MessageType.REQUEST, piece_index, offset, length)
+            key = (piece_index, offset)
+            self._requested[key] = length
+            self._window.sent(key)
             self._in_flight += 1
-            logger.info(f"{self} Created new writer")
-            await sleep(0)
+            if self._rate_limit is not None:
+                self._rate_limit.take(length)
+        if used:
+            self._queue_bytes(bytes(memoryview(self._request_buffer)[:used]))
+        self._schedule_flush()
+
+    def _rate_limited(self) -> bool:
+        """True while the bandwidth budget cannot pay for another block, a wake-up is then scheduled"""
+        if self._rate_limit is None:
+            return False
+        delay = self._rate_limit.delay(BLOCK_SIZE_BYTES)
+        if delay == 0:
+            return False
+        if self._rate_task is None or self._rate_task.done():
+            self._rate_task = create_task(sleep(delay), name=f"{self} rate limit")
+            self._tasks.add(self._rate_task)
+        return True
+
+    def _wait_for_blocks(self, pieces: Pieces) -> None:
+        if self._changed_task is not None and not self._changed_task.done():
+            return
+        self._changed_task = create_task(pieces.wait_changed(), name=f"{self} wait for blocks")
+        self._tasks.add(self._changed_task)
 
-    def _process_done_task(self, task: Task[OptionalPeerPacket]) -> None:
+    def _process_done_task(self, task: Task[OptionalPeerPacket]) -> None:  # noqa: WPS231
         if not task.done():
             raise NotImplementedError
         if task != self.read_task:
+            # Surfaces flush failures; the read task then fails on the same closed connection
+            if not task.cancelled() and task.exception() is not None:
+                logger.debug(f"{self}: {task.get_name()} failed: {task.exception()}")
             return
-        self._in_flight -= 1
+        if self.pieces is None:
+            raise NotImplementedError
         if task.exception() is None:
-            message_response = task.result()
             message_response = task.result()
             if isinstance(message_response, PiecePeerPacket):
-                piece_block = PieceBlock(
-                    piece_index=message_response.parsed_payload.piece_index,
-                    block_index=message_response.parsed_payload.block_index,
-                )
+                payload = message_response.parsed_payload
+                key = (payload.piece_index, payload.offset)
+                if key in self._requested:
+                    del self._requested[key]
+                    self._in_flight -= 1
+                else:
+                    self._cancelled.discard(key)
+                    if self._rate_limit is not None:
+                        # Not paid for when it was asked, or not asked at all
+                        self._rate_limit.take(len(payload.block))
+                self._downloaded += len(payload.block)
+                if self._window.received(key, len(payload.block)):
+                    logger.info(
+                        f"{self}: request depth {self._window.depth} "
+                        + f"rate = {self._window.rate / 1024:.1f} KiB/s rtt = {self._window.rtt * 1000:.1f} ms"
+                    )
                 self.pieces.put_processed(
-                    piece_block=piece_block,
-                    block_value=message_response.parsed_payload.block,
+                    piece_index=payload.piece_index,
+                    offset=payload.offset,
+                    block_value=payload.block,
                     peername=self._peername,
                 )
+            elif message_response is not None and message_response.message_type == MessageType.HAVE:
+                self._process_have(message_response)
+            elif message_response is not None and message_response.message_type in STATE_MESSAGES:
+                self._process_state(message_response.message_type)
+            elif isinstance(message_response, ExtendedPacket):
+                self._extensions.dispatch(message_response)
             elif not isinstance(message_response, KeepAlivePacket):
                 logger.error(
                     f"message_response = {type(message_response)} {message_response}"
@@ -178,10 +446,38 @@ class Peer:  # noqa: WPS214
                 raise NotImplementedError
         else:
             self.pieces.return_in_queue(peername=self._peername)
-        self.read_task = create_task(self._read_peer(), name=f"{self} reader")
+            raise ReaderClosedError(f"{self}: read failed") from task.exception()
+        self.read_task = create_task(self._read_peer(paced=True), name=f"{self} reader")
         self._tasks.add(self.read_task)
 
+    def _process_state(self, message_type: MessageType) -> None:
+        match message_type:  # noqa: WPS242
+            case MessageType.CHOKE if self._unchoked:
+                # The peer drops what it was asked for: the blocks go to other peers
+                # until an UNCHOKE lets requests start again
+                self._unchoked = False
+                for key, length in self._requested.items():
+                    self._window.forget(key)
+                    if self._rate_limit is not None:
+                        self._rate_limit.give_back(length)
+                self._requested.clear()
+                self._in_flight = 0
+                if self.pieces is not None:
+                    self.pieces.release_blocks(self._peername)
+                logger.info(f"{self}: Choked")
+            case MessageType.UNCHOKE:
+                self._unchoked = True
+            case _:
+                # A repeated CHOKE, or INTERESTED and NOT_INTERESTED: nothing is uploaded here
+                return
+
+    def _read_delay(self) -> float:
+        """Time to keep reading paused while a budget is in debt"""
+        if self._rate_limit is None:
+            return 0
+        return self._rate_limit.delay(0)
+
     def _is_ready(self) -> bool:
         if not self._extension_enabled:
             return self._unchoked
-        return self._unchoked and self._extension_id is not None
+        return self._unchoked and self._extension_handshake_seen
@@ -0,0 +1,82 @@
+import asyncio
+from typing import Callable, Iterable, Optional
+
+from app.const import DIAL_TIMEOUT_SECONDS, MAX_CONCURRENT_DIALS
+from app.logging_config import get_logger
+from app.peer.peer import Peer, peer_to_str
+
+logger = get_logger(__name__)
+
+PeerFactory = Callable[[str, int], Peer]
+DialResult = Peer | BaseException
+
+
+class PeerPool:
+    """Handshaken connections kept open between the phases of one command.
+
+    Handshakes, the metadata fetch and the download run on the same event loop, so a
+    phase can take over the peers an earlier one connected instead of dialling again.
+    """
+
+    def __init__(
+        self,
+        info_hash: bytes,
+        extension_enabled: bool = True,
+        max_dialing: int = MAX_CONCURRENT_DIALS,
+        timeout: float = DIAL_TIMEOUT_SECONDS,
+        peer_factory: Optional[PeerFactory] = None,
+    ) -> None:
+        self._peer_factory = peer_factory or (
+            lambda ip, port: Peer(ip, port, info_hash, extension_enabled=extension_enabled)
+        )
+        self._dial_slots = asyncio.Semaphore(max_dialing)
+        self._timeout = timeout
+        self._idle: dict[str, Peer] = dict()
+        self._peer_ids: dict[str, str] = dict()
+
+    def __len__(self) -> int:
+        return len(self._idle)
+
+    def peer_id(self, peername: str) -> Optional[str]:
+        return self._peer_ids.get(peername)
+
+    async def dial(self, ip: str, port: int) -> Peer:
+        """An open connection to the address, reused when there is an idle one"""
+        idle = self._idle.pop(peer_to_str(ip, port), None)
+        if idle is not None:
+            return idle
+        peer = self._peer_factory(ip, port)
+        try:
+            async with self._dial_slots:
+                self._peer_ids[peer.peername] = await asyncio.wait_for(peer.handshake(), self._timeout)
+        except BaseException:
+            await peer.close()
+            raise
+        return peer
+
+    async def dial_all(self, addresses: Iterable[tuple[str, int]]) -> list[DialResult]:
+        """Handshake every address concurrently, connected peers stay idle in the pool"""
+        results: list[DialResult] = await asyncio.gather(
+            *(self.dial(ip, port) for ip, port in addresses), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Peer):
+                self.release(result)
+            else:
+                logger.info(f"Handshake failed: {type(result).__name__} {result}")
+        return results
+
+    def release(self, peer: Peer) -> None:
+        """Hand a healthy connection back for a later phase"""
+        if peer.closed.is_set():
+            return
+        self._idle[peer.peername] = peer
+
+    def take_all(self) -> list[Peer]:
+        peers = list(self._idle.values())
+        self._idle.clear()
+        return peers
+
+    async def close(self) -> None:
+        peers = self.take_all()
+        await asyncio.gather(*(peer.close() for peer in peers), return_exceptions=True)
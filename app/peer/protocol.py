@@ -0,0 +1,215 @@
+from asyncio import (
+    BaseTransport,
+    BufferedProtocol,
+    Future,
+    Transport,
+    get_running_loop,
+)
+from collections import deque
+from typing import Any, Callable, Optional, cast
+
+from app.const import HANDSHAKE_SIZE_BYTES, MAX_MESSAGE_BYTES, RECEIVE_CHUNK_BYTES
+from app.exceptions import ReaderClosedError, WriterClosedError, WrongPacketFormatError
+from app.logging_config import get_logger
+from app.packets import HandshakePacket, PeerPacket
+
+logger = get_logger(__name__)
+
+LENGTH_PREFIX_BYTES = 4
+MIN_FREE_BYTES = 4 * 1024
+
+Message = HandshakePacket | PeerPacket
+
+
+class PeerProtocol(BufferedProtocol):  # noqa: WPS214, WPS230
+    """Length-prefixed framing straight out of the socket receive buffer.
+
+    Bytes are received into a chunk that is filled front to back and never compacted,
+    so payloads are handed out as memoryviews into it. When the free tail gets small a
+    fresh chunk is started; the old one lives as long as someone holds a payload view.
+    """
+
+    def __init__(
+        self,
+        peername: str,
+        chunk_size: int = RECEIVE_CHUNK_BYTES,
+        on_connected: Optional[Callable[["PeerProtocol"], None]] = None,
+    ) -> None:
+        self._peername = peername
+        self._on_connected = on_connected
+        self._chunk_size = chunk_size
+        self._chunk = bytearray(chunk_size)
+        self._start = 0
+        self._end = 0
+        self._handshake_done = False
+        self._messages: deque[Message] = deque()
+        self._read_waiter: Optional[Future[None]] = None
+        self._drain_waiter: Optional[Future[None]] = None
+        self._paused = False
+        self._closed: Optional[Future[None]] = None
+        self._exception: Optional[Exception] = None
+        self._transport: Optional[Transport] = None
+
+    def __str__(self) -> str:
+        return self._peername
+
+    @property
+    def peername(self) -> str:
+        return self._peername
+
+    # asyncio.BufferedProtocol
+
+    def connection_made(self, transport: BaseTransport) -> None:
+        self._transport = cast(Transport, transport)
+        self._closed = get_running_loop().create_future()
+        if self._on_connected is not None:
+            # Accepted connection: name it after the remote end
+            address = transport.get_extra_info("peername")
+            if address is not None:
+                self._peername = f"[{address[0]}:{address[1]}]"
+            self._on_connected(self)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        logger.debug(f"{self}: connection lost: {exc}")
+        self._exception = ReaderClosedError(f"Connection lost: {exc}")
+        self._wake_reader()
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_exception(WriterClosedError(f"Connection lost: {exc}"))
+        if self._closed is not None and not self._closed.done():
+            self._closed.set_result(None)
+
+    def eof_received(self) -> bool:
+        self._exception = ReaderClosedError("EOF")
+        self._wake_reader()
+        return False
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if len(self._chunk) - self._end < MIN_FREE_BYTES:
+            self._new_chunk(self._chunk_size)
+        return memoryview(self._chunk)[self._end :]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self._end += nbytes
+        try:
+            self._frame()
+        except Exception as e:
+            self._exception = e
+            if self._transport is not None:
+                self._transport.close()
+        self._wake_reader()
+
+    def pause_writing(self) -> None:
+        self._paused = True
+
+    def resume_writing(self) -> None:
+        self._paused = False
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_result(None)
+
+    # Reading
+
+    def pause_reading(self) -> None:
+        """Leave bytes in the socket: its buffer fills and TCP flow control holds the peer back"""
+        if self._transport is not None and not self._transport.is_closing():
+            self._transport.pause_reading()
+
+    def resume_reading(self) -> None:
+        if self._transport is not None and not self._transport.is_closing():
+            self._transport.resume_reading()
+
+    async def read_handshake(self) -> HandshakePacket:
+        message = await self._read()
+        if not isinstance(message, HandshakePacket):
+            raise NotImplementedError
+        return message
+
+    async def read_packet(self) -> PeerPacket:
+        message = await self._read()
+        if not isinstance(message, PeerPacket):
+            raise NotImplementedError
+        return message
+
+    # StreamWriter-compatible writing
+
+    def write(self, data: bytes | memoryview) -> None:
+        if self._transport is None or self._transport.is_closing():
+            raise WriterClosedError("Transport is closed")
+        self._transport.write(data)
+
+    def writelines(self, chunks: list[bytes | memoryview]) -> None:
+        if self._transport is None or self._transport.is_closing():
+            raise WriterClosedError("Transport is closed")
+        self._transport.writelines(chunks)
+
+    async def drain(self) -> None:
+        if self._transport is None or self._transport.is_closing():
+            raise WriterClosedError("Transport is closed")
+        if not self._paused:
+            return
+        self._drain_waiter = get_running_loop().create_future()
+        await self._drain_waiter
+
+    def is_closing(self) -> bool:
+        return self._transport is None or self._transport.is_closing()
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+
+    async def wait_closed(self) -> None:
+        if self._closed is not None:
+            await self._closed
+
+    def get_extra_info(self, name: str, default: Any = None) -> Any:
+        if self._transport is None:
+            return default
+        return self._transport.get_extra_info(name, default)
+
+    # Internals
+
+    async def _read(self) -> Message:
+        while not self._messages:
+            if self._exception is not None:
+                raise self._exception
+            self._read_waiter = get_running_loop().create_future()
+            try:
+                await self._read_waiter
+            finally:
+                self._read_waiter = None
+        return self._messages.popleft()
+
+    def _wake_reader(self) -> None:
+        if self._read_waiter is not None and not self._read_waiter.done():
+            self._read_waiter.set_result(None)
+
+    def _frame(self) -> None:
+        view = memoryview(self._chunk)
+        if not self._handshake_done:
+            if self._end - self._start < HANDSHAKE_SIZE_BYTES:
+                return
+            handshake_end = self._start + HANDSHAKE_SIZE_BYTES
+            self._messages.append(HandshakePacket.from_bytes(view[self._start : handshake_end]))
+            self._start = handshake_end
+            self._handshake_done = True
+        while self._end - self._start >= LENGTH_PREFIX_BYTES:
+            message_start = self._start + LENGTH_PREFIX_BYTES
+            length = int.from_bytes(view[self._start : message_start])
+            if length > MAX_MESSAGE_BYTES:
+                # Checked before the chunk grows to fit it, the peer picks the length
+                raise WrongPacketFormatError(f"{self}: {length} byte message")
+            message_end = message_start + length
+            if message_end > self._end:
+                if message_end > len(self._chunk):
+                    self._new_chunk(max(self._chunk_size, LENGTH_PREFIX_BYTES + length))
+                return
+            self._messages.append(PeerPacket.from_buffer(view[message_start:message_end]))
+            self._start = message_end
+
+    def _new_chunk(self, size: int) -> None:
+        """Carry the unparsed tail into a new chunk, the old one is never written again"""
+        leftover = self._end - self._start
+        chunk = bytearray(max(size, leftover + MIN_FREE_BYTES))
+        chunk[:leftover] = self._chunk[self._start : self._end]
+        self._chunk = chunk
+        self._start = 0
+        self._end = leftover
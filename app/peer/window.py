@@ -0,0 +1,95 @@
+import math
+import time
+from typing import Callable, Hashable
+
+from app.const import (
+    BLOCK_SIZE_BYTES,
+    INITIAL_CONCURRENT_REQUESTS,
+    MAX_CONCURRENT_REQUESTS,
+    MIN_CONCURRENT_REQUESTS,
+)
+
+RATE_SAMPLE_SECONDS = 0.5
+RATE_SMOOTHING = 0.3
+
+Clock = Callable[[], float]
+
+
+class RequestWindow:  # noqa: WPS230
+    """Outstanding-request depth sized to twice the measured bandwidth-delay product.
+
+    The round-trip time is the smallest one seen, so requests queued behind our own
+    pipeline do not inflate it, and the factor of two lets the window keep growing
+    while the link still has headroom.
+    """
+
+    def __init__(
+        self,
+        min_depth: int = MIN_CONCURRENT_REQUESTS,
+        max_depth: int = MAX_CONCURRENT_REQUESTS,
+        clock: Clock = time.monotonic,
+    ) -> None:
+        if not 0 < min_depth <= max_depth:
+            raise ValueError(f"min_depth = {min_depth} max_depth = {max_depth}")
+        self._min_depth = min_depth
+        self._max_depth = max_depth
+        self._clock = clock
+        self._sent_at: dict[Hashable, float] = dict()
+        self._min_rtt = math.inf
+        self._rate = 0.0
+        self._sample_start = clock()
+        self._sample_bytes = 0
+        self._depth = max(min_depth, min(INITIAL_CONCURRENT_REQUESTS, max_depth))
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    @property
+    def rate(self) -> float:
+        """Smoothed throughput in bytes per second"""
+        return self._rate
+
+    @property
+    def rtt(self) -> float:
+        return self._min_rtt
+
+    def cap(self, limit: int) -> None:
+        """Lower the largest depth, e.g. to the request queue a peer advertises"""
+        self._max_depth = max(1, min(self._max_depth, limit))
+        self._min_depth = min(self._min_depth, self._max_depth)
+        self._depth = max(self._min_depth, min(self._depth, self._max_depth))
+
+    def sent(self, key: Hashable) -> None:
+        self._sent_at[key] = self._clock()
+
+    def forget(self, key: Hashable) -> None:
+        self._sent_at.pop(key, None)
+
+    def received(self, key: Hashable, size: int) -> bool:
+        """Account for a block, return True if the depth changed"""
+        now = self._clock()
+        sent_at = self._sent_at.pop(key, None)
+        if sent_at is not None:
+            self._min_rtt = min(self._min_rtt, now - sent_at)
+        self._sample_bytes += size
+        elapsed = now - self._sample_start
+        if elapsed < RATE_SAMPLE_SECONDS:
+            return False
+        sample_rate = self._sample_bytes / elapsed
+        if self._rate == 0:
+            self._rate = sample_rate
+        else:
+            self._rate += RATE_SMOOTHING * (sample_rate - self._rate)
+        self._sample_start = now
+        self._sample_bytes = 0
+        return self._resize()
+
+    def _resize(self) -> bool:
+        if math.isinf(self._min_rtt):
+            return False
+        bdp_blocks = self._rate * self._min_rtt / BLOCK_SIZE_BYTES
+        depth = max(self._min_depth, min(self._max_depth, math.ceil(2 * bdp_blocks)))
+        changed = depth != self._depth
+        self._depth = depth
+        return changed
@@ -1,120 +1,424 @@
 import asyncio
+import heapq
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Iterable, Optional
+from typing import Callable, Optional, Sequence
 
-from app.const import BLOCK_SIZE_BYTES
+from app.bitfield import Bitfield
+from app.const import BLOCK_SIZE_BYTES, PIECE_DEADLINE_SECONDS
 from app.logging_config import get_logger
-from app.packets import RequestPayload, RequestPeerPacket
+from app.scheduler import PieceBlock, PieceScheduler
+from app.storage import Storage
 from app.torrent_file import TorrentFile
+from app.verifier import PieceSpan, PieceVerifier
 
 logger = get_logger(__name__)
 
 PeerAndPiece = tuple[str, int]
 
+# Piece index, offset and length of a block, as sent in REQUEST and CANCEL
+BlockRequest = tuple[int, int, int]
+CancelCallback = Callable[[int, int, int], None]
+Clock = Callable[[], float]
 
-@dataclass(frozen=True)
-class PieceBlock:
-    piece_index: int
-    block_index: int
+# Owner slot of a block nobody is asked for
+NO_PEER = 0
 
 
-class Pieces:  # noqa: WPS214
-    def __init__(
-        self, torrent_file: TorrentFile, piece_index: Optional[int] = None
+@dataclass
+class _PeerHooks:
+    cancel: CancelCallback
+    depth: Callable[[], int]
+
+
+class Pieces:  # noqa: WPS214, WPS230
+    """Block bookkeeping of a download, in flat arrays indexed by block number.
+
+    Only per-piece arrays and bitfields are built up front: a block is a number, its
+    request tuple and REQUEST bytes are made when it is handed out. The first peer asked
+    for a block is its owner, as a small slot number; only endgame adds more requesters.
+
+    In sequential mode the scheduler prefers the pieces after a playback cursor. Blocks
+    of those pieces get a deadline, later the further they are from the cursor, and one
+    still missing at its deadline is requested again from the next peer that asks.
+    """
+
+    def __init__(  # noqa: WPS211
+        self,
+        torrent_file: TorrentFile,
+        storage: Storage,
+        piece_index: Optional[int] = None,
+        already_verified: Optional[Bitfield] = None,
+        sequential: bool = False,
+        deadline_seconds: float = PIECE_DEADLINE_SECONDS,
+        clock: Clock = time.monotonic,
+        hash_executor: Optional[ThreadPoolExecutor] = None,
     ) -> None:
-        self._length = torrent_file.length
-        self._request_packets: dict[PieceBlock, RequestPeerPacket] = dict()
-        self._queue: asyncio.Queue[PieceBlock] = asyncio.Queue()
-        self._ready_blocks: dict[PieceBlock, bytes] = dict()
-        self._in_progress: dict[str, set[PieceBlock]] = dict()
+        self._storage = storage
+        self._torrent_file = torrent_file
+        self._piece_length = torrent_file.piece_length
+        self._blocks_per_piece = -(-torrent_file.piece_length // BLOCK_SIZE_BYTES)
+        self._changed = asyncio.Event()
+        self._in_progress: dict[str, set[int]] = dict()
+        self._hooks: dict[str, _PeerHooks] = dict()
+        self._endgame = False
+        self._suppliers: dict[int, set[str]] = dict()
+        self._corrupt_suppliers: dict[str, int] = dict()
+        self._done_event = asyncio.Event()
         self._piece_count = len(torrent_file.piece_hashes)
-        if piece_index is None:
-            piece_range: Iterable[int] = range(self._piece_count)
-        else:
-            piece_range = [piece_index]
-        for piece_index in piece_range:
-            if piece_index == self._piece_count - 1:
-                piece_length = torrent_file.length % torrent_file.piece_length
-            else:
-                piece_length = torrent_file.piece_length
-            blocks_count = piece_length // BLOCK_SIZE_BYTES
-            for block_index in range(blocks_count):
-                self._add_to_queue(piece_index=piece_index, block_index=block_index)
-            if piece_length % BLOCK_SIZE_BYTES > 0:
-                self._add_to_queue(
-                    piece_index=piece_index,
-                    block_index=blocks_count,
-                    length=piece_length % BLOCK_SIZE_BYTES,
-                )
+        self._first_piece = 0 if piece_index is None else piece_index
+        self._verified = Bitfield(self._piece_count)
+        missing = self._missing_pieces(piece_index, already_verified)
+        self._wanted_count = self._piece_count if piece_index is None else 1
+        self._scheduler = PieceScheduler(
+            piece_count=self._piece_count,
+            wanted=missing,
+            blocks_count=self._blocks_count,
+        )
+        block_count = self._piece_count * self._blocks_per_piece
+        self._blocks_left = array("I", [self._blocks_per_piece]) * self._piece_count
+        self._blocks_left[-1] = self._blocks_count(self._piece_count - 1)
+        self._done = Bitfield(block_count)
+        self._owners = array("I", [NO_PEER]) * block_count
+        self._extra_requesters: dict[int, set[int]] = dict()
+        self._peer_slots: dict[str, int] = dict()
+        self._slot_peers: dict[int, str] = dict()
+        self._next_slot = NO_PEER + 1
+        self._verified_listeners: list[Callable[[int], None]] = []
+        self._deadline_seconds = deadline_seconds
+        self._clock = clock
+        self._deadlines: list[tuple[float, int]] = []
+        if sequential:
+            self.set_cursor(self._first_piece)
+        self._remaining_blocks = self._total(missing, self._blocks_per_piece, self._blocks_left[-1])
+        self._left = self._total(missing, self._piece_length, torrent_file.piece_size(self._piece_count - 1))
+        self._downloaded = 0
+        self._verifier = PieceVerifier(
+            storage=storage,
+            piece_hashes=torrent_file.piece_hashes,
+            on_verified=self._on_verified,
+            executor=hash_executor,
+        )
+        if self.is_done:
+            self._done_event.set()
 
     @property
     def is_done(self) -> bool:
-        return len(self._ready_blocks) == len(self._request_packets)
+        return self._verified.count == self._wanted_count
 
     @property
-    def done_blocks(self) -> set[PieceBlock]:
-        return set(self._ready_blocks.keys())
+    def in_endgame(self) -> bool:
+        return self._endgame
 
-    def return_in_queue(self, peername: str) -> None:
-        block_index_set = self._in_progress.pop(peername, None)
-        if block_index_set is None:
-            logger.error(
-                f"peername = {peername} self._in_progress = {self._in_progress}"
-            )
+    @property
+    def verified(self) -> Bitfield:
+        return self._verified
+
+    @property
+    def left(self) -> int:
+        """Bytes of wanted pieces not verified yet, as reported to trackers"""
+        return self._left
+
+    @property
+    def downloaded(self) -> int:
+        return self._downloaded
+
+    @property
+    def peers(self) -> int:
+        """Peers that told which pieces they have"""
+        return len(self._scheduler.peers)
+
+    @property
+    def corrupt_suppliers(self) -> dict[str, int]:
+        return self._corrupt_suppliers
+
+    async def wait_done(self) -> None:
+        await self._done_event.wait()
+
+    async def run_verifier(self) -> None:
+        await self._verifier.run()
+
+    def add_peer(self, peername: str, bitfield: bytes = b"") -> None:
+        self._scheduler.add_peer(peername, Bitfield(self._piece_count, bitfield))
+        self._notify()
+
+    def attach_peer(
+        self, peername: str, cancel: CancelCallback, depth: Callable[[], int]
+    ) -> None:
+        """Let endgame mode cancel duplicate requests and see the peer's request window"""
+        self._hooks[peername] = _PeerHooks(cancel=cancel, depth=depth)
+
+    @property
+    def cursor(self) -> Optional[int]:
+        """First piece not verified from where playback reads, None unless sequential"""
+        return self._scheduler.cursor
+
+    def set_cursor(self, piece_index: int) -> None:
+        """Download the pieces from piece_index on first, e.g. where a player seeks to"""
+        while piece_index < self._piece_count - 1 and self._verified[piece_index]:
+            piece_index += 1
+        if piece_index != self._scheduler.cursor:
+            self._scheduler.set_cursor(piece_index)
+            self._notify()
+
+    def watch_verified(self, callback: Callable[[int], None]) -> None:
+        self._verified_listeners.append(callback)
+
+    def peer_has(self, peername: str, piece_index: int) -> None:
+        if not 0 <= piece_index < self._piece_count:
+            logger.error(f"{peername}: HAVE for piece_index = {piece_index}")
             raise NotImplementedError
-        for block_index in block_index_set:
-            self._queue.put_nowait(block_index)
+        self._scheduler.peer_has(peername, piece_index)
+        self._notify()
+
+    def return_in_queue(self, peername: str) -> None:
+        self._scheduler.remove_peer(peername)
+        self._hooks.pop(peername, None)
+        self.release_blocks(peername)
+        slot = self._peer_slots.pop(peername, NO_PEER)
+        self._slot_peers.pop(slot, None)
+
+    def release_blocks(self, peername: str) -> None:
+        """Queue again the blocks asked of a peer that will not send them, e.g. as it chokes"""
+        slot = self._peer_slots.get(peername, NO_PEER)
+        for block in self._in_progress.pop(peername, set()):
+            if self._drop_requester(block, slot):
+                self._scheduler.return_block(PieceBlock(*divmod(block, self._blocks_per_piece)))
+        self._notify()
 
-    async def get_request_packet(self, peername: str) -> RequestPeerPacket:
-        piece_block = await self._queue.get()
-        if piece_block in self._ready_blocks:
-            logger.error(f"Got {piece_block} that is in self._ready_blocks")
+    async def wait_changed(self) -> None:
+        """Wait until a peer, block or piece change may have made new requests possible"""
+        await self._changed.wait()
+
+    def next_request(self, peername: str) -> Optional[BlockRequest]:
+        block = self._next_block(peername)
+        if block is None:
+            return None
+        if self._done[block]:
+            logger.error(f"Got block {block} that is already done")
             raise NotImplementedError
+        slot = self._peer_slots.get(peername)
+        if slot is None:
+            slot = self._add_slot(peername)
+        if self._owners[block] == NO_PEER:
+            self._owners[block] = slot
+        else:
+            self._extra_requesters.setdefault(block, set()).add(slot)
         if peername not in self._in_progress:
             self._in_progress[peername] = set()
-        self._in_progress[peername].add(piece_block)
-        return self._request_packets[piece_block]
+        self._in_progress[peername].add(block)
+        return self._request(block)
 
     def put_processed(
-        self, piece_block: PieceBlock, block_value: bytes, peername: str
+        self, piece_index: int, offset: int, block_value: bytes | memoryview, peername: str
     ) -> None:
-        stored_block_value = self._ready_blocks.get(piece_block, None)
-        if stored_block_value is not None:
-            logger.error(f"Already received {piece_block}")
-            if stored_block_value != block_value:
-                logger.error("And this one has different content")
-            raise NotImplementedError
+        self._downloaded += len(block_value)
+        block_index, remainder = divmod(offset, BLOCK_SIZE_BYTES)
+        if not 0 <= piece_index < self._piece_count or remainder or block_index >= self._blocks_per_piece:
+            logger.warning(f"{peername}: no block at piece {piece_index} offset {offset}")
+            return
+        block = piece_index * self._blocks_per_piece + block_index
         allocated = self._in_progress.get(peername)
-        if allocated is None:
-            logger.error(f"There is no {peername} in {self._in_progress}")
-            logger.error(f"self._in_progress = {self._in_progress}")
-            raise NotImplementedError
-        if piece_block not in allocated:
-            logger.error(f"There is no {piece_block} in allocated = {allocated}")
-            raise NotImplementedError
-        allocated.remove(piece_block)
-        self._ready_blocks[piece_block] = block_value
+        if allocated is not None:
+            allocated.discard(block)
+        if self._done[block]:
+            logger.debug(f"{peername}: duplicate piece {piece_index} offset {offset}")
+            return
+        slot = self._peer_slots.get(peername, NO_PEER)
+        requesters = self._requesters(block)
+        if slot not in requesters:
+            # A late answer to a cancelled request, possibly for a piece reset since then:
+            # the block may be queued again, so taking it here would hand it out twice
+            logger.warning(f"{peername}: unrequested piece {piece_index} offset {offset}")
+            return
+        self._owners[block] = NO_PEER
+        self._extra_requesters.pop(block, None)
+        self._cancel_duplicates(block, requesters - {slot})
+        self._storage.write(self._offset(piece_index, block_index), block_value)
+        self._done.set(block)
+        self._remaining_blocks -= 1
+        if self._endgame:
+            self._notify()
+        self._suppliers.setdefault(piece_index, set()).add(peername)
+        self._blocks_left[piece_index] -= 1
+        if self._blocks_left[piece_index] == 0:
+            self._scheduler.piece_finished(piece_index)
+            self._verifier.submit(
+                PieceSpan(
+                    piece_index=piece_index,
+                    offset=self._offset(piece_index, 0),
+                    length=self._torrent_file.piece_size(piece_index),
+                )
+            )
 
-    def blocks(self) -> Iterable[bytes]:
-        if not self.is_done:
-            raise NotImplementedError
-        ready_blocks = sorted(
-            self._ready_blocks.keys(), key=lambda x: (x.piece_index, x.block_index)
-        )
-        for index in ready_blocks:
-            yield self._ready_blocks[index]
+    def _on_verified(self, piece_index: int, is_valid: bool) -> None:
+        suppliers = self._suppliers.pop(piece_index, set())
+        if is_valid:
+            self._verified.set(piece_index)
+            self._left -= self._torrent_file.piece_size(piece_index)
+            if piece_index == self._scheduler.cursor:
+                self.set_cursor(piece_index)
+            for listener in self._verified_listeners:
+                listener(piece_index)
+            if self.is_done:
+                self._done_event.set()
+            return
+        logger.warning(f"Piece {piece_index} is corrupt, suppliers = {suppliers}")
+        for peername in suppliers:
+            self._corrupt_suppliers[peername] = self._corrupt_suppliers.get(peername, 0) + 1
+        blocks_count = self._blocks_count(piece_index)
+        self._blocks_left[piece_index] = blocks_count
+        self._remaining_blocks += blocks_count
+        self._endgame = False
+        first_block = piece_index * self._blocks_per_piece
+        for block in range(first_block, first_block + blocks_count):
+            self._done.clear(block)
+        self._scheduler.reset_piece(piece_index)
+        self._notify()
 
-    def _add_to_queue(
-        self, block_index: int, piece_index: int, length: int = BLOCK_SIZE_BYTES
-    ) -> None:
-        piece_block = PieceBlock(piece_index=piece_index, block_index=block_index)
-        if piece_block in self._request_packets:
-            raise NotImplementedError
-        self._request_packets[piece_block] = RequestPeerPacket(
-            payload=RequestPayload(
-                piece_index=piece_index,
-                offset=block_index * BLOCK_SIZE_BYTES,
-                length=length,
-            ).to_bytes
-        )
-        self._queue.put_nowait(piece_block)
+    def _missing_pieces(
+        self, piece_index: Optional[int], already_verified: Optional[Bitfield]
+    ) -> Sequence[int]:
+        """Wanted pieces not verified yet, in order; verified ones are marked on the way"""
+        wanted = range(self._piece_count) if piece_index is None else range(piece_index, piece_index + 1)
+        if already_verified is None or not already_verified.count:
+            return wanted
+        missing: list[int] = []
+        for index in wanted:
+            if already_verified[index]:
+                self._verified.set(index)
+            else:
+                missing.append(index)
+        return missing
+
+    def _total(self, pieces: Sequence[int], per_piece: int, last_piece: int) -> int:
+        """Sum over sorted pieces of a quantity only the last piece has less of"""
+        total = len(pieces) * per_piece
+        if pieces and pieces[-1] == self._piece_count - 1:
+            total -= per_piece - last_piece
+        return total
+
+    def _add_slot(self, peername: str) -> int:
+        slot = self._next_slot
+        self._next_slot += 1
+        self._peer_slots[peername] = slot
+        self._slot_peers[slot] = peername
+        return slot
+
+    def _requesters(self, block: int) -> set[int]:
+        owner = self._owners[block]
+        if owner == NO_PEER:
+            return set()
+        return {owner} | self._extra_requesters.get(block, set())
+
+    def _drop_requester(self, block: int, slot: int) -> bool:
+        """Forget a peer was asked for the block, True if nobody is asked for it any more"""
+        extra = self._extra_requesters.get(block)
+        if self._owners[block] == slot:
+            self._owners[block] = extra.pop() if extra else NO_PEER
+        elif extra is not None:
+            extra.discard(slot)
+        if extra is not None and not extra:
+            del self._extra_requesters[block]  # noqa: WPS420
+        return self._owners[block] == NO_PEER
+
+    def _next_block(self, peername: str) -> Optional[int]:
+        if self._deadlines:
+            overdue = self._overdue_block(peername)
+            if overdue is not None:
+                return overdue
+        piece_block = self._scheduler.next_block(peername)
+        if piece_block is not None:
+            block = piece_block.piece_index * self._blocks_per_piece + piece_block.block_index
+            if self._scheduler.in_window(piece_block.piece_index):
+                self._set_deadline(block)
+            return block
+        if not self._endgame:
+            window = sum(hooks.depth() for hooks in self._hooks.values())
+            if self._remaining_blocks > window:
+                return None
+            logger.info(f"Endgame: {self._remaining_blocks} blocks left, request window {window}")
+            self._endgame = True
+        return self._endgame_block(peername)
+
+    def _set_deadline(self, block: int) -> None:
+        cursor = self._scheduler.cursor or 0
+        distance = max(block // self._blocks_per_piece - cursor, 0)
+        deadline = self._clock() + self._deadline_seconds * (1 + distance)
+        heapq.heappush(self._deadlines, (deadline, block))
+
+    def _overdue_block(self, peername: str) -> Optional[int]:  # noqa: WPS231
+        """A block past its deadline the peer was not asked for yet, asked again with a new one"""
+        have = self._scheduler.peers.get(peername)
+        if have is None:
+            return None
+        slot = self._peer_slots.get(peername, NO_PEER)
+        now = self._clock()
+        skipped: list[tuple[float, int]] = []
+        chosen: Optional[int] = None
+        while self._deadlines and self._deadlines[0][0] <= now:
+            entry = heapq.heappop(self._deadlines)
+            block = entry[1]
+            requesters = self._requesters(block)
+            if not requesters:
+                # Arrived or handed back, a new request sets a new deadline
+                continue
+            if slot in requesters or not have[block // self._blocks_per_piece]:
+                skipped.append(entry)
+                continue
+            chosen = block
+            break
+        for entry in skipped:
+            heapq.heappush(self._deadlines, entry)
+        if chosen is not None:
+            logger.debug(f"{peername}: block {chosen} is overdue, asked again")
+            heapq.heappush(self._deadlines, (now + self._deadline_seconds, chosen))
+        return chosen
+
+    def _endgame_block(self, peername: str) -> Optional[int]:
+        have = self._scheduler.peers.get(peername)
+        if have is None:
+            return None
+        slot = self._peer_slots.get(peername, NO_PEER)
+        in_flight = set().union(*self._in_progress.values())
+        candidates = [
+            (len(requesters), block)
+            for block, requesters in ((block, self._requesters(block)) for block in in_flight)
+            if requesters and slot not in requesters and have[block // self._blocks_per_piece]
+        ]
+        if not candidates:
+            return None
+        _, block = min(candidates, key=lambda candidate: candidate[0])
+        return block
+
+    def _cancel_duplicates(self, block: int, slots: set[int]) -> None:
+        if not slots:
+            return
+        piece_index, offset, length = self._request(block)
+        for slot in slots:
+            peername = self._slot_peers.get(slot)
+            if peername is None:
+                continue
+            self._in_progress.get(peername, set()).discard(block)
+            hooks = self._hooks.get(peername)
+            if hooks is not None:
+                hooks.cancel(piece_index, offset, length)
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _blocks_count(self, piece_index: int) -> int:
+        return -(-self._torrent_file.piece_size(piece_index) // BLOCK_SIZE_BYTES)
+
+    def _offset(self, piece_index: int, block_index: int) -> int:
+        piece_offset = (piece_index - self._first_piece) * self._piece_length
+        return piece_offset + block_index * BLOCK_SIZE_BYTES
+
+    def _request(self, block: int) -> BlockRequest:
+        piece_index, block_index = divmod(block, self._blocks_per_piece)
+        offset = block_index * BLOCK_SIZE_BYTES
+        length = min(BLOCK_SIZE_BYTES, self._torrent_file.piece_size(piece_index) - offset)
+        return piece_index, offset, length
@@ -0,0 +1,214 @@
+import asyncio
+import mimetypes
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+from urllib.parse import unquote, urlsplit
+
+from app.const import RANGE_SERVER_CHUNK_BYTES
+from app.exceptions import RangeNotSatisfiableError
+from app.logging_config import get_logger
+from app.pieces import Pieces
+from app.torrent_file import TorrentFile
+
+logger = get_logger(__name__)
+
+Reader = Callable[[int, int], bytes]
+
+
+@dataclass(frozen=True)
+class ByteRange:
+    start: int
+    end: int
+
+
+@dataclass(frozen=True)
+class _Resource:
+    name: str
+    offset: int
+    length: int
+
+
+def parse_range(header: Optional[str], length: int) -> Optional[ByteRange]:
+    """The one byte range a Range header asks for, None to send the whole resource.
+
+    Headers this server does not handle, such as several ranges, are ignored as HTTP
+    allows; a range starting past the end raises RangeNotSatisfiableError.
+    """
+    if header is None:
+        return None
+    unit, _, spec = header.partition("=")
+    first, dash, last = spec.strip().partition("-")
+    if unit.strip().lower() != "bytes" or "," in spec or not dash:
+        return None
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0 or length == 0:
+                raise RangeNotSatisfiableError(header)
+            return ByteRange(max(length - suffix, 0), length)
+        start = int(first)
+        end = min(int(last) + 1, length) if last else length
+    except ValueError:
+        return None
+    if start >= length:
+        raise RangeNotSatisfiableError(header)
+    if end <= start:
+        return None
+    return ByteRange(start, end)
+
+
+def _resources(torrent_file: TorrentFile) -> dict[str, _Resource]:
+    if not torrent_file.is_multi_file:
+        resource = _Resource(torrent_file.name, 0, torrent_file.length)
+        return {"/": resource, f"/{torrent_file.name}": resource}
+    resources: dict[str, _Resource] = dict()
+    offset = 0
+    for entry in torrent_file.files:
+        resources["/" + "/".join(entry.path)] = _Resource(entry.path[-1], offset, entry.length)
+        offset += entry.length
+    return resources
+
+
+def _head(status: str, headers: dict[str, str]) -> bytes:
+    lines = [f"HTTP/1.1 {status}", *(f"{name}: {value}" for name, value in headers.items()), "", ""]
+    return "\r\n".join(lines).encode("latin-1")
+
+
+class RangeServer:  # noqa: WPS214
+    """Serves the files of a torrent over HTTP while they download, Range requests included.
+
+    A response streams piece by piece and only waits where a piece is not verified yet.
+    Every request and every wait moves the download cursor there, so the pieces a player
+    is about to read are the ones fetched first.
+    """
+
+    def __init__(
+        self,
+        torrent_file: TorrentFile,
+        read: Reader,
+        pieces: Pieces,
+        chunk_bytes: int = RANGE_SERVER_CHUNK_BYTES,
+    ) -> None:
+        self._read = read
+        self._pieces = pieces
+        self._piece_length = torrent_file.piece_length
+        self._chunk_bytes = chunk_bytes
+        self._resources = _resources(torrent_file)
+        self._waiters: dict[int, list[asyncio.Future[None]]] = dict()
+        self._tasks: set[asyncio.Task[Any]] = set()
+        self._server: Optional[asyncio.Server] = None
+        pieces.watch_verified(self._piece_verified)
+
+    @property
+    def port(self) -> int:
+        if self._server is None:
+            raise NotImplementedError
+        return int(self._server.sockets[0].getsockname()[1])
+
+    async def start(self, host: str, port: int) -> None:
+        self._server = await asyncio.start_server(self._serve, host, port)
+        logger.info(f"HTTP: serving {sorted(self._resources)} on http://{host}:{self.port}")
+
+    def set_reader(self, read: Reader) -> None:
+        """Read from somewhere else from now on, e.g. the complete file once it is renamed"""
+        self._read = read
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def _piece_verified(self, piece_index: int) -> None:
+        for waiter in self._waiters.pop(piece_index, []):
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        if task is None:
+            raise NotImplementedError
+        self._tasks.add(task)
+        try:
+            while await self._respond(reader, writer):
+                logger.debug("HTTP: connection kept alive")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError) as e:
+            logger.debug(f"HTTP: client gone: {type(e).__name__} {e}")
+        finally:
+            self._tasks.discard(task)
+            writer.close()
+
+    async def _respond(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """Answer one request, True if the connection stays open for the next one"""
+        lines = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+        request_line = lines[0].split(" ")
+        if len(request_line) != 3:
+            writer.write(_head("400 Bad Request", {"Content-Length": "0", "Connection": "close"}))
+            await writer.drain()
+            return False
+        method, target, version = request_line
+        headers: dict[str, str] = dict()
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        logger.info(f"HTTP: {method} {target} range {headers.get('range')}")
+        resource = self._resources.get(unquote(urlsplit(target).path))
+        if method not in {"GET", "HEAD"}:
+            writer.write(_head("405 Method Not Allowed", {"Allow": "GET, HEAD", "Content-Length": "0"}))
+        elif resource is None:
+            writer.write(_head("404 Not Found", {"Content-Length": "0"}))
+        else:
+            await self._send(writer, resource, headers.get("range"), with_body=method == "GET")
+        await writer.drain()
+        return keep_alive
+
+    async def _send(
+        self, writer: asyncio.StreamWriter, resource: _Resource, range_header: Optional[str], with_body: bool
+    ) -> None:
+        try:
+            byte_range = parse_range(range_header, resource.length)
+        except RangeNotSatisfiableError:
+            writer.write(
+                _head(
+                    "416 Range Not Satisfiable",
+                    {"Content-Range": f"bytes */{resource.length}", "Content-Length": "0"},
+                )
+            )
+            return
+        headers = {
+            "Content-Type": mimetypes.guess_type(resource.name)[0] or "application/octet-stream",
+            "Accept-Ranges": "bytes",
+        }
+        if byte_range is None:
+            status = "200 OK"
+            byte_range = ByteRange(0, resource.length)
+        else:
+            status = "206 Partial Content"
+            headers["Content-Range"] = f"bytes {byte_range.start}-{byte_range.end - 1}/{resource.length}"
+        headers["Content-Length"] = str(byte_range.end - byte_range.start)
+        writer.write(_head(status, headers))
+        start = resource.offset + byte_range.start
+        if with_body and byte_range.end > byte_range.start:
+            self._pieces.set_cursor(start // self._piece_length)
+            await self._send_body(writer, start, resource.offset + byte_range.end)
+
+    async def _send_body(self, writer: asyncio.StreamWriter, offset: int, end: int) -> None:
+        while offset < end:
+            piece_index = offset // self._piece_length
+            await self._wait_verified(piece_index)
+            chunk_end = min(end, (piece_index + 1) * self._piece_length, offset + self._chunk_bytes)
+            writer.write(self._read(offset, chunk_end - offset))
+            await writer.drain()
+            offset = chunk_end
+
+    async def _wait_verified(self, piece_index: int) -> None:
+        if self._pieces.verified[piece_index]:
+            return
+        self._pieces.set_cursor(piece_index)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(piece_index, []).append(waiter)
+        logger.info(f"HTTP: waiting for piece {piece_index}")
+        await waiter
@@ -0,0 +1,101 @@
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from app.const import BLOCK_SIZE_BYTES
+
+Clock = Callable[[], float]
+
+
+@dataclass(frozen=True)
+class RateLimits:
+    """Byte rates per second of one torrent, None where there is no limit"""
+
+    download: Optional[float] = None
+    upload: Optional[float] = None
+    # Of every connection, in each direction
+    peer: Optional[float] = None
+
+
+class TokenBucket:
+    """A byte rate with a burst allowance, refilled from the clock whenever it is asked.
+
+    There is no timer: a caller that finds too few tokens is told how long to wait. A
+    bucket under a parent passes bytes only when its ancestors can pay for them too and
+    charges them all, which nests a peer's limit in its torrent's and that in the global;
+    a chain is read with one clock reading, so the buckets of one chain share a clock.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: Optional[float] = None,
+        clock: Clock = time.monotonic,
+        parent: Optional["TokenBucket"] = None,
+    ) -> None:
+        if rate <= 0:
+            raise NotImplementedError
+        self._rate = rate
+        # At least one block, or a block request could never be afforded
+        self._burst = max(burst if burst is not None else rate, BLOCK_SIZE_BYTES)
+        self._clock = clock
+        self._parent = parent
+        self._tokens = self._burst
+        self._updated = clock()
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @property
+    def clock(self) -> Clock:
+        return self._clock
+
+    def delay(self, amount: int) -> float:
+        """Seconds until amount bytes may pass, 0 if they may now; delay(0) is the time to clear a debt"""
+        now = self._clock()
+        wait = 0.0
+        bucket: Optional[TokenBucket] = self
+        while bucket is not None:
+            bucket._refill(now)
+            if bucket._tokens < amount:
+                wait = max(wait, (amount - bucket._tokens) / bucket._rate)
+            bucket = bucket._parent
+        return wait
+
+    def take(self, amount: int) -> None:
+        """Charge bytes that passed, the tokens go negative for bytes that came unasked"""
+        now = self._clock()
+        bucket: Optional[TokenBucket] = self
+        while bucket is not None:
+            bucket._refill(now)
+            bucket._tokens -= amount
+            bucket = bucket._parent
+
+    def give_back(self, amount: int) -> None:
+        """Refund bytes taken for a transfer that will not happen"""
+        now = self._clock()
+        bucket: Optional[TokenBucket] = self
+        while bucket is not None:
+            bucket._refill(now)
+            bucket._tokens = min(bucket._tokens + amount, bucket._burst)
+            bucket = bucket._parent
+
+    def _refill(self, now: float) -> None:
+        if now > self._updated:
+            self._tokens = min(self._tokens + (now - self._updated) * self._rate, self._burst)
+            self._updated = now
+
+
+def nested_bucket(
+    parent: Optional[TokenBucket], rate: Optional[float], clock: Optional[Clock] = None
+) -> Optional[TokenBucket]:
+    """The bucket of one level: a new one under parent if the level has a rate, else parent itself.
+
+    Levels without a limit are skipped, so they cost nothing per block.
+    """
+    if not rate:
+        return parent
+    if clock is None:
+        clock = parent.clock if parent is not None else time.monotonic
+    return TokenBucket(rate, clock=clock, parent=parent)
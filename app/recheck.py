@@ -0,0 +1,120 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Iterable
+
+from app.bitfield import Bitfield
+from app.const import VERIFY_READ_BYTES
+from app.logging_config import get_logger
+from app.torrent_file import TorrentFile
+
+logger = get_logger(__name__)
+
+Reader = Callable[[int, int], bytes]
+
+IN_FLIGHT_PER_WORKER = 2
+
+
+def _piece_ok(read: Reader, offset: int, length: int, expected: bytes) -> bool:
+    # pread and sha1 of a large buffer both release the GIL, so threads use every core
+    return hashlib.sha1(read(offset, length)).digest() == expected  # noqa: DUO130
+
+
+async def recheck(
+    read: Reader,
+    torrent_file: TorrentFile,
+    piece_indices: Iterable[int],
+    max_workers: int = os.cpu_count() or 1,
+) -> Bitfield:
+    """Hash pieces on a thread pool, the result has the bits of the pieces that match"""
+    loop = asyncio.get_running_loop()
+    good = Bitfield(len(torrent_file.piece_hashes))
+    in_flight: set[asyncio.Future[bool]] = set()
+    index_of: dict[asyncio.Future[bool], int] = dict()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="recheck") as executor:
+        for piece_index in piece_indices:
+            future = loop.run_in_executor(
+                executor,
+                _piece_ok,
+                read,
+                piece_index * torrent_file.piece_length,
+                torrent_file.piece_size(piece_index),
+                torrent_file.piece_hashes[piece_index],
+            )
+            in_flight.add(future)
+            index_of[future] = piece_index
+            if len(in_flight) >= max_workers * IN_FLIGHT_PER_WORKER:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                _collect(done, index_of, good)
+        if in_flight:
+            done, _ = await asyncio.wait(in_flight)
+            _collect(done, index_of, good)
+    return good
+
+
+def _collect(
+    done: set[asyncio.Future[bool]], index_of: dict[asyncio.Future[bool], int], good: Bitfield
+) -> None:
+    for future in done:
+        if future.result():
+            good.set(index_of.pop(future))
+        else:
+            index_of.pop(future)
+
+
+@dataclass(frozen=True)
+class VerifyReport:
+    bad_pieces: list[int]
+    hashed_bytes: int
+    seconds: float
+
+    @property
+    def megabytes_per_second(self) -> float:
+        return self.hashed_bytes / max(self.seconds, 1e-9) / 1e6
+
+
+def _bad_in_chunk(
+    chunk: bytes, first_piece: int, piece_length: int, piece_hashes: list[bytes]
+) -> list[int]:
+    view = memoryview(chunk)
+    bad: list[int] = []
+    for offset in range(0, len(chunk), piece_length):
+        piece_index = first_piece + offset // piece_length
+        digest = hashlib.sha1(view[offset : offset + piece_length]).digest()  # noqa: DUO130
+        if digest != piece_hashes[piece_index]:
+            bad.append(piece_index)
+    return bad
+
+
+def verify_stream(
+    read: Reader,
+    torrent_file: TorrentFile,
+    max_workers: int = os.cpu_count() or 1,
+    read_bytes: int = VERIFY_READ_BYTES,
+) -> VerifyReport:
+    """Hash all the data: one thread reads big sequential chunks, the pool hashes them.
+
+    Chunks are a whole number of pieces, and at most two per worker are held in memory.
+    """
+    piece_length = torrent_file.piece_length
+    chunk_bytes = max(read_bytes // piece_length, 1) * piece_length
+    start = time.perf_counter()
+    bad: list[int] = []
+    pending: deque[Future[list[int]]] = deque()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="verify") as executor:
+        for offset in range(0, torrent_file.length, chunk_bytes):
+            chunk = read(offset, min(chunk_bytes, torrent_file.length - offset))
+            pending.append(
+                executor.submit(
+                    _bad_in_chunk, chunk, offset // piece_length, piece_length, torrent_file.piece_hashes
+                )
+            )
+            if len(pending) >= IN_FLIGHT_PER_WORKER * max_workers:
+                bad += pending.popleft().result()
+        while pending:
+            bad += pending.popleft().result()
+    return VerifyReport(bad_pieces=bad, hashed_bytes=torrent_file.length, seconds=time.perf_counter() - start)
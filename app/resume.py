@@ -0,0 +1,128 @@
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from app.bencode import Bencode, Dict, Integer, String
+from app.bitfield import Bitfield
+from app.const import RESUME_SAVE_SECONDS
+from app.exceptions import NeedMoreBytesError, WrongBencodeFormatError
+from app.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+TEMPORARY_SUFFIX = ".tmp"
+
+
+class ResumeFile:
+    """Fast-resume state of a partial download: verified pieces plus what they refer to.
+
+    The pieces are only trusted while the info hash and the size and mtime of the part
+    file match what was saved with them; a changed mtime means the file was written
+    after the last save, so the pieces marked in it have to be rechecked.
+    """
+
+    def __init__(self, path: str, info_hash: bytes, piece_count: int) -> None:
+        self._path = path
+        self._info_hash = info_hash
+        self._piece_count = piece_count
+        self._saved_at = 0.0
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def load(self, data_path: str) -> tuple[Bitfield, bool]:
+        """Pieces marked verified and whether they can be trusted without a recheck"""
+        empty = Bitfield(self._piece_count)
+        try:
+            with open(self._path, "rb") as file:
+                raw_data = file.read()
+            size, mtime = _stat(data_path)
+        except FileNotFoundError:
+            return empty, True
+        state = _parse(raw_data)
+        if state is None or state.info_hash != self._info_hash:
+            logger.warning(f"{self._path}: not a resume file for this torrent, ignored")
+            return empty, True
+        if state.length != size:
+            logger.warning(f"{self._path}: {data_path} changed size, starting over")
+            return empty, True
+        pieces = Bitfield(self._piece_count, state.pieces)
+        trusted = state.mtime == mtime
+        if not trusted:
+            logger.warning(f"{self._path}: {data_path} was modified after the last save")
+        logger.info(f"{self._path}: {pieces.count} of {self._piece_count} pieces verified")
+        return pieces, trusted
+
+    def save(self, verified: Bitfield, data_path: str) -> None:
+        size, mtime = _stat(data_path)
+        state = Dict(
+            {
+                "info hash": String(self._info_hash),
+                "length": Integer(size),
+                "mtime": Integer(mtime),
+                "pieces": String(verified.to_bytes),
+            }
+        )
+        temporary_path = self._path + TEMPORARY_SUFFIX
+        with open(temporary_path, "wb") as file:
+            file.write(state.to_bytes)
+        os.replace(temporary_path, self._path)
+        self._saved_at = time.monotonic()
+
+    def save_soon(self, verified: Bitfield, data_path: str) -> None:
+        """Save unless the last save is fresher than RESUME_SAVE_SECONDS"""
+        if time.monotonic() - self._saved_at >= RESUME_SAVE_SECONDS:
+            self.save(verified, data_path)
+
+    def remove(self) -> None:
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            logger.debug(f"{self._path} is already gone")
+
+
+def _stat(data_path: str) -> tuple[int, int]:
+    """Size and mtime of the part file, for a directory the total size and latest mtime"""
+    stat = os.stat(data_path)
+    if not os.path.isdir(data_path):
+        return stat.st_size, stat.st_mtime_ns
+    size = 0
+    mtime = stat.st_mtime_ns
+    for directory, _, filenames in os.walk(data_path):
+        for filename in filenames:
+            file_stat = os.stat(os.path.join(directory, filename))
+            size += file_stat.st_size
+            mtime = max(mtime, file_stat.st_mtime_ns)
+    return size, mtime
+
+
+@dataclass(frozen=True)
+class _State:
+    info_hash: bytes
+    length: int
+    mtime: int
+    pieces: bytes
+
+
+def _parse(raw_data: bytes) -> Optional[_State]:
+    try:
+        remainder, state = Bencode.from_bytes(raw_data)
+    except (NeedMoreBytesError, WrongBencodeFormatError) as e:
+        logger.warning(f"Broken resume file: {e}")
+        return None
+    if len(remainder) > 0 or not isinstance(state, Dict):
+        return None
+    info_hash = state.data.get("info hash")
+    length = state.data.get("length")
+    mtime = state.data.get("mtime")
+    pieces = state.data.get("pieces")
+    if not (
+        isinstance(info_hash, String)
+        and isinstance(length, Integer)
+        and isinstance(mtime, Integer)
+        and isinstance(pieces, String)
+    ):
+        return None
+    return _State(info_hash=info_hash.data, length=length.data, mtime=mtime.data, pieces=pieces.data)
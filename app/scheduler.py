@@ -0,0 +1,234 @@
+import heapq
+import random
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+from app.bitfield import Bitfield
+from app.const import SEQUENTIAL_RAREST_EVERY, SEQUENTIAL_WINDOW_PIECES
+from app.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+MAX_SKIPPED_CANDIDATES = 64
+HEAP_COMPACTION_FACTOR = 4
+
+
+@dataclass(frozen=True)
+class PieceBlock:
+    piece_index: int
+    block_index: int
+
+
+class PieceScheduler:  # noqa: WPS214, WPS230
+    """Rarest-first piece selection with whole pieces assigned to one peer.
+
+    Unstarted pieces sit in a heap keyed by availability, so picking the rarest piece a
+    peer has is O(log n) unless the peer lacks the first candidates. Pieces no peer has
+    stay out until one announces them, or they would be the first candidates of every
+    pick and push it to a scan of all pieces once there are many of them. Stale heap entries
+    are skipped lazily and the heap is rebuilt once they dominate it. Whether a piece is
+    unstarted is one byte per piece, not a set entry.
+
+    With a cursor set, new pieces come from the window of pieces after it, in order, so
+    a player reading there gets them first; every rarest_every-th pick still goes to the
+    rarest piece, which keeps the swarm's rare pieces flowing.
+    """
+
+    def __init__(
+        self,
+        piece_count: int,
+        wanted: Iterable[int],
+        blocks_count: Callable[[int], int],
+        window: int = SEQUENTIAL_WINDOW_PIECES,
+        rarest_every: int = SEQUENTIAL_RAREST_EVERY,
+    ) -> None:
+        self._piece_count = piece_count
+        self._window = window
+        self._rarest_every = rarest_every
+        self._cursor: Optional[int] = None
+        self._picks = 0
+        self._blocks_count = blocks_count
+        self._availability: list[int] = [0] * piece_count
+        self._unstarted = bytearray(piece_count)
+        for piece_index in wanted:
+            self._unstarted[piece_index] = 1
+        self._unstarted_count = self._unstarted.count(1)
+        self._heap: list[tuple[int, float, int]] = []
+        self._peers: dict[str, Bitfield] = dict()
+        self._pending: dict[int, deque[int]] = dict()
+        self._owner: dict[int, str] = dict()
+        self._owned: dict[str, list[int]] = dict()
+        self._orphaned: set[int] = set()
+        self._rebuild_heap()
+
+    @property
+    def peers(self) -> dict[str, Bitfield]:
+        return self._peers
+
+    @property
+    def cursor(self) -> Optional[int]:
+        return self._cursor
+
+    def set_cursor(self, piece_index: Optional[int]) -> None:
+        """Prefer the pieces from piece_index on, None goes back to rarest first only"""
+        self._cursor = piece_index
+
+    def in_window(self, piece_index: int) -> bool:
+        if self._cursor is None:
+            return False
+        return self._cursor <= piece_index < self._cursor + self._window
+
+    def availability(self, piece_index: int) -> int:
+        return self._availability[piece_index]
+
+    def add_peer(self, peername: str, have: Optional[Bitfield] = None) -> None:
+        if peername in self._peers:
+            self.remove_peer(peername)
+        bitfield = have if have is not None else Bitfield(self._piece_count)
+        self._peers[peername] = bitfield
+        self._owned[peername] = []
+        for piece_index in bitfield:
+            self._change_availability(piece_index, 1)
+
+    def peer_has(self, peername: str, piece_index: int) -> None:
+        bitfield = self._peers.get(peername)
+        if bitfield is None:
+            self.add_peer(peername)
+            bitfield = self._peers[peername]
+        if bitfield.set(piece_index):
+            self._change_availability(piece_index, 1)
+
+    def remove_peer(self, peername: str) -> None:
+        bitfield = self._peers.pop(peername, None)
+        if bitfield is None:
+            return
+        for piece_index in bitfield:
+            self._change_availability(piece_index, -1)
+        for piece_index in self._owned.pop(peername, []):
+            if self._owner.get(piece_index) == peername:
+                del self._owner[piece_index]  # noqa: WPS420
+                self._orphaned.add(piece_index)
+
+    def next_block(self, peername: str) -> Optional[PieceBlock]:
+        owned = self._owned.get(peername)
+        if owned is None:
+            return None
+        while owned:
+            pending = self._pending.get(owned[0])
+            if pending:
+                return PieceBlock(piece_index=owned[0], block_index=pending.popleft())
+            self._owner.pop(owned.pop(0), None)
+        piece_index = self._claim_orphan(peername)
+        if piece_index is None:
+            piece_index = self._pick(peername)
+        if piece_index is None:
+            return None
+        self._owner[piece_index] = peername
+        owned.append(piece_index)
+        return PieceBlock(piece_index=piece_index, block_index=self._pending[piece_index].popleft())
+
+    def return_block(self, piece_block: PieceBlock) -> None:
+        piece_index = piece_block.piece_index
+        pending = self._pending.get(piece_index)
+        if pending is None:
+            return
+        pending.appendleft(piece_block.block_index)
+        if piece_index not in self._owner:
+            self._orphaned.add(piece_index)
+
+    def piece_finished(self, piece_index: int) -> None:
+        self._pending.pop(piece_index, None)
+        self._orphaned.discard(piece_index)
+        self._owner.pop(piece_index, None)
+
+    def reset_piece(self, piece_index: int) -> None:
+        self.piece_finished(piece_index)
+        if not self._unstarted[piece_index]:
+            self._unstarted[piece_index] = 1
+            self._unstarted_count += 1
+        self._push(piece_index)
+
+    def _claim_orphan(self, peername: str) -> Optional[int]:
+        have = self._peers[peername]
+        for piece_index in self._orphaned:
+            if have[piece_index] and self._pending.get(piece_index):
+                self._orphaned.discard(piece_index)
+                return piece_index
+        return None
+
+    def _pick(self, peername: str) -> Optional[int]:
+        if self._cursor is not None:
+            self._picks += 1
+            if self._picks % self._rarest_every:
+                piece_index = self._pick_in_window(peername)
+                if piece_index is not None:
+                    self._start(piece_index)
+                    return piece_index
+        return self._pick_rarest(peername)
+
+    def _pick_in_window(self, peername: str) -> Optional[int]:
+        if self._cursor is None:
+            raise NotImplementedError
+        have = self._peers[peername]
+        for piece_index in range(self._cursor, min(self._cursor + self._window, self._piece_count)):
+            if self._unstarted[piece_index] and have[piece_index]:
+                return piece_index
+        return None
+
+    def _start(self, piece_index: int) -> None:
+        self._unstarted[piece_index] = 0
+        self._unstarted_count -= 1
+        self._pending[piece_index] = deque(range(self._blocks_count(piece_index)))
+
+    def _pick_rarest(self, peername: str) -> Optional[int]:  # noqa: WPS231
+        have = self._peers[peername]
+        skipped: list[tuple[int, float, int]] = []
+        chosen: Optional[int] = None
+        while self._heap and len(skipped) < MAX_SKIPPED_CANDIDATES:
+            entry = heapq.heappop(self._heap)
+            availability, _, piece_index = entry
+            if not self._unstarted[piece_index]:
+                continue
+            if availability != self._availability[piece_index]:
+                continue
+            if have[piece_index]:
+                chosen = piece_index
+                break
+            skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        if chosen is None and len(skipped) == MAX_SKIPPED_CANDIDATES:
+            chosen = self._scan_rarest(have)
+        if chosen is None:
+            return None
+        self._start(chosen)
+        return chosen
+
+    def _scan_rarest(self, have: Bitfield) -> Optional[int]:
+        candidates = [piece for piece in have if self._unstarted[piece]]
+        if not candidates:
+            return None
+        return min(candidates, key=self._availability.__getitem__)
+
+    def _change_availability(self, piece_index: int, delta: int) -> None:
+        self._availability[piece_index] += delta
+        if self._unstarted[piece_index]:
+            self._push(piece_index)
+
+    def _push(self, piece_index: int) -> None:
+        if not self._availability[piece_index]:
+            return
+        if len(self._heap) > HEAP_COMPACTION_FACTOR * max(self._unstarted_count, 1):
+            self._rebuild_heap()
+            return
+        entry = (self._availability[piece_index], random.random(), piece_index)  # noqa: S311
+        heapq.heappush(self._heap, entry)
+
+    def _rebuild_heap(self) -> None:
+        self._heap = [
+            (self._availability[piece_index], random.random(), piece_index)  # noqa: S311
+            for piece_index, unstarted in enumerate(self._unstarted)
+            if unstarted and self._availability[piece_index]
+        ]
+        heapq.heapify(self._heap)
@@ -0,0 +1,48 @@
+from collections import OrderedDict
+from typing import Callable
+
+from app.const import BLOCK_CACHE_BYTES
+
+Reader = Callable[[int, int], bytes]
+
+
+class BlockCache:
+    """LRU of whole pieces read from disk, blocks are served as views into them.
+
+    Leechers ask for the blocks of a piece one after another, so reading the piece once
+    turns a pread per 16 KiB block into a pread per piece.
+    """
+
+    def __init__(
+        self,
+        read: Reader,
+        piece_length: int,
+        piece_size: Callable[[int], int],
+        capacity_bytes: int = BLOCK_CACHE_BYTES,
+    ) -> None:
+        self._read = read
+        self._piece_length = piece_length
+        self._piece_size = piece_size
+        self._capacity_bytes = capacity_bytes
+        self._pieces: OrderedDict[int, bytes] = OrderedDict()
+        self._cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, piece_index: int, offset: int, length: int) -> memoryview:
+        piece = self._pieces.get(piece_index)
+        if piece is None:
+            self.misses += 1
+            piece = self._read(piece_index * self._piece_length, self._piece_size(piece_index))
+            self._store(piece_index, piece)
+        else:
+            self.hits += 1
+            self._pieces.move_to_end(piece_index)
+        return memoryview(piece)[offset : offset + length]
+
+    def _store(self, piece_index: int, piece: bytes) -> None:
+        self._pieces[piece_index] = piece
+        self._cached_bytes += len(piece)
+        while self._cached_bytes > self._capacity_bytes and len(self._pieces) > 1:
+            _, evicted = self._pieces.popitem(last=False)
+            self._cached_bytes -= len(evicted)
@@ -0,0 +1,46 @@
+import random
+from dataclasses import dataclass
+
+from app.const import OPTIMISTIC_UNCHOKE_ROUNDS, UPLOAD_SLOTS
+
+
+@dataclass
+class LeecherStats:
+    interested: bool
+    rate: float
+
+
+class Choker:
+    """Tit-for-tat unchoking with a rotating optimistic slot.
+
+    Each round the interested peers with the best rate get slots - 1 slots and one more
+    goes to a random choked peer, which is kept for OPTIMISTIC_UNCHOKE_ROUNDS rounds so it
+    has time to prove itself.
+    """
+
+    def __init__(self, slots: int = UPLOAD_SLOTS, rng: random.Random | None = None) -> None:
+        self._slots = slots
+        self._rng = rng or random.Random()
+        self._optimistic: str | None = None
+        self._rounds = 0
+
+    @property
+    def slots(self) -> int:
+        return self._slots
+
+    @property
+    def optimistic(self) -> str | None:
+        return self._optimistic
+
+    def rechoke(self, leechers: dict[str, LeecherStats]) -> set[str]:
+        interested = [peername for peername, stats in leechers.items() if stats.interested]
+        if len(interested) <= self._slots:
+            self._optimistic = None
+            return set(interested)
+        ranked = sorted(interested, key=lambda peername: leechers[peername].rate, reverse=True)
+        regular = set(ranked[: self._slots - 1])
+        choked = [peername for peername in interested if peername not in regular]
+        if self._optimistic not in choked or self._rounds % OPTIMISTIC_UNCHOKE_ROUNDS == 0:
+            self._optimistic = self._rng.choice(choked)
+        self._rounds += 1
+        return regular | {self._optimistic}
@@ -0,0 +1,219 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from app.bitfield import Bitfield
+from app.const import MAX_REQUEST_BYTES, MY_ID, RECHOKE_SECONDS, UPLOAD_SLOTS, MessageType
+from app.exceptions import ReaderClosedError, WriterClosedError
+from app.logging_config import get_logger
+from app.packets import HandshakePacket, PeerPacket, RequestPeerPacket
+from app.peer.async_writer import AsyncWriterHandler
+from app.peer.protocol import PeerProtocol
+from app.rate_limit import TokenBucket, nested_bucket
+from app.seeding.block_cache import BlockCache
+from app.seeding.choker import Choker, LeecherStats
+
+logger = get_logger(__name__)
+
+Clock = Callable[[], float]
+
+
+@dataclass
+class _Leecher:
+    protocol: PeerProtocol
+    writer: AsyncWriterHandler
+    interested: bool = False
+    choked: bool = True
+    uploaded: int = 0
+    uploaded_at_rechoke: int = 0
+    flush_task: Optional[asyncio.Task[None]] = None
+    rate_limit: Optional[TokenBucket] = None
+    tasks: set[asyncio.Task[None]] = field(default_factory=set)
+
+
+class SeedServer:  # noqa: WPS214, WPS230
+    """Accepts incoming peers and answers their REQUESTs from verified pieces"""
+
+    def __init__(  # noqa: WPS211
+        self,
+        info_hash: bytes,
+        have: Bitfield,
+        cache: BlockCache,
+        piece_size: Callable[[int], int],
+        slots: int = UPLOAD_SLOTS,
+        rechoke_seconds: float = RECHOKE_SECONDS,
+        clock: Clock = time.monotonic,
+        rate_limit: Optional[TokenBucket] = None,
+        peer_rate: Optional[float] = None,
+    ) -> None:
+        self._info_hash = info_hash
+        self._have = have
+        self._cache = cache
+        self._piece_size = piece_size
+        self._choker = Choker(slots)
+        self._rechoke_seconds = rechoke_seconds
+        self._clock = clock
+        self._rate_limit = rate_limit
+        self._peer_rate = peer_rate
+        self._leechers: dict[str, _Leecher] = dict()
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._server: Optional[asyncio.Server] = None
+        self._last_rechoke = clock()
+        self.uploaded = 0
+
+    @property
+    def port(self) -> int:
+        if self._server is None:
+            raise NotImplementedError
+        return int(self._server.sockets[0].getsockname()[1])
+
+    @property
+    def leechers(self) -> int:
+        return len(self._leechers)
+
+    async def start(self, host: str, port: int) -> None:
+        self._server = await asyncio.get_running_loop().create_server(
+            lambda: PeerProtocol("incoming", on_connected=self._accept), host, port
+        )
+        self._tasks.add(asyncio.create_task(self._rechoke_loop(), name="rechoke"))
+        logger.info(f"Seeding on {host}:{self.port}")
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def have_piece(self, piece_index: int) -> None:
+        """Tell connected leechers about a piece that just got verified"""
+        have = PeerPacket(message_type=MessageType.HAVE, payload=piece_index.to_bytes(4))
+        for leecher in self._leechers.values():
+            self._send(leecher, have.to_bytes)
+
+    def _accept(self, protocol: PeerProtocol) -> None:
+        task = asyncio.create_task(self._serve(protocol), name=f"{protocol} seed")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _serve(self, protocol: PeerProtocol) -> None:
+        closed = asyncio.Event()
+        writer = AsyncWriterHandler(protocol, peername=protocol.peername, closed_event=closed)
+        leecher = _Leecher(
+            protocol=protocol, writer=writer, rate_limit=nested_bucket(self._rate_limit, self._peer_rate)
+        )
+        try:
+            handshake = await protocol.read_handshake()
+            if handshake.info_hash != self._info_hash:
+                logger.info(f"{protocol}: handshake for an unknown torrent")
+                return
+            writer.queue(
+                HandshakePacket(info_hash=self._info_hash, peer_id_bytes=MY_ID, extension_enabled=False).to_bytes
+            )
+            writer.queue(PeerPacket(message_type=MessageType.BITFIELD, payload=self._have.to_bytes).to_bytes)
+            await writer.flush()
+            self._leechers[protocol.peername] = leecher
+            while True:
+                self._process(leecher, await protocol.read_packet())
+                if leecher.rate_limit is not None and leecher.rate_limit.delay(0):
+                    # Requests wait in the socket while the upload budget is in debt
+                    # instead of blocks piling up in the writer
+                    await _pay_debt(protocol, leecher.rate_limit)
+        except (ReaderClosedError, WriterClosedError) as e:
+            logger.debug(f"{protocol}: leecher gone: {e}")
+        finally:
+            self._leechers.pop(protocol.peername, None)
+            for task in leecher.tasks:
+                task.cancel()
+            closed.set()
+
+    def _process(self, leecher: _Leecher, packet: PeerPacket) -> None:
+        match packet.message_type:  # noqa: WPS242
+            case MessageType.INTERESTED:
+                leecher.interested = True
+                if leecher.choked and self._unchoked_count() < self._choker.slots:
+                    # A free slot need not wait for the next round
+                    self._set_choked(leecher, choked=False)
+            case MessageType.NOT_INTERESTED:
+                leecher.interested = False
+            case MessageType.REQUEST:
+                self._serve_request(leecher, RequestPeerPacket(payload=packet.payload))
+            case _:
+                # KEEPALIVE, HAVE, BITFIELD and CANCEL need no answer: blocks are sent
+                # as soon as they are requested, so there is nothing left to cancel
+                return
+
+    def _serve_request(self, leecher: _Leecher, request: RequestPeerPacket) -> None:
+        payload = request.parsed_payload
+        if leecher.choked:
+            return
+        piece_index = payload.piece_index
+        if (
+            not 0 <= piece_index < len(self._have)
+            or not self._have[piece_index]
+            or not 0 < payload.length <= MAX_REQUEST_BYTES
+            or payload.offset + payload.length > self._piece_size(piece_index)
+        ):
+            logger.info(f"{leecher.protocol}: bad request {payload}")
+            leecher.protocol.close()
+            return
+        block = self._cache.get(piece_index, payload.offset, payload.length)
+        header = (9 + len(block)).to_bytes(4) + bytes([MessageType.PIECE]) + request.payload[:8]
+        self._send(leecher, header, block)
+        leecher.uploaded += len(block)
+        self.uploaded += len(block)
+        if leecher.rate_limit is not None:
+            leecher.rate_limit.take(len(block))
+
+    def _send(self, leecher: _Leecher, *chunks: bytes | memoryview) -> None:
+        for chunk in chunks:
+            leecher.writer.queue(chunk)
+        if leecher.flush_task is None or leecher.flush_task.done():
+            leecher.flush_task = asyncio.create_task(self._flush(leecher))
+            leecher.tasks.add(leecher.flush_task)
+            leecher.flush_task.add_done_callback(leecher.tasks.discard)
+
+    async def _flush(self, leecher: _Leecher) -> None:
+        try:
+            await leecher.writer.flush()
+        except WriterClosedError as e:
+            logger.debug(f"{leecher.protocol}: flush failed: {e}")
+
+    def _unchoked_count(self) -> int:
+        return sum(not leecher.choked for leecher in self._leechers.values())
+
+    def _set_choked(self, leecher: _Leecher, choked: bool) -> None:
+        leecher.choked = choked
+        message_type = MessageType.CHOKE if choked else MessageType.UNCHOKE
+        self._send(leecher, PeerPacket(message_type=message_type).to_bytes)
+
+    async def _rechoke_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._rechoke_seconds)
+            self._rechoke()
+
+    def _rechoke(self) -> None:
+        now = self._clock()
+        elapsed = max(now - self._last_rechoke, 1e-3)
+        self._last_rechoke = now
+        stats: dict[str, LeecherStats] = dict()
+        for peername, leecher in self._leechers.items():
+            rate = (leecher.uploaded - leecher.uploaded_at_rechoke) / elapsed
+            leecher.uploaded_at_rechoke = leecher.uploaded
+            stats[peername] = LeecherStats(interested=leecher.interested, rate=rate)
+        unchoked = self._choker.rechoke(stats)
+        for peername, leecher in self._leechers.items():
+            choked = peername not in unchoked
+            if choked != leecher.choked:
+                self._set_choked(leecher, choked)
+
+
+async def _pay_debt(protocol: PeerProtocol, rate_limit: TokenBucket) -> None:
+    protocol.pause_reading()
+    try:
+        while debt := rate_limit.delay(0):
+            await asyncio.sleep(debt)
+    finally:
+        protocol.resume_reading()
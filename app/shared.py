@@ -0,0 +1,49 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from app.const import DAEMON_MAX_PEERS, MAX_CONCURRENT_DIALS
+from app.peer.manager import ConnectionBudget
+from app.rate_limit import TokenBucket
+from app.tracker.http_pool import HttpPool
+from app.tracker.udp import UdpTrackerClient
+
+
+@dataclass
+class SharedResources:
+    """What the torrents of one process share instead of each having its own.
+
+    One connection budget and set of dial slots, one pool of hashing threads, one
+    download budget, and tracker clients whose connections serve every torrent.
+    """
+
+    connections: ConnectionBudget
+    dial_slots: asyncio.Semaphore
+    hash_executor: ThreadPoolExecutor
+    http_pool: HttpPool
+    udp: UdpTrackerClient
+    download_rate: Optional[TokenBucket] = None
+
+    @classmethod
+    def create(
+        cls,
+        max_peers: int = DAEMON_MAX_PEERS,
+        max_dialing: int = MAX_CONCURRENT_DIALS,
+        hash_workers: int = os.cpu_count() or 1,
+        download_rate: Optional[float] = None,
+    ) -> "SharedResources":
+        return cls(
+            connections=ConnectionBudget(max_peers),
+            dial_slots=asyncio.Semaphore(max_dialing),
+            hash_executor=ThreadPoolExecutor(max_workers=hash_workers, thread_name_prefix="sha1"),
+            http_pool=HttpPool(),
+            udp=UdpTrackerClient(),
+            download_rate=TokenBucket(download_rate) if download_rate else None,
+        )
+
+    async def close(self) -> None:
+        self.udp.close()
+        await self.http_pool.close()
+        self.hash_executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,261 @@
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from types import TracebackType
+from typing import Optional, Self
+
+from app.const import MAX_OPEN_FILES
+from app.file_spans import FileSpanIndex
+from app.logging_config import get_logger
+from app.torrent_file import FileEntry
+
+logger = get_logger(__name__)
+
+PARTIAL_SUFFIX = ".part"
+
+
+class Storage:
+    """Writes go to path + ".part", which replaces path once the download succeeds.
+
+    With keep_partial the part file survives a failed or interrupted download, so the
+    next run can resume from it; otherwise it is removed. For a multi-file torrent path
+    is a directory and the ".part" one holds every file of it.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        length: int,
+        keep_partial: bool = False,
+        files: Optional[list[FileEntry]] = None,
+    ) -> None:
+        self._path = path
+        self._keep_partial = keep_partial
+        self._partial_path = path + PARTIAL_SUFFIX
+        self._length = length
+        self._is_directory = files is not None
+        paths, lengths = _layout(self._partial_path, length, files)
+        for file_path, file_length in zip(paths, lengths):
+            _preallocate(file_path, file_length)
+        self._files = _FileSet(paths, lengths, writable=True)
+        logger.info(f"Storage: {self._partial_path} preallocated {length} bytes in {len(paths)} files")
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        if exc_type is None:
+            self.finish()
+        elif self._keep_partial:
+            self.close()
+        else:
+            self.discard()
+
+    @property
+    def length(self) -> int:
+        return self._length
+
+    @property
+    def partial_path(self) -> str:
+        return self._partial_path
+
+    def write(self, offset: int, data: bytes | memoryview) -> None:
+        self._files.write(offset, data)
+
+    def read(self, offset: int, length: int) -> bytes:
+        return self._files.read(offset, length)
+
+    def finish(self) -> None:
+        """Close the partial file and move it to the target path"""
+        self.close()
+        os.replace(self._partial_path, self._path)
+
+    def discard(self) -> None:
+        self.close()
+        try:
+            if self._is_directory:
+                shutil.rmtree(self._partial_path)
+            else:
+                os.remove(self._partial_path)
+        except FileNotFoundError:
+            logger.debug(f"Storage: {self._partial_path} is already gone")
+
+    def close(self) -> None:
+        self._files.close()
+
+
+class FileReader:
+    """Read-only access to complete files, for seeding and checking them.
+
+    Bytes missing from a file, short or absent, read as zeros: their pieces fail the
+    hash check instead of stopping it. `mismatches` tells which files are affected.
+    """
+
+    def __init__(self, path: str, length: int, files: Optional[list[FileEntry]] = None) -> None:
+        paths, lengths = _layout(path, length, files)
+        self._length = length
+        self._mismatches: list[str] = []
+        for file_path, file_length in zip(paths, lengths):
+            size = _size(file_path)
+            if size != file_length:
+                self._mismatches.append(f"{file_path} has {size} bytes, expected {file_length}")
+        self._files = _FileSet(paths, lengths, writable=False)
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    @property
+    def length(self) -> int:
+        return self._length
+
+    @property
+    def mismatches(self) -> list[str]:
+        return list(self._mismatches)
+
+    def read(self, offset: int, length: int) -> bytes:
+        return self._files.read(offset, length)
+
+    def close(self) -> None:
+        self._files.close()
+
+
+class _FileSet:
+    """Files of a torrent addressed as one byte range through a FileSpanIndex.
+
+    Torrents can hold tens of thousands of files, so descriptors are opened on demand
+    and at most MAX_OPEN_FILES stay open, least recently used closed first. The lock
+    makes reads from verifier threads safe against a write evicting their descriptor.
+    """
+
+    def __init__(self, paths: list[str], lengths: list[int], writable: bool) -> None:
+        self._paths = paths
+        self._index = FileSpanIndex(lengths)
+        self._writable = writable
+        self._fds: OrderedDict[int, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def write(self, offset: int, data: bytes | memoryview) -> None:
+        if offset < 0 or offset + len(data) > self._index.total:
+            logger.error(f"offset = {offset} len(data) = {len(data)} length = {self._index.total}")
+            raise NotImplementedError
+        view = memoryview(data)
+        position = 0
+        with self._lock:
+            for segment in self._index.segments(offset, len(data)):
+                fd = self._fd(segment.file_index)
+                _pwrite_exactly(fd, view[position : position + segment.length], segment.file_offset)
+                position += segment.length
+
+    def read(self, offset: int, length: int) -> bytes:
+        chunks: list[bytes] = []
+        with self._lock:
+            for segment in self._index.segments(offset, length):
+                fd = self._fd(segment.file_index)
+                if self._writable:
+                    chunks.append(_pread_exactly(fd, segment.file_offset, segment.length))
+                else:
+                    chunks.append(_pread_padded(fd, segment.file_offset, segment.length))
+        return b"".join(chunks)
+
+    def close(self) -> None:
+        with self._lock:
+            while self._fds:
+                _, fd = self._fds.popitem()
+                if fd >= 0:
+                    os.close(fd)
+
+    def _fd(self, file_index: int) -> int:
+        """Descriptor of a file, -1 for a file a reader cannot find"""
+        fd = self._fds.get(file_index)
+        if fd is not None:
+            self._fds.move_to_end(file_index)
+            return fd
+        if len(self._fds) >= MAX_OPEN_FILES:
+            _, evicted = self._fds.popitem(last=False)
+            if evicted >= 0:
+                os.close(evicted)
+        flags = os.O_RDWR if self._writable else os.O_RDONLY
+        try:
+            fd = os.open(self._paths[file_index], flags)
+        except FileNotFoundError:
+            if self._writable:
+                raise
+            fd = -1
+        self._fds[file_index] = fd
+        return fd
+
+
+def _layout(
+    path: str, length: int, files: Optional[list[FileEntry]]
+) -> tuple[list[str], list[int]]:
+    """Paths and lengths of the files behind path, a single file unless files is given"""
+    if files is None:
+        return [path], [length]
+    return [os.path.join(path, *entry.path) for entry in files], [entry.length for entry in files]
+
+
+def _preallocate(path: str, length: int) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        # Truncating bumps the mtime a resume file relies on, skip it when the size is right
+        if os.fstat(fd).st_size != length:
+            os.ftruncate(fd, length)
+    finally:
+        os.close(fd)
+
+
+def _size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def _pwrite_exactly(fd: int, view: memoryview, offset: int) -> None:
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def _pread_exactly(fd: int, offset: int, length: int) -> bytes:
+    chunks: list[bytes] = []
+    while length > 0:
+        chunk = os.pread(fd, length, offset)
+        if not chunk:
+            logger.error(f"offset = {offset} length = {length}: unexpected end of file")
+            raise NotImplementedError
+        chunks.append(chunk)
+        offset += len(chunk)
+        length -= len(chunk)
+    return b"".join(chunks)
+
+
+def _pread_padded(fd: int, offset: int, length: int) -> bytes:
+    chunks: list[bytes] = []
+    while length > 0 and fd >= 0:
+        chunk = os.pread(fd, length, offset)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        offset += len(chunk)
+        length -= len(chunk)
+    chunks.append(bytes(length))
+    return b"".join(chunks)
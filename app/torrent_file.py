@@ -1,29 +1,21 @@
 import hashlib
-from dataclasses import dataclass
-from typing import Any, Optional
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Optional
 
-import requests
-
-from app.bencode import Bencode, BencodeAny, Dict, Integer, String
-from app.const import MY_ID, PEER_ID_SIZE_BYTES, PIECE_HASH_SIZE_BYTES
+from app.bencode import Bencode, BencodeAny, Dict, Integer, List, String
+from app.const import PIECE_HASH_SIZE_BYTES
 from app.logging_config import get_logger
 
 logger = get_logger(__name__)
 
 
-def _fetch(url: str, params: dict[str, Any]) -> bytes:
-    r = requests.get(url, params=params, timeout=10)  # type: ignore
-    r.raise_for_status()
-    return bytes(r.content)
-
+@dataclass(frozen=True)
+class FileEntry:
+    """A file of a multi-file torrent, path relative to the torrent directory"""
 
-def _read_peer(raw_data: bytes) -> tuple[str, int]:
-    if len(raw_data) != 6:
-        logger.error(f"raw_data = {len(raw_data)} {raw_data!r}")
-        raise NotImplementedError
-    host = ".".join(map(str, raw_data[:4]))
-    port = int.from_bytes(raw_data[4:])
-    return host, port
+    path: tuple[str, ...]
+    length: int
 
 
 @dataclass
@@ -33,43 +25,51 @@ class TorrentFile:
     length: int
     piece_length: int
     piece_hashes: list[bytes]
+    announce_list: list[list[str]] = field(default_factory=list)
+    name: str = ""
+    files: list[FileEntry] = field(default_factory=list)
 
-    # no async since no parallel processes exist yet
-    def get_peers(self) -> list[tuple[str, int]]:  # noqa: WPS210
-        params: dict[str, Any] = {
-            "info_hash": self.info_hash,
-            "peer_id": MY_ID,
-            "port": 6881,
-            "uploaded": 0,
-            "downloaded": 0,
-            "left": self.length,
-            "compact": 1,
-        }
-        remainder, response = Bencode.from_bytes(_fetch(self.announce, params=params))
-        if len(remainder) > 0:
-            logger.error(f"remainder = {remainder!r}")
-            raise NotImplementedError
-        if not isinstance(response, Dict):
-            logger.error(f"response = {type(response)} {response}")
-            raise NotImplementedError
-        peers = response.data.get("peers")
-        if not isinstance(peers, String):
-            logger.error(f"type(peers) = {type(peers)}")
-            raise NotImplementedError
-        result: list[tuple[str, int]] = []
-        index = 0
-        for index in range(0, len(peers.data), PEER_ID_SIZE_BYTES):
-            peer = _read_peer(peers.data[index : index + PEER_ID_SIZE_BYTES])
-            result.append(peer)
-        return result
+    @property
+    def is_multi_file(self) -> bool:
+        return bool(self.files)
 
     @property
-    def info_hash_hex(self) -> str:
-        return hashlib.sha1(self.info.to_bytes).hexdigest()  # noqa: DUO130
+    def tiers(self) -> list[list[str]]:
+        """announce-list tiers (BEP 12), the plain announce url when there is none"""
+        if self.announce_list:
+            return [list(tier) for tier in self.announce_list]
+        return [[self.announce]]
+
+    def piece_size(self, piece_index: int) -> int:
+        if piece_index == len(self.piece_hashes) - 1:
+            return self.length - piece_index * self.piece_length
+        return self.piece_length
 
     @property
+    def info_hash_hex(self) -> str:
+        return self.info_hash.hex()
+
+    @cached_property
     def info_hash(self) -> bytes:
-        return hashlib.sha1(self.info.to_bytes).digest()  # noqa: DUO130
+        return hashlib.sha1(self.info.span).digest()  # noqa: DUO130
+
+    @classmethod
+    def from_metadata(cls, metadata: bytes, tiers: list[list[str]]) -> "TorrentFile":
+        """Torrent of an info dict fetched from peers, its bytes are kept as they came"""
+        announce_list = List([List([String(url.encode()) for url in tier]) for tier in tiers])
+        raw_data = b"".join(
+            [
+                b"d",
+                String(b"announce").to_bytes,
+                String(tiers[0][0].encode()).to_bytes,
+                String(b"announce-list").to_bytes,
+                announce_list.to_bytes,
+                String(b"info").to_bytes,
+                metadata,
+                b"e",
+            ]
+        )
+        return cls.from_bytes(raw_data)
 
     @classmethod
     def from_bytes(cls, raw_data: bytes) -> "TorrentFile":  # noqa: WPS210, WPS238
@@ -77,6 +77,9 @@ class TorrentFile:
         if len(remainder) > 0:
             logger.error(f"remainder = {remainder!r}")
             raise NotImplementedError
+        if not isinstance(content, Dict):
+            logger.error(f"type(content) = {type(content)}")
+            raise NotImplementedError
         announce: Optional[BencodeAny] = content.data.get("announce")
         if not isinstance(announce, String):
             logger.error(f"type(announce) = {type(announce)}")
@@ -85,10 +88,14 @@ class TorrentFile:
         if not isinstance(info, Dict):
             logger.error(f"type(info) = {type(info)}")
             raise NotImplementedError
+        files = _read_files(info.data.get("files"))
         length: Optional[BencodeAny] = info.data.get("length")
+        if files:
+            length = Integer(sum(entry.length for entry in files))
         if not isinstance(length, Integer):
             logger.error(f"type(length) = {type(length)}")
             raise NotImplementedError
+        name: Optional[BencodeAny] = info.data.get("name")
         piece_length: Optional[BencodeAny] = info.data.get("piece length")
         if not isinstance(piece_length, Integer):
             logger.error(f"type(piece_length) = {type(piece_length)}")
@@ -104,8 +111,48 @@ class TorrentFile:
         ]
         return TorrentFile(
             announce=announce.data.decode(),
+            announce_list=_read_announce_list(content.data.get("announce-list")),
             info=info,
             length=length.data,
             piece_length=piece_length.data,
             piece_hashes=piece_hashes,
+            name=name.data.decode() if isinstance(name, String) else "",
+            files=files,
         )
+
+
+def _read_announce_list(announce_list: Optional[BencodeAny]) -> list[list[str]]:
+    if not isinstance(announce_list, List):
+        return []
+    return [
+        [url.data.decode() for url in tier.data if isinstance(url, String)]
+        for tier in announce_list.data
+        if isinstance(tier, List)
+    ]
+
+
+def is_safe_path_part(part: str) -> bool:
+    """Names come from the network: refuse anything that could leave the directory it is joined to"""
+    return part not in {"", ".", ".."} and "/" not in part and "\\" not in part
+
+
+def _read_files(files: Optional[BencodeAny]) -> list[FileEntry]:
+    """info['files'] of a multi-file torrent, empty for a single-file one"""
+    if files is None:
+        return []
+    if not isinstance(files, List) or not files.data:
+        logger.error(f"type(files) = {type(files)}")
+        raise NotImplementedError
+    entries: list[FileEntry] = []
+    for entry in files.data:
+        length = entry.data.get("length") if isinstance(entry, Dict) else None
+        path = entry.data.get("path") if isinstance(entry, Dict) else None
+        if not isinstance(length, Integer) or length.data < 0 or not isinstance(path, List):
+            logger.error(f"files entry = {entry}")
+            raise NotImplementedError
+        parts = tuple(part.data.decode() for part in path.data if isinstance(part, String))
+        if not parts or len(parts) != len(path.data) or not all(is_safe_path_part(part) for part in parts):
+            logger.error(f"files entry path = {parts}")
+            raise NotImplementedError
+        entries.append(FileEntry(path=parts, length=length.data))
+    return entries
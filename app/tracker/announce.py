@@ -0,0 +1,139 @@
+import asyncio
+import random
+from typing import Any, Callable
+from urllib.parse import urlsplit
+
+from app.const import (
+    DEFAULT_ANNOUNCE_INTERVAL_SECONDS,
+    LISTEN_PORT,
+    MY_ID,
+    TRACKER_RETRY_SECONDS,
+)
+from app.exceptions import TrackerError
+from app.logging_config import get_logger
+from app.tracker.http_pool import HttpPool
+from app.tracker.models import AnnounceEvent, AnnounceResponse, PeerAddress, TransferStats
+from app.tracker.udp import UdpTrackerClient
+
+logger = get_logger(__name__)
+
+
+class Announcer:  # noqa: WPS214
+    """Announces to the trackers of an announce-list and keeps doing it on the tracker's schedule.
+
+    Tiers are tried in order. All trackers of a tier are asked in parallel and the first
+    answer wins; that tracker moves to the front of its tier as BEP 12 prescribes.
+    """
+
+    def __init__(
+        self,
+        info_hash: bytes,
+        tiers: list[list[str]],
+        stats: Callable[[], TransferStats],
+        on_peers: Callable[[list[PeerAddress]], None],
+        pool: HttpPool | None = None,
+        udp: UdpTrackerClient | None = None,
+        port: int = LISTEN_PORT,
+    ) -> None:
+        self._info_hash = info_hash
+        self._tiers = [random.sample(tier, len(tier)) for tier in tiers if tier]
+        self._stats = stats
+        self._on_peers = on_peers
+        # Clients passed in are shared with other torrents and stay open on close
+        self._owns_clients = pool is None, udp is None
+        self._pool = pool if pool is not None else HttpPool()
+        self._udp = udp if udp is not None else UdpTrackerClient()
+        self._port = port
+
+    @property
+    def tiers(self) -> list[list[str]]:
+        return self._tiers
+
+    async def announce(self, event: AnnounceEvent = AnnounceEvent.NONE) -> AnnounceResponse:
+        errors: list[str] = []
+        for tier in self._tiers:
+            try:
+                url, response = await self._announce_tier(tier, event)
+            except TrackerError as e:
+                errors.append(str(e))
+                continue
+            tier.remove(url)
+            tier.insert(0, url)
+            logger.info(f"{url}: {len(response.peers)} peers, next announce in {response.next_announce}s")
+            self._on_peers(response.peers)
+            return response
+        raise TrackerError(f"All trackers failed: {errors}")
+
+    async def run(self, first_delay: float) -> None:
+        """Re-announce forever: on the tracker's interval, or with a doubling backoff on errors"""
+        delay = first_delay
+        retry = TRACKER_RETRY_SECONDS
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                response = await self.announce()
+            except TrackerError as e:
+                logger.warning(f"Announce failed, retry in {retry}s: {e}")
+                delay = retry
+                retry = min(retry * 2, DEFAULT_ANNOUNCE_INTERVAL_SECONDS)
+                continue
+            delay = response.next_announce
+            retry = TRACKER_RETRY_SECONDS
+
+    async def close(self) -> None:
+        owns_pool, owns_udp = self._owns_clients
+        if owns_udp:
+            self._udp.close()
+        if owns_pool:
+            await self._pool.close()
+
+    async def _announce_tier(
+        self, tier: list[str], event: AnnounceEvent
+    ) -> tuple[str, AnnounceResponse]:
+        tasks = {
+            asyncio.create_task(self._announce_one(url, event), name=url): url for url in tier
+        }
+        errors: list[str] = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    return await next_done
+                except (TrackerError, TimeoutError, OSError, asyncio.IncompleteReadError) as e:
+                    errors.append(f"{type(e).__name__} {e}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        raise TrackerError(f"Tier {tier} failed: {errors}")
+
+    async def _announce_one(self, url: str, event: AnnounceEvent) -> tuple[str, AnnounceResponse]:
+        stats = self._stats()
+        if urlsplit(url).scheme == "udp":
+            return url, await self._udp.announce(url, self._info_hash, stats, event, self._port)
+        params: dict[str, Any] = {
+            "info_hash": self._info_hash,
+            "peer_id": MY_ID,
+            "port": self._port,
+            "uploaded": stats.uploaded,
+            "downloaded": stats.downloaded,
+            "left": stats.left,
+            "compact": 1,
+        }
+        if event != AnnounceEvent.NONE:
+            params["event"] = event.value
+        return url, AnnounceResponse.from_bytes(await self._pool.get(url, params))
+
+
+async def fetch_peers(info_hash: bytes, tiers: list[list[str]], left: int) -> list[PeerAddress]:
+    """One-off announce for the commands that only need a peer list"""
+    announcer = Announcer(
+        info_hash=info_hash,
+        tiers=tiers,
+        stats=lambda: TransferStats(left=left),
+        on_peers=lambda _: None,
+    )
+    try:
+        response = await announcer.announce(AnnounceEvent.STARTED)
+    finally:
+        await announcer.close()
+    return response.peers
@@ -0,0 +1,114 @@
+import asyncio
+from asyncio import IncompleteReadError, StreamReader, StreamWriter
+from typing import Any
+from urllib.parse import urlencode, urlsplit
+
+from app.const import TRACKER_TIMEOUT_SECONDS
+from app.exceptions import TrackerError
+from app.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+HostKey = tuple[str, str, int]
+Connection = tuple[StreamReader, StreamWriter]
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+class HttpPool:
+    """Minimal HTTP/1.1 GET client keeping idle keep-alive connections per host"""
+
+    def __init__(self, timeout: float = TRACKER_TIMEOUT_SECONDS) -> None:
+        self._timeout = timeout
+        self._idle: dict[HostKey, list[Connection]] = dict()
+        self._opened = 0
+
+    @property
+    def opened(self) -> int:
+        """Connections opened so far, reused ones are not counted"""
+        return self._opened
+
+    async def get(self, url: str, params: dict[str, Any]) -> bytes:
+        parts = urlsplit(url)
+        if parts.scheme not in DEFAULT_PORTS or parts.hostname is None:
+            raise TrackerError(f"Unsupported tracker url {url}")
+        key = (parts.scheme, parts.hostname, parts.port or DEFAULT_PORTS[parts.scheme])
+        query = "&".join(filter(None, [parts.query, urlencode(params)]))
+        request = (
+            f"GET {parts.path or '/'}?{query} HTTP/1.1\r\n"
+            + f"Host: {parts.netloc}\r\nConnection: keep-alive\r\nAccept-Encoding: identity\r\n\r\n"
+        ).encode()
+        async with asyncio.timeout(self._timeout):
+            while self._idle.get(key):
+                connection = self._idle[key].pop()
+                try:
+                    return await self._exchange(key, connection, request)
+                except (ConnectionError, IncompleteReadError) as e:
+                    # The server dropped an idle connection, try the next one
+                    logger.debug(f"{key}: stale keep-alive connection: {e}")
+            return await self._exchange(key, await self._connect(key), request)
+
+    async def close(self) -> None:
+        idle = [writer for connections in self._idle.values() for _, writer in connections]
+        self._idle.clear()
+        for writer in idle:
+            writer.close()
+        await asyncio.gather(*(writer.wait_closed() for writer in idle), return_exceptions=True)
+
+    async def _connect(self, key: HostKey) -> Connection:
+        scheme, host, port = key
+        try:
+            connection = await asyncio.open_connection(host, port, ssl=scheme == "https")
+        except OSError as e:
+            raise TrackerError(f"Cannot connect to {host}:{port}: {e}") from e
+        self._opened += 1
+        return connection
+
+    async def _exchange(self, key: HostKey, connection: Connection, request: bytes) -> bytes:
+        reader, writer = connection
+        try:
+            writer.write(request)
+            await writer.drain()
+            status, headers = await _read_head(reader)
+            body = await _read_body(reader, headers)
+        except BaseException:
+            writer.close()
+            raise
+        keep_alive = headers.get("connection", "").lower() != "close" and (
+            "content-length" in headers or headers.get("transfer-encoding") == "chunked"
+        )
+        if keep_alive and not reader.at_eof():
+            self._idle.setdefault(key, []).append(connection)
+        else:
+            writer.close()
+        if status != 200:
+            raise TrackerError(f"{key}: HTTP status {status}")
+        return body
+
+
+async def _read_head(reader: StreamReader) -> tuple[int, dict[str, str]]:
+    status_line = await reader.readuntil(b"\r\n")
+    fields = status_line.split(maxsplit=2)
+    if len(fields) < 2 or not fields[0].startswith(b"HTTP/"):
+        raise TrackerError(f"Bad status line {status_line!r}")
+    headers: dict[str, str] = dict()
+    if fields[0] == b"HTTP/1.0":
+        headers["connection"] = "close"
+    while (line := await reader.readuntil(b"\r\n")) != b"\r\n":
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return int(fields[1]), headers
+
+
+async def _read_body(reader: StreamReader, headers: dict[str, str]) -> bytes:
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks: list[bytes] = []
+        while size := int((await reader.readuntil(b"\r\n")).split(b";")[0], 16):
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        while await reader.readuntil(b"\r\n") != b"\r\n":
+            continue
+        return b"".join(chunks)
+    if "content-length" in headers:
+        return await reader.readexactly(int(headers["content-length"]))
+    return await reader.read()
@@ -0,0 +1,78 @@
+from dataclasses import dataclass
+from enum import StrEnum
+from typing import Any
+
+from app.bencode import Bencode, Dict, Integer, List, String
+from app.const import DEFAULT_ANNOUNCE_INTERVAL_SECONDS, PEER_ID_SIZE_BYTES
+from app.exceptions import TrackerError
+
+PeerAddress = tuple[str, int]
+
+
+class AnnounceEvent(StrEnum):
+    NONE = ""
+    STARTED = "started"
+    COMPLETED = "completed"
+    STOPPED = "stopped"
+
+
+@dataclass(frozen=True)
+class AnnounceResponse:
+    peers: list[PeerAddress]
+    interval: int = DEFAULT_ANNOUNCE_INTERVAL_SECONDS
+    min_interval: int = 0
+
+    @property
+    def next_announce(self) -> int:
+        return max(self.interval, self.min_interval)
+
+    @classmethod
+    def from_bytes(cls, raw_data: bytes) -> "AnnounceResponse":  # noqa: WPS231
+        remainder, response = Bencode.from_bytes(raw_data)
+        if len(remainder) > 0 or not isinstance(response, Dict):
+            raise TrackerError(f"Bad announce response {raw_data[:64]!r}")
+        failure = response.data.get("failure reason")
+        if isinstance(failure, String):
+            raise TrackerError(failure.data.decode(errors="replace"))
+        peers = response.data.get("peers")
+        if isinstance(peers, String):
+            addresses = read_compact_peers(peers.data)
+        elif isinstance(peers, List):
+            addresses = [_read_peer_dict(peer) for peer in peers.data]
+        else:
+            raise TrackerError(f"type(peers) = {type(peers)}")
+        interval = response.data.get("interval")
+        min_interval = response.data.get("min interval")
+        return AnnounceResponse(
+            peers=addresses,
+            interval=interval.data if isinstance(interval, Integer) else DEFAULT_ANNOUNCE_INTERVAL_SECONDS,
+            min_interval=min_interval.data if isinstance(min_interval, Integer) else 0,
+        )
+
+
+def read_compact_peers(raw_data: bytes) -> list[PeerAddress]:
+    if len(raw_data) % PEER_ID_SIZE_BYTES:
+        raise TrackerError(f"Compact peers of {len(raw_data)} bytes")
+    result: list[PeerAddress] = []
+    for index in range(0, len(raw_data), PEER_ID_SIZE_BYTES):
+        host = ".".join(map(str, raw_data[index : index + 4]))
+        port = int.from_bytes(raw_data[index + 4 : index + PEER_ID_SIZE_BYTES])
+        result.append((host, port))
+    return result
+
+
+def _read_peer_dict(peer: Any) -> PeerAddress:
+    if not isinstance(peer, Dict):
+        raise TrackerError(f"type(peer) = {type(peer)}")
+    ip = peer.data.get("ip")
+    port = peer.data.get("port")
+    if not isinstance(ip, String) or not isinstance(port, Integer):
+        raise TrackerError(f"peer = {peer}")
+    return ip.data.decode(), port.data
+
+
+@dataclass
+class TransferStats:
+    uploaded: int = 0
+    downloaded: int = 0
+    left: int = 0
@@ -0,0 +1,235 @@
+import asyncio
+import random
+import struct
+import time
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+
+from app.const import (
+    LISTEN_PORT,
+    MY_ID,
+    UDP_CONNECTION_ID_SECONDS,
+    UDP_TRACKER_ATTEMPTS,
+    UDP_TRACKER_RETRY_SECONDS,
+)
+from app.exceptions import TrackerError
+from app.logging_config import get_logger
+from app.tracker.models import AnnounceEvent, AnnounceResponse, TransferStats, read_compact_peers
+
+logger = get_logger(__name__)
+
+PROTOCOL_ID = 0x41727101980
+HEADER = struct.Struct(">II")
+CONNECT_REQUEST = struct.Struct(">QII")
+CONNECT_RESPONSE = struct.Struct(">IIQ")
+ANNOUNCE_REQUEST = struct.Struct(">QII20s20sQQQIIIiH")
+ANNOUNCE_RESPONSE = struct.Struct(">IIIII")
+SCRAPE_ENTRY = struct.Struct(">III")
+
+Address = tuple[str, int]
+Clock = Callable[[], float]
+
+EVENT_CODES = {
+    AnnounceEvent.NONE: 0,
+    AnnounceEvent.COMPLETED: 1,
+    AnnounceEvent.STARTED: 2,
+    AnnounceEvent.STOPPED: 3,
+}
+
+
+class Action(IntEnum):
+    CONNECT = 0
+    ANNOUNCE = 1
+    SCRAPE = 2
+    ERROR = 3
+
+
+@dataclass(frozen=True)
+class ScrapeResult:
+    seeders: int
+    completed: int
+    leechers: int
+
+
+class _Endpoint(asyncio.DatagramProtocol):
+    """One socket per tracker, answers are matched to requests by transaction id"""
+
+    def __init__(self) -> None:
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self._waiters: dict[int, asyncio.Future[bytes]] = dict()
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport  # type: ignore[assignment]
+
+    def datagram_received(self, data: bytes, addr: Address) -> None:
+        if len(data) < HEADER.size:
+            return
+        _, transaction_id = HEADER.unpack_from(data)
+        waiter = self._waiters.pop(transaction_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(data)
+
+    def error_received(self, exc: Exception) -> None:
+        for waiter in self._waiters.values():
+            if not waiter.done():
+                waiter.set_exception(TrackerError(f"UDP error: {exc}"))
+        self._waiters.clear()
+
+    def expect(self, transaction_id: int) -> asyncio.Future[bytes]:
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[transaction_id] = waiter
+        return waiter
+
+    def forget(self, transaction_id: int) -> None:
+        self._waiters.pop(transaction_id, None)
+
+
+class UdpTrackerClient:  # noqa: WPS214
+    """BEP 15 client: connect, announce and scrape with cached connection ids.
+
+    A request is retransmitted after retry_seconds * 2 ** attempt, the schedule of the
+    BEP with a shorter base and fewer attempts so a dead tracker does not stall its tier.
+    """
+
+    def __init__(
+        self,
+        retry_seconds: float = UDP_TRACKER_RETRY_SECONDS,
+        attempts: int = UDP_TRACKER_ATTEMPTS,
+        clock: Clock = time.monotonic,
+    ) -> None:
+        self._retry_seconds = retry_seconds
+        self._attempts = attempts
+        self._clock = clock
+        self._key = random.getrandbits(32)
+        self._endpoints: dict[Address, _Endpoint] = dict()
+        self._connection_ids: dict[Address, tuple[int, float]] = dict()
+        self._connects = 0
+
+    @property
+    def connects(self) -> int:
+        """Connect round trips so far, cached connection ids are not counted"""
+        return self._connects
+
+    async def announce(
+        self,
+        url: str,
+        info_hash: bytes,
+        stats: TransferStats,
+        event: AnnounceEvent,
+        port: int = LISTEN_PORT,
+    ) -> AnnounceResponse:
+        address = _address(url)
+        connection_id = await self._connection_id(address)
+        response = await self._transact(
+            address,
+            Action.ANNOUNCE,
+            lambda transaction_id: ANNOUNCE_REQUEST.pack(
+                connection_id,
+                Action.ANNOUNCE,
+                transaction_id,
+                info_hash,
+                MY_ID,
+                stats.downloaded,
+                stats.left,
+                stats.uploaded,
+                EVENT_CODES[event],
+                0,
+                self._key,
+                -1,
+                port,
+            ),
+        )
+        if len(response) < ANNOUNCE_RESPONSE.size:
+            raise TrackerError(f"Short announce response of {len(response)} bytes")
+        _, _, interval, _, _ = ANNOUNCE_RESPONSE.unpack_from(response)
+        return AnnounceResponse(
+            peers=read_compact_peers(response[ANNOUNCE_RESPONSE.size :]),
+            interval=interval,
+        )
+
+    async def scrape(self, url: str, info_hashes: list[bytes]) -> list[ScrapeResult]:
+        address = _address(url)
+        connection_id = await self._connection_id(address)
+        response = await self._transact(
+            address,
+            Action.SCRAPE,
+            lambda transaction_id: CONNECT_REQUEST.pack(connection_id, Action.SCRAPE, transaction_id)
+            + b"".join(info_hashes),
+        )
+        if len(response) != HEADER.size + SCRAPE_ENTRY.size * len(info_hashes):
+            raise TrackerError(f"Scrape response of {len(response)} bytes")
+        return [
+            ScrapeResult(*SCRAPE_ENTRY.unpack_from(response, HEADER.size + SCRAPE_ENTRY.size * index))
+            for index in range(len(info_hashes))
+        ]
+
+    def close(self) -> None:
+        for endpoint in self._endpoints.values():
+            if endpoint.transport is not None:
+                endpoint.transport.close()
+        self._endpoints.clear()
+
+    async def _connection_id(self, address: Address) -> int:
+        cached = self._connection_ids.get(address)
+        if cached is not None and self._clock() - cached[1] < UDP_CONNECTION_ID_SECONDS:
+            return cached[0]
+        response = await self._transact(
+            address,
+            Action.CONNECT,
+            lambda transaction_id: CONNECT_REQUEST.pack(PROTOCOL_ID, Action.CONNECT, transaction_id),
+        )
+        if len(response) < CONNECT_RESPONSE.size:
+            raise TrackerError(f"Short connect response of {len(response)} bytes")
+        _, _, connection_id = CONNECT_RESPONSE.unpack_from(response)
+        self._connects += 1
+        self._connection_ids[address] = (connection_id, self._clock())
+        return connection_id
+
+    async def _transact(
+        self, address: Address, action: Action, build: Callable[[int], bytes]
+    ) -> bytes:
+        endpoint = await self._endpoint(address)
+        for attempt in range(self._attempts):
+            transaction_id = random.getrandbits(32)
+            waiter = endpoint.expect(transaction_id)
+            if endpoint.transport is None:
+                raise TrackerError(f"{address}: socket closed")
+            endpoint.transport.sendto(build(transaction_id))
+            try:
+                async with asyncio.timeout(self._retry_seconds * 2**attempt):
+                    response = await waiter
+            except TimeoutError:
+                logger.debug(f"{address}: {action.name} attempt {attempt} timed out")
+                continue
+            finally:
+                endpoint.forget(transaction_id)
+            response_action, _ = HEADER.unpack_from(response)
+            if response_action == Action.ERROR:
+                self._connection_ids.pop(address, None)
+                raise TrackerError(response[HEADER.size :].decode(errors="replace"))
+            if response_action != action:
+                raise TrackerError(f"{address}: action {response_action} for {action.name}")
+            return response
+        self._connection_ids.pop(address, None)
+        raise TrackerError(f"{address}: no answer to {action.name}")
+
+    async def _endpoint(self, address: Address) -> _Endpoint:
+        endpoint = self._endpoints.get(address)
+        if endpoint is None:
+            try:
+                _, endpoint = await asyncio.get_running_loop().create_datagram_endpoint(
+                    _Endpoint, remote_addr=address
+                )
+            except OSError as e:
+                raise TrackerError(f"Cannot reach {address}: {e}") from e
+            self._endpoints[address] = endpoint
+        return endpoint
+
+
+def _address(url: str) -> Address:
+    parts = urlsplit(url)
+    if parts.scheme != "udp" or parts.hostname is None or parts.port is None:
+        raise TrackerError(f"Unsupported tracker url {url}")
+    return parts.hostname, parts.port
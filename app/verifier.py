@@ -0,0 +1,72 @@
+import asyncio
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from app.logging_config import get_logger
+from app.storage import Storage
+
+logger = get_logger(__name__)
+
+VERIFY_BATCH_SIZE = 16
+
+VerifiedCallback = Callable[[int, bool], None]
+
+
+@dataclass(frozen=True)
+class PieceSpan:
+    piece_index: int
+    offset: int
+    length: int
+
+
+def _sha1(storage: Storage, span: PieceSpan) -> bytes:
+    data = storage.read(span.offset, span.length)
+    return hashlib.sha1(data).digest()  # noqa: DUO130
+
+
+class PieceVerifier:
+    def __init__(
+        self,
+        storage: Storage,
+        piece_hashes: list[bytes],
+        on_verified: VerifiedCallback,
+        max_workers: int = os.cpu_count() or 1,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ) -> None:
+        self._storage = storage
+        self._piece_hashes = piece_hashes
+        self._on_verified = on_verified
+        self._queue: asyncio.Queue[PieceSpan] = asyncio.Queue()
+        # A shared executor outlives this verifier, so only an own one is shut down
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="sha1"
+        )
+
+    def submit(self, span: PieceSpan) -> None:
+        self._queue.put_nowait(span)
+
+    async def run(self) -> None:
+        try:
+            while True:
+                batch = [await self._queue.get()]
+                while len(batch) < VERIFY_BATCH_SIZE and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                await self._verify_batch(batch)
+        finally:
+            if self._owns_executor:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+
+    async def _verify_batch(self, batch: list[PieceSpan]) -> None:
+        loop = asyncio.get_running_loop()
+        digests = await asyncio.gather(
+            *(loop.run_in_executor(self._executor, _sha1, self._storage, span) for span in batch)
+        )
+        for span, digest in zip(batch, digests):
+            is_valid = digest == self._piece_hashes[span.piece_index]
+            if not is_valid:
+                logger.warning(f"Piece {span.piece_index} failed SHA-1 verification")
+            self._on_verified(span.piece_index, is_valid)
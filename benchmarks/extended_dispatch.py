@@ -0,0 +1,37 @@
+import sys
+import time
+
+from app.const import UT_METADATA_ID, UT_PEX_ID
+from app.packets import ExtendedPacket, ExtendedPayload, MetadataMessageType, MetadataPayload, PexPayload
+from app.peer.extensions import Extension, ExtensionRegistry
+
+MESSAGE_COUNT = 100_000
+
+HANDSHAKE = ExtendedPacket(
+    payload=ExtendedPayload(
+        extensions={"ut_metadata": 3, "ut_pex": 1, "lt_donthave": 7}, metadata_size=31235, reqq=250, client="bench"
+    ).to_bytes
+)
+MESSAGES = [
+    ExtendedPacket(payload=bytes([UT_PEX_ID]) + PexPayload(added=[("10.0.0.1", 6881)] * 20).to_bytes),
+    ExtendedPacket(
+        payload=bytes([UT_METADATA_ID])
+        + MetadataPayload(msg_type=MetadataMessageType.DATA, piece=0, total_size=16384, data=bytes(16384)).to_bytes
+    ),
+]
+
+
+def main() -> None:
+    registry = ExtensionRegistry(on_handshake=lambda _: None)
+    registry.register(Extension.UT_PEX, PexPayload.from_bytes)
+    registry.register(Extension.UT_METADATA, MetadataPayload.from_bytes)
+    for name, packets in (("handshake", [HANDSHAKE]), ("pex + metadata", MESSAGES)):
+        start = time.perf_counter()
+        for index in range(MESSAGE_COUNT):
+            registry.dispatch(packets[index % len(packets)])
+        elapsed = time.perf_counter() - start
+        sys.stdout.write(f"{name:>15}: {MESSAGE_COUNT / elapsed:10.0f} messages/s\n")
+
+
+if __name__ == "__main__":
+    main()
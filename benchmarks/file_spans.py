@@ -0,0 +1,42 @@
+import random
+import sys
+import time
+
+from app.const import BLOCK_SIZE_BYTES
+from app.file_spans import FileSpanIndex
+
+FILE_COUNT = 50_000
+LOOKUPS = 20_000
+
+
+def linear_scan(lengths: list[int], offset: int, length: int) -> int:
+    """The walk over the file list an index saves: count the files a block touches"""
+    touched = 0
+    start = 0
+    for file_length in lengths:
+        if start < offset + length and offset < start + file_length:
+            touched += 1
+        start += file_length
+    return touched
+
+
+def main() -> None:
+    rng = random.Random(0)
+    lengths = [rng.randrange(1, 64 * 1024) for _ in range(FILE_COUNT)]
+    index = FileSpanIndex(lengths)
+    offsets = [rng.randrange(index.total - BLOCK_SIZE_BYTES) for _ in range(LOOKUPS)]
+    start = time.perf_counter()
+    for offset in offsets:
+        sum(1 for _ in index.segments(offset, BLOCK_SIZE_BYTES))
+    indexed = time.perf_counter() - start
+    start = time.perf_counter()
+    for offset in offsets[: LOOKUPS // 100]:
+        linear_scan(lengths, offset, BLOCK_SIZE_BYTES)
+    scanned = (time.perf_counter() - start) * 100
+    sys.stdout.write(f"{FILE_COUNT} files, {LOOKUPS} block lookups\n")
+    sys.stdout.write(f"  bisect: {LOOKUPS / indexed:12.0f} lookups/s\n")
+    sys.stdout.write(f"  linear: {LOOKUPS / scanned:12.0f} lookups/s\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from app.bencode import Dict, Integer, String
+from app.const import BLOCK_SIZE_BYTES
+from app.pieces import Pieces
+from app.storage import Storage
+from app.torrent_file import TorrentFile
+
+LENGTH = 50 * 1024**3
+PIECE_LENGTH = 256 * 1024
+REQUESTS = 20000
+
+
+def make_torrent() -> TorrentFile:
+    piece_count = -(-LENGTH // PIECE_LENGTH)
+    info = Dict(
+        {
+            "length": Integer(LENGTH),
+            "name": String(b"big.bin"),
+            "piece length": Integer(PIECE_LENGTH),
+            "pieces": String(bytes(20 * piece_count)),
+        }
+    )
+    return TorrentFile.from_bytes(Dict({"announce": String(b"http://localhost/"), "info": info}).to_bytes)
+
+
+def build(torrent_file: TorrentFile, storage: Storage) -> tuple[Pieces, float]:
+    start = time.perf_counter()
+    pieces = Pieces(torrent_file, storage)
+    return pieces, time.perf_counter() - start
+
+
+async def measure(torrent_file: TorrentFile, storage: Storage) -> None:
+    _, built = build(torrent_file, storage)
+    tracemalloc.start()
+    pieces, _ = build(torrent_file, storage)
+    _, startup_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    pieces.add_peer("seed", bytes([0xFF]) * -(-len(torrent_file.piece_hashes) // 8))
+    start = time.perf_counter()
+    pieces.next_request("seed")
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        pieces.next_request("seed")
+    requesting = time.perf_counter() - start
+    sys.stdout.write(
+        f"{LENGTH / 1024**3:.0f} GiB, {len(torrent_file.piece_hashes)} pieces, {LENGTH // BLOCK_SIZE_BYTES} blocks\n"
+    )
+    sys.stdout.write(f"  construction:  {built * 1000:8.1f} ms, peak {startup_peak / 1024**2:6.1f} MiB\n")
+    sys.stdout.write(f"  first request: {first * 1000:8.1f} ms\n")
+    sys.stdout.write(f"  next requests: {REQUESTS / requesting:8.0f} requests/s\n")
+
+
+def main() -> None:
+    torrent_file = make_torrent()
+    with tempfile.TemporaryDirectory() as directory:
+        # A sparse file: nothing is written, only the bookkeeping is measured
+        storage = Storage(os.path.join(directory, "big.bin"), LENGTH)
+        try:
+            asyncio.run(measure(torrent_file, storage))
+        finally:
+            storage.discard()
+
+
+if __name__ == "__main__":
+    main()
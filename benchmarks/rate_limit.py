@@ -0,0 +1,44 @@
+import sys
+import time
+from typing import Optional
+
+from app.const import BLOCK_SIZE_BYTES
+from app.rate_limit import TokenBucket, nested_bucket
+
+BLOCKS = 500_000
+ROUNDS = 3
+# High enough never to throttle: this measures the bookkeeping alone
+RATE = 1e15
+
+
+def per_block(bucket: Optional[TokenBucket]) -> float:
+    """Seconds per block of what a peer does for each REQUEST: check the budget, then charge it"""
+    best = float("inf")
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for _ in range(BLOCKS):
+            if bucket is not None and bucket.delay(BLOCK_SIZE_BYTES) == 0:
+                bucket.take(BLOCK_SIZE_BYTES)
+        best = min(best, time.perf_counter() - start)
+    return best / BLOCKS
+
+
+def main() -> None:
+    global_bucket = TokenBucket(RATE)
+    torrent_bucket = nested_bucket(global_bucket, RATE)
+    levels = {
+        "none": None,
+        "global": global_bucket,
+        "global+torrent": torrent_bucket,
+        "global+torrent+peer": nested_bucket(torrent_bucket, RATE),
+    }
+    baseline = per_block(None)
+    for name, bucket in levels.items():
+        cost = per_block(bucket) - baseline
+        # At 100 MiB/s a peer connection set handles 6400 blocks a second
+        share = cost * 100 * 1024**2 / BLOCK_SIZE_BYTES
+        sys.stdout.write(f"{name:>20}: {cost * 1e9:7.0f} ns/block, {share:.2%} of a core at 100 MiB/s\n")
+
+
+if __name__ == "__main__":
+    main()
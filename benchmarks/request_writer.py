@@ -0,0 +1,64 @@
+import asyncio
+import sys
+import time
+from typing import Awaitable, Callable
+
+from app.packets import RequestPayload, RequestPeerPacket
+from app.peer.async_writer import AsyncWriterHandler
+from app.peer.protocol import PeerProtocol
+
+MESSAGE_COUNT = 50_000
+BATCH_SIZE = 250
+ROUNDS = 3
+REQUEST = RequestPeerPacket(payload=RequestPayload(piece_index=1, offset=0, length=16384).to_bytes).to_bytes
+
+Sender = Callable[[AsyncWriterHandler], Awaitable[None]]
+
+
+async def sink(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Stub peer that swallows everything until the client goes away"""
+    while await reader.read(1 << 20):
+        pass
+    writer.close()
+
+
+async def task_per_message(writer: AsyncWriterHandler) -> None:
+    """The previous path: a task per REQUEST, each one writing and draining on its own"""
+    for _ in range(MESSAGE_COUNT // BATCH_SIZE):
+        await asyncio.gather(*(asyncio.create_task(writer.write(REQUEST)) for _ in range(BATCH_SIZE)))
+
+
+async def batched(writer: AsyncWriterHandler) -> None:
+    for _ in range(MESSAGE_COUNT // BATCH_SIZE):
+        for _ in range(BATCH_SIZE):
+            writer.queue(REQUEST)
+        await writer.flush()
+
+
+async def best_of(sender: Sender, host: str, port: int) -> float:
+    best = float("inf")
+    for _ in range(ROUNDS):
+        _, protocol = await asyncio.get_running_loop().create_connection(
+            lambda: PeerProtocol("benchmark"), host, port
+        )
+        closed = asyncio.Event()
+        writer = AsyncWriterHandler(protocol, peername="benchmark", closed_event=closed)
+        start = time.perf_counter()
+        await sender(writer)
+        best = min(best, time.perf_counter() - start)
+        closed.set()
+        await protocol.wait_closed()
+    return best
+
+
+async def main() -> None:
+    server = await asyncio.start_server(sink, "127.0.0.1", 0)
+    host, port = server.sockets[0].getsockname()[:2]
+    async with server:
+        for name, sender in (("per-task", task_per_message), ("batched", batched)):
+            elapsed = await best_of(sender, host, port)
+            sys.stdout.write(f"{name:>8}: {MESSAGE_COUNT / elapsed:10.0f} messages/s\n")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+import asyncio
+import random
+import struct
+import sys
+import time
+
+from app.bitfield import Bitfield
+from app.const import BLOCK_SIZE_BYTES, MY_ID, MessageType
+from app.packets import HandshakePacket
+from app.seeding.block_cache import BlockCache
+from app.seeding.server import SeedServer
+
+LEECHERS = 300
+PIECE_LENGTH = 256 * 1024
+PIECE_COUNT = 16
+PIECES_PER_LEECHER = 4
+PIPELINE = 16
+DATA = random.Random(0).randbytes(PIECE_LENGTH * PIECE_COUNT)
+INFO_HASH = bytes(20)
+
+
+def piece_size(piece_index: int) -> int:
+    return PIECE_LENGTH
+
+
+async def read_message(reader: asyncio.StreamReader) -> bytes:
+    length = struct.unpack(">I", await reader.readexactly(4))[0]
+    return await reader.readexactly(length)
+
+
+async def leecher(port: int, seed: int) -> int:
+    """Minimal leecher: handshake, interested, then pipelined requests for a few pieces"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(HandshakePacket(info_hash=INFO_HASH, peer_id_bytes=MY_ID, extension_enabled=False).to_bytes)
+    await reader.readexactly(68)
+    await read_message(reader)
+    writer.write(struct.pack(">IB", 1, MessageType.INTERESTED))
+    while await read_message(reader) != bytes([MessageType.UNCHOKE]):
+        continue
+    pieces = random.Random(seed).sample(range(PIECE_COUNT), PIECES_PER_LEECHER)
+    requests = [
+        struct.pack(">IBIII", 13, MessageType.REQUEST, piece_index, offset, BLOCK_SIZE_BYTES)
+        for piece_index in pieces
+        for offset in range(0, PIECE_LENGTH, BLOCK_SIZE_BYTES)
+    ]
+    received = 0
+    sent = min(PIPELINE, len(requests))
+    writer.writelines(requests[:sent])
+    while received < len(requests):
+        message = await read_message(reader)
+        if message[0] != MessageType.PIECE:
+            continue
+        received += 1
+        if sent < len(requests):
+            writer.write(requests[sent])
+            sent += 1
+    writer.close()
+    return received * BLOCK_SIZE_BYTES
+
+
+async def main() -> None:
+    have = Bitfield(PIECE_COUNT)
+    for piece_index in range(PIECE_COUNT):
+        have.set(piece_index)
+    cache = BlockCache(lambda offset, length: DATA[offset : offset + length], PIECE_LENGTH, piece_size)
+    server = SeedServer(INFO_HASH, have, cache, piece_size, slots=LEECHERS)
+    await server.start("127.0.0.1", 0)
+    start = time.perf_counter()
+    total = sum(await asyncio.gather(*(leecher(server.port, seed) for seed in range(LEECHERS))))
+    elapsed = time.perf_counter() - start
+    await server.close()
+    blocks = total // BLOCK_SIZE_BYTES
+    sys.stdout.write(
+        f"{LEECHERS} leechers: {elapsed:.2f} s, {blocks / elapsed:.0f} blocks/s, "
+        + f"{total / elapsed / 1e6:.1f} MB/s, cache hits {cache.hits} misses {cache.misses}\n"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,44 @@
+import hashlib
+import os
+import sys
+
+from app.bencode import Dict, Integer, String
+from app.recheck import verify_stream
+from app.torrent_file import TorrentFile
+
+PIECE_LENGTH = 256 * 1024
+DATA = os.urandom(256 * PIECE_LENGTH)
+ROUNDS = 3
+
+
+def make_torrent() -> TorrentFile:
+    hashes = b"".join(
+        hashlib.sha1(DATA[offset : offset + PIECE_LENGTH]).digest() for offset in range(0, len(DATA), PIECE_LENGTH)
+    )
+    info = Dict(
+        {
+            "length": Integer(len(DATA)),
+            "name": String(b"data.bin"),
+            "piece length": Integer(PIECE_LENGTH),
+            "pieces": String(hashes),
+        }
+    )
+    return TorrentFile.from_bytes(Dict({"announce": String(b"http://localhost/"), "info": info}).to_bytes)
+
+
+def read(offset: int, length: int) -> bytes:
+    return DATA[offset : offset + length]
+
+
+def main() -> None:
+    torrent_file = make_torrent()
+    for workers in sorted({1, os.cpu_count() or 1}):
+        best = max(
+            verify_stream(read, torrent_file, max_workers=workers).megabytes_per_second
+            for _ in range(ROUNDS)
+        )
+        sys.stdout.write(f"{workers:>3} workers: {best:8.1f} MB/s\n")
+
+
+if __name__ == "__main__":
+    main()
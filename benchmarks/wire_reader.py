@@ -0,0 +1,68 @@
+import asyncio
+import sys
+import time
+from typing import Awaitable, Callable
+
+from app.const import BLOCK_SIZE_BYTES, MY_ID, MessageType
+from app.packets import HandshakePacket, PeerPacket
+from app.peer.protocol import PeerProtocol
+
+MESSAGE_COUNT = 20_000
+ROUNDS = 3
+HANDSHAKE = HandshakePacket(info_hash=bytes(20), peer_id_bytes=MY_ID, extension_enabled=False)
+PIECE = PeerPacket(message_type=MessageType.PIECE, payload=bytes(8 + BLOCK_SIZE_BYTES)).to_bytes
+
+Reader = Callable[[str, int], Awaitable[None]]
+
+
+async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    writer.write(HANDSHAKE.to_bytes)
+    for _ in range(MESSAGE_COUNT):
+        writer.write(PIECE)
+        await writer.drain()
+    writer.close()
+
+
+async def stream_reader(host: str, port: int) -> None:
+    """The previous path: StreamReader plus readexactly per field"""
+    reader, writer = await asyncio.open_connection(host, port)
+    await HandshakePacket.from_stream(reader.readexactly)
+    for _ in range(MESSAGE_COUNT):
+        await PeerPacket.from_stream(reader.readexactly)
+    writer.close()
+
+
+async def buffered_protocol(host: str, port: int) -> None:
+    _, protocol = await asyncio.get_running_loop().create_connection(
+        lambda: PeerProtocol("benchmark"), host, port
+    )
+    await protocol.read_handshake()
+    for _ in range(MESSAGE_COUNT):
+        await protocol.read_packet()
+    protocol.close()
+
+
+async def best_of(reader: Reader) -> float:
+    server = await asyncio.start_server(serve, "127.0.0.1", 0)
+    host, port = server.sockets[0].getsockname()[:2]
+    best = float("inf")
+    async with server:
+        for _ in range(ROUNDS):
+            start = time.perf_counter()
+            await reader(host, port)
+            best = min(best, time.perf_counter() - start)
+    return best
+
+
+async def main() -> None:
+    total_bytes = MESSAGE_COUNT * len(PIECE)
+    for name, reader in (("stream", stream_reader), ("protocol", buffered_protocol)):
+        elapsed = await best_of(reader)
+        sys.stdout.write(
+            f"{name:>8}: {MESSAGE_COUNT / elapsed:10.0f} messages/s "
+            + f"{total_bytes / elapsed / 1e6:8.1f} MB/s\n"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+import pytest
+
+from app.bencode import Bencode, BencodeParser, Dict, Integer, List, String
+from app.exceptions import NeedMoreBytesError, WrongBencodeFormatError
+
+SAMPLES = [
+    b"5:hello",
+    b"0:",
+    b"i52e",
+    b"i-123456789012345678901234567890e",
+    b"le",
+    b"de",
+    b"l5:helloi52ee",
+    b"d3:foo3:bar5:helloi52ee",
+    b"ld1:ai1eel0:ee",
+    b"d4:infod6:lengthi92063e4:name10:sample.txt6:pieces20:aaaaaaaaaaaaaaaaaaaaee",
+]
+STREAM = b"".join(SAMPLES)
+EXPECTED = [Bencode.from_bytes(sample)[1] for sample in SAMPLES]
+
+
+@pytest.mark.parametrize("split", range(len(STREAM) + 1))
+def test_split_at_every_offset(split: int) -> None:
+    parser = BencodeParser()
+    values = parser.feed(STREAM[:split]) + parser.feed(STREAM[split:])
+    parser.close()
+    assert values == EXPECTED
+    assert [value.to_bytes for value in values] == SAMPLES
+
+
+def test_byte_at_a_time() -> None:
+    parser = BencodeParser()
+    values = []
+    for index in range(len(STREAM)):
+        values += parser.feed(STREAM[index : index + 1])
+    parser.close()
+    assert values == EXPECTED
+
+
+def test_spans_point_at_source_bytes() -> None:
+    parser = BencodeParser()
+    (value,) = parser.feed(SAMPLES[-1])
+    assert isinstance(value, Dict)
+    assert bytes(value["info"].span) == SAMPLES[-1][7:-1]
+
+
+def test_feed_one_leaves_trailing_bytes() -> None:
+    parser = BencodeParser()
+    assert parser.feed_one(b"d8:msg_typei1e5:pi") is None
+    value = parser.feed_one(b"ecei0eei0eRAW")
+    assert value == Dict({"msg_type": Integer(1), "piece": Integer(0)})
+    assert parser.unconsumed == b"i0eRAW"
+
+
+def test_close_with_partial_value() -> None:
+    parser = BencodeParser()
+    assert parser.feed(b"l4:sp") == []
+    with pytest.raises(NeedMoreBytesError):
+        parser.close()
+    assert parser.feed(b"ame") == [List([String(b"spam")])]
+    parser.close()
+
+
+@pytest.mark.parametrize("raw_bytes", [b"x", b"ie", b"di1ei2ee", b"d1:ae", b"e", b"5xhello"])
+def test_wrong_format(raw_bytes: bytes) -> None:
+    with pytest.raises(WrongBencodeFormatError):
+        BencodeParser().feed(raw_bytes)
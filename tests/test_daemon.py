@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import json
+import random
+import struct
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from app.bencode import Dict, Integer, String
+from app.bitfield import Bitfield
+from app.const import BLOCK_SIZE_BYTES
+from app.daemon.api import ControlServer, send_request
+from app.daemon.session import Session
+from app.seeding.block_cache import BlockCache
+from app.seeding.server import SeedServer
+from app.shared import SharedResources
+from app.torrent_file import TorrentFile
+
+PIECE_LENGTH = 2 * BLOCK_SIZE_BYTES
+
+
+class Swarm:
+    """One seeder per torrent behind a tracker that hands out the seeder of the asked info hash"""
+
+    def __init__(self) -> None:
+        self.seeders: dict[bytes, SeedServer] = dict()
+        self.url = ""
+        self._server: asyncio.Server | None = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.url = f"http://127.0.0.1:{self._server.sockets[0].getsockname()[1]}/announce"
+
+    async def seed(self, name: str, data: bytes, path: Path) -> TorrentFile:
+        hashes = b"".join(
+            hashlib.sha1(data[start : start + PIECE_LENGTH]).digest()
+            for start in range(0, len(data), PIECE_LENGTH)
+        )
+        info = Dict(
+            {
+                "length": Integer(len(data)),
+                "name": String(name.encode()),
+                "piece length": Integer(PIECE_LENGTH),
+                "pieces": String(hashes),
+            }
+        )
+        content = Dict({"announce": String(self.url.encode()), "info": info}).to_bytes
+        path.write_bytes(content)
+        torrent_file = TorrentFile.from_bytes(content)
+        have = Bitfield(len(torrent_file.piece_hashes))
+        for piece_index in range(len(have)):
+            have.set(piece_index)
+        cache = BlockCache(
+            lambda offset, length: data[offset : offset + length], PIECE_LENGTH, torrent_file.piece_size
+        )
+        seeder = SeedServer(torrent_file.info_hash, have, cache, torrent_file.piece_size)
+        await seeder.start("127.0.0.1", 0)
+        self.seeders[torrent_file.info_hash] = seeder
+        return torrent_file
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+        for seeder in self.seeders.values():
+            await seeder.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while request_line := await reader.readline():
+                while await reader.readline() != b"\r\n":
+                    continue
+                query = parse_qs(urlsplit(request_line.split()[1].decode()).query, encoding="latin-1")
+                seeder = self.seeders[query["info_hash"][0].encode("latin-1")]
+                peers = bytes([127, 0, 0, 1]) + struct.pack(">H", seeder.port)
+                body = Dict({"interval": Integer(900), "peers": String(peers)}).to_bytes
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+async def wait_for_states(socket_path: str, states: set[str]) -> list[dict[str, object]]:
+    for _ in range(200):
+        reply = await send_request(socket_path, {"command": "status"})
+        if {torrent["state"] for torrent in reply["torrents"]} == states:
+            return reply["torrents"]
+        await asyncio.sleep(0.05)
+    raise TimeoutError(reply)
+
+
+def test_daemon_downloads_several_torrents_through_its_socket(tmp_path: Path) -> None:
+    rng = random.Random(24)
+    datas = [rng.randbytes(9 * PIECE_LENGTH + 300), rng.randbytes(5 * PIECE_LENGTH)]
+
+    async def scenario() -> None:
+        swarm = Swarm()
+        await swarm.start()
+        torrents = [
+            await swarm.seed(f"t{index}.bin", data, tmp_path / f"t{index}.torrent")
+            for index, data in enumerate(datas)
+        ]
+        shared = SharedResources.create(max_peers=4)
+        session = Session(str(tmp_path / "downloads"), shared)
+        (tmp_path / "downloads").mkdir()
+        socket_path = str(tmp_path / "daemon.sock")
+        server = ControlServer(session, socket_path)
+        await server.start()
+        try:
+            hashes = []
+            for index in range(len(datas)):
+                request = {"command": "add", "torrent": str(tmp_path / f"t{index}.torrent")}
+                reply = await send_request(socket_path, request)
+                assert reply["ok"]
+                hashes.append(reply["info_hash"])
+            assert hashes == [torrent_file.info_hash.hex() for torrent_file in torrents]
+            # The last add again
+            again = await send_request(socket_path, request)
+            assert not again["ok"] and "already added" in again["error"]
+            statuses = await wait_for_states(socket_path, {"done"})
+            assert [(status["verified"], status["left"]) for status in statuses] == [(10, 0), (5, 0)]
+            for index, data in enumerate(datas):
+                assert (tmp_path / "downloads" / f"t{index}.bin").read_bytes() == data
+            assert shared.connections.free == 4
+            assert (await send_request(socket_path, {"command": "remove", "info_hash": hashes[0]}))["ok"]
+            assert len((await send_request(socket_path, {"command": "status"}))["torrents"]) == 1
+        finally:
+            await server.close()
+            await session.close()
+            await shared.close()
+            await swarm.close()
+
+    asyncio.run(scenario())
+
+
+def test_removing_a_torrent_keeps_its_part_file(tmp_path: Path) -> None:
+    data = random.Random(25).randbytes(20 * PIECE_LENGTH)
+
+    async def scenario() -> None:
+        swarm = Swarm()
+        await swarm.start()
+        await swarm.seed("slow.bin", data, tmp_path / "slow.torrent")
+        # Two blocks a second: the download is far from done when it is removed
+        shared = SharedResources.create(download_rate=2 * BLOCK_SIZE_BYTES)
+        session = Session(str(tmp_path), shared)
+        try:
+            info_hash = session.add(str(tmp_path / "slow.torrent"))
+            for _ in range(100):
+                if session.status()[0]["downloaded"]:
+                    break
+                await asyncio.sleep(0.05)
+            [status] = session.status()
+            assert status["state"] == "downloading" and 0 < status["downloaded"] < len(data)
+            await session.remove(info_hash)
+            assert not session.status()
+            assert (tmp_path / "slow.bin.part").exists()
+            assert (tmp_path / "slow.bin.resume").exists()
+            assert not (tmp_path / "slow.bin").exists()
+        finally:
+            await session.close()
+            await shared.close()
+            await swarm.close()
+
+    asyncio.run(scenario())
+
+
+def test_malformed_requests_get_an_error_reply(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        shared = SharedResources.create()
+        server = ControlServer(Session(str(tmp_path), shared), str(tmp_path / "daemon.sock"))
+        await server.start()
+        reader, writer = await asyncio.open_unix_connection(str(tmp_path / "daemon.sock"))
+        (tmp_path / "bad.torrent").write_bytes(b"d8:announce")
+        escaping = Dict(
+            {
+                "announce": String(b"http://localhost/"),
+                "info": Dict(
+                    {
+                        "length": Integer(1),
+                        "name": String(b"../x"),
+                        "piece length": Integer(PIECE_LENGTH),
+                        "pieces": String(bytes(20)),
+                    }
+                ),
+            }
+        )
+        (tmp_path / "escaping.torrent").write_bytes(escaping.to_bytes)
+        add = {"command": "add", "torrent": str(tmp_path / "escaping.torrent")}
+        requests = [
+            b"{oops",
+            b"[1]",
+            b'{"command": "pause"}',
+            b'{"command": "remove", "info_hash": "00"}',
+            json.dumps({"command": "add", "torrent": str(tmp_path / "bad.torrent")}).encode(),
+            json.dumps({**add, "output": 5}).encode(),
+            json.dumps({**add, "output": str(tmp_path / "x"), "download_rate": True}).encode(),
+            json.dumps(add).encode(),
+        ]
+        for line in requests:
+            writer.write(line + b"\n")
+            reply = json.loads(await reader.readline())
+            assert not reply["ok"] and reply["error"]
+        writer.close()
+        await server.close()
+        await shared.close()
+        assert not (tmp_path / "daemon.sock").exists()
+
+    asyncio.run(scenario())
+
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import struct
+
+import pytest
+
+from app.bencode import Dict, Integer, String
+from app.const import UT_PEX_ID, MessageType
+from app.packets import ExtendedPacket, ExtendedPayload, HandshakePacket, PexPayload
+from app.peer.extensions import Extension, ExtensionRegistry
+from app.peer.peer import Peer
+from app.peer.pool import PeerPool
+from app.peer.window import RequestWindow
+
+INFO_HASH = bytes(range(20))
+
+
+def extended(extended_id: int, payload: bytes) -> ExtendedPacket:
+    return ExtendedPacket(payload=bytes([extended_id]) + payload)
+
+
+def test_handshake_round_trips_every_field() -> None:
+    payload = ExtendedPayload(
+        extensions={"ut_metadata": 3, "ut_pex": 1}, metadata_size=31235, reqq=250, client="test 1.0"
+    )
+    assert ExtendedPayload.from_bytes(payload.to_bytes) == payload
+
+
+def test_handshake_skips_disabled_and_odd_entries(caplog: pytest.LogCaptureFixture) -> None:
+    raw = Dict(
+        {
+            "m": Dict({"lt_donthave": Integer(7), "ut_metadata": Integer(0), "ut_pex": String(b"x")}),
+            "p": Integer(6881),
+            "reqq": Integer(-1),
+            "yourip": String(bytes(4)),
+        }
+    ).to_bytes
+    with caplog.at_level(logging.DEBUG):
+        payload = ExtendedPayload.from_bytes(b"\x00" + raw)
+    assert payload == ExtendedPayload(extensions={"lt_donthave": 7})
+    assert payload.ut_metadata is None
+    assert not [record for record in caplog.records if record.levelno >= logging.WARNING]
+
+
+def test_registry_dispatches_by_the_ids_we_advertised() -> None:
+    handshakes: list[ExtendedPayload] = []
+    pex: list[bytes] = []
+    registry = ExtensionRegistry(on_handshake=handshakes.append)
+    registry.register(Extension.UT_PEX, lambda payload: pex.append(bytes(payload)))
+    assert registry.handshake.extensions == {"ut_pex": UT_PEX_ID}
+    assert registry.remote_id(Extension.UT_PEX) is None
+
+    registry.dispatch(extended(0, ExtendedPayload(extensions={"ut_pex": 9}, reqq=5).to_bytes[1:]))
+    assert registry.remote_id(Extension.UT_PEX) == 9
+    assert handshakes[0].reqq == 5
+    registry.dispatch(extended(UT_PEX_ID, b"payload"))
+    registry.dispatch(extended(9, b"ignored, that is the peer's id"))
+    assert pex == [b"payload"]
+
+
+def test_pex_payload_lists_added_peers() -> None:
+    payload = PexPayload(added=[("10.0.0.1", 6881), ("192.168.1.2", 51413)], dropped=[("1.2.3.4", 1)])
+    assert PexPayload.from_bytes(payload.to_bytes) == payload
+    assert PexPayload.from_bytes(Dict({"added.f": String(b"\x00")}).to_bytes) == PexPayload()
+
+
+def test_window_cap_respects_the_advertised_queue() -> None:
+    window = RequestWindow(min_depth=2, max_depth=500)
+    window.cap(250)
+    window.cap(1)
+    assert window.depth == 1
+
+
+def test_peer_takes_reqq_and_pex_from_its_extension_messages() -> None:
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        await reader.readexactly(68)
+        writer.write(HandshakePacket(INFO_HASH, bytes(20), extension_enabled=True).to_bytes)
+        handshake = ExtendedPayload(extensions={"ut_pex": 4}, reqq=3).to_bytes
+        writer.write(struct.pack(">IB", 1 + len(handshake), MessageType.EXTENDED) + handshake)
+        pex = bytes([UT_PEX_ID]) + PexPayload(added=[("10.0.0.7", 7000)]).to_bytes
+        writer.write(struct.pack(">IB", 1 + len(pex), MessageType.EXTENDED) + pex)
+        writer.write(struct.pack(">IB", 1, MessageType.UNCHOKE))
+        await reader.read()
+        writer.close()
+
+    async def scenario() -> None:
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        added: list[tuple[str, int]] = []
+        pool = PeerPool(
+            INFO_HASH,
+            peer_factory=lambda ip, port: Peer(ip, port, INFO_HASH, extension_enabled=True, on_peers=added.extend),
+        )
+        peer = await pool.dial("127.0.0.1", port)
+        assert peer.request_depth <= 3
+        await peer.get_ready()
+        assert added == [("10.0.0.7", 7000)]
+        await peer.close()
+        server.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,120 @@
+import os
+import random
+from pathlib import Path
+
+import pytest
+
+from app.bencode import Dict, Integer, List, String
+from app.const import MAX_OPEN_FILES
+from app.file_spans import FileSegment, FileSpanIndex
+from app.resume import ResumeFile
+from app.storage import FileReader, Storage
+from app.torrent_file import FileEntry, TorrentFile
+
+
+def naive_segments(lengths: list[int], offset: int, length: int) -> list[FileSegment]:
+    segments: list[FileSegment] = []
+    start = 0
+    for file_index, file_length in enumerate(lengths):
+        low = max(offset, start)
+        high = min(offset + length, start + file_length)
+        if low < high:
+            segments.append(FileSegment(file_index=file_index, file_offset=low - start, length=high - low))
+        start += file_length
+    return segments
+
+
+def test_segments_match_a_linear_scan() -> None:
+    rng = random.Random(3)
+    lengths = [rng.choice((0, 1, 7, 100, 5000)) for _ in range(300)]
+    index = FileSpanIndex(lengths)
+    assert index.total == sum(lengths)
+    for _ in range(2000):
+        offset = rng.randrange(index.total)
+        length = rng.randrange(index.total - offset + 1)
+        assert list(index.segments(offset, length)) == naive_segments(lengths, offset, length)
+
+
+def test_segments_skip_empty_files_at_boundaries() -> None:
+    index = FileSpanIndex([0, 4, 0, 0, 4, 0])
+    assert list(index.segments(0, 8)) == [FileSegment(1, 0, 4), FileSegment(4, 0, 4)]
+    assert list(index.segments(4, 2)) == [FileSegment(4, 0, 2)]
+    assert not list(index.segments(8, 0))
+    with pytest.raises(NotImplementedError):
+        list(index.segments(6, 3))
+
+
+def make_info(files: List, piece_length: int = 4) -> Dict:
+    return Dict(
+        {
+            "files": files,
+            "name": String(b"dir"),
+            "piece length": Integer(piece_length),
+            "pieces": String(bytes(20)),
+        }
+    )
+
+
+def file_entry(length: int, *path: bytes) -> Dict:
+    return Dict({"length": Integer(length), "path": List([String(part) for part in path])})
+
+
+def to_torrent(info: Dict) -> TorrentFile:
+    return TorrentFile.from_bytes(Dict({"announce": String(b"http://localhost/"), "info": info}).to_bytes)
+
+
+def test_multi_file_torrent_is_parsed() -> None:
+    torrent_file = to_torrent(make_info(List([file_entry(3, b"a.txt"), file_entry(5, b"sub", b"b.bin")])))
+    assert torrent_file.is_multi_file
+    assert torrent_file.name == "dir"
+    assert torrent_file.length == 8
+    assert torrent_file.files == [FileEntry(("a.txt",), 3), FileEntry(("sub", "b.bin"), 5)]
+
+
+@pytest.mark.parametrize("path", [(b"..", b"x"), (b"a/b",), (b"",), ()])
+def test_paths_leaving_the_torrent_directory_are_refused(path: tuple[bytes, ...]) -> None:
+    with pytest.raises(NotImplementedError):
+        to_torrent(make_info(List([file_entry(3, *path)])))
+
+
+def test_storage_splits_blocks_across_many_files(tmp_path: Path) -> None:
+    rng = random.Random(5)
+    files = [FileEntry(("d", f"{index}.bin"), rng.choice((0, 1, 10, 300))) for index in range(3 * MAX_OPEN_FILES)]
+    data = rng.randbytes(sum(entry.length for entry in files))
+    output = str(tmp_path / "out")
+    with Storage(output, len(data), files=files) as storage:
+        for offset in range(0, len(data), 1000):
+            storage.write(offset, data[offset : offset + 1000])
+        assert storage.read(0, len(data)) == data
+    start = 0
+    for entry in files:
+        assert Path(output, *entry.path).read_bytes() == data[start : start + entry.length]
+        start += entry.length
+    with FileReader(output, len(data), files) as reader:
+        assert not reader.mismatches
+        assert reader.read(0, len(data)) == data
+
+
+def test_reader_reads_missing_files_as_zeros(tmp_path: Path) -> None:
+    files = [FileEntry(("a",), 4), FileEntry(("b",), 4)]
+    (tmp_path / "a").write_bytes(b"abcd")
+    with FileReader(str(tmp_path), 8, files) as reader:
+        assert len(reader.mismatches) == 1
+        assert reader.read(2, 6) == b"cd" + bytes(4)
+
+
+def test_resume_notices_a_file_modified_inside_the_part_directory(tmp_path: Path) -> None:
+    files = [FileEntry(("a",), 4), FileEntry(("sub", "b"), 4)]
+    resume = ResumeFile(str(tmp_path / "out.resume"), bytes(20), piece_count=2)
+    storage = Storage(str(tmp_path / "out"), 8, keep_partial=True, files=files)
+    storage.write(0, b"12345678")
+    storage.close()
+    verified, _ = resume.load(storage.partial_path)
+    verified.set(0)
+    resume.save(verified, storage.partial_path)
+    loaded, trusted = resume.load(storage.partial_path)
+    assert trusted and list(loaded) == [0]
+    changed = os.path.join(storage.partial_path, "sub", "b")
+    stat = os.stat(changed)
+    os.utime(changed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert not resume.load(storage.partial_path)[1]
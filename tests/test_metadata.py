@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import random
+import struct
+
+import pytest
+
+from app.bencode import Dict, Integer, String
+from app.const import METADATA_PIECE_BYTES, UT_METADATA_ID, MessageType
+from app.exceptions import MetadataError
+from app.packets import HandshakePacket, MetadataMessageType, MetadataPayload
+from app.peer.metadata import fetch_metadata
+from app.peer.peer import Peer
+from app.peer.pool import PeerPool
+from app.torrent_file import TorrentFile
+
+PEER_UT_METADATA_ID = 3
+PIECE_HASHES = random.Random(2).randbytes(20 * 2000)
+METADATA = Dict(
+    {
+        "length": Integer(2000 * 1024),
+        "name": String(b"data.bin"),
+        "piece length": Integer(1024),
+        "pieces": String(PIECE_HASHES),
+    }
+).to_bytes
+INFO_HASH = hashlib.sha1(METADATA).digest()
+
+
+async def read_message(reader: asyncio.StreamReader) -> bytes:
+    length = struct.unpack(">I", await reader.readexactly(4))[0]
+    return await reader.readexactly(length)
+
+
+def extended(extended_id: int, payload: bytes) -> bytes:
+    return struct.pack(">IBB", 2 + len(payload), MessageType.EXTENDED, extended_id) + payload
+
+
+class MetadataPeer:
+    """Serves METADATA over ut_metadata: honestly, by rejecting, with a flipped byte or never"""
+
+    def __init__(self, mode: str, delay: float = 0) -> None:
+        self.mode = mode
+        self.delay = delay
+        self.served: list[int] = []
+        self.connections = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            await reader.readexactly(68)
+            await asyncio.sleep(self.delay)
+            writer.write(HandshakePacket(INFO_HASH, bytes(20), extension_enabled=True).to_bytes)
+            handshake = Dict(
+                {"m": Dict({"ut_metadata": Integer(PEER_UT_METADATA_ID)}), "metadata_size": Integer(len(METADATA))}
+            )
+            writer.write(extended(0, handshake.to_bytes))
+            writer.write(struct.pack(">IB", 1, MessageType.UNCHOKE))
+            while True:
+                message = await read_message(reader)
+                if message[0] != MessageType.EXTENDED or message[1] != PEER_UT_METADATA_ID:
+                    continue
+                if self.mode == "silent":
+                    continue
+                request = MetadataPayload.from_bytes(message[2:])
+                writer.write(extended(UT_METADATA_ID, self.answer(request.piece).to_bytes))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def answer(self, piece: int) -> MetadataPayload:
+        if self.mode == "reject":
+            return MetadataPayload(msg_type=MetadataMessageType.REJECT, piece=piece)
+        self.served.append(piece)
+        data = bytearray(METADATA[piece * METADATA_PIECE_BYTES : (piece + 1) * METADATA_PIECE_BYTES])
+        if self.mode == "corrupt":
+            data[0] ^= 1
+        return MetadataPayload(
+            msg_type=MetadataMessageType.DATA, piece=piece, total_size=len(METADATA), data=bytes(data)
+        )
+
+
+async def start(peers: list[MetadataPeer]) -> tuple[list[asyncio.Server], list[tuple[str, int]]]:
+    servers = [await asyncio.start_server(peer.handle, "127.0.0.1", 0) for peer in peers]
+    return servers, [("127.0.0.1", server.sockets[0].getsockname()[1]) for server in servers]
+
+
+async def fetch_from_peers(peers: list[MetadataPeer]) -> bytes:
+    servers, addresses = await start(peers)
+    try:
+        return await fetch_metadata(INFO_HASH, addresses)
+    finally:
+        for server in servers:
+            server.close()
+
+
+def test_metadata_is_fetched_from_several_peers_at_once() -> None:
+    peers = [MetadataPeer("good"), MetadataPeer("reject"), MetadataPeer("good")]
+    metadata = asyncio.run(fetch_from_peers(peers))
+    assert metadata == METADATA
+    assert len(METADATA) > 2 * METADATA_PIECE_BYTES
+    assert peers[0].served and peers[2].served
+    torrent_file = TorrentFile.from_metadata(metadata, [["http://localhost/announce"]])
+    assert torrent_file.info_hash == INFO_HASH
+    assert torrent_file.piece_hashes[1] == PIECE_HASHES[20:40]
+
+
+def test_metadata_not_matching_the_info_hash_is_refused() -> None:
+    with pytest.raises(MetadataError):
+        asyncio.run(fetch_from_peers([MetadataPeer("corrupt")]))
+
+
+def test_handshakes_run_concurrently_with_a_timeout_each() -> None:
+    async def scenario() -> None:
+        peers = [MetadataPeer("good", delay=0.5) for _ in range(5)] + [MetadataPeer("good", delay=5)]
+        servers, addresses = await start(peers)
+        pool = PeerPool(INFO_HASH, timeout=1)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        results = await pool.dial_all(addresses)
+        assert loop.time() - started < 1.5
+        assert [isinstance(result, Peer) for result in results] == [True] * 5 + [False]
+        assert isinstance(results[-1], TimeoutError)
+        assert len(pool) == 5
+        await pool.close()
+        for server in servers:
+            server.close()
+
+    asyncio.run(scenario())
+
+
+def test_pool_connections_are_reused_by_a_later_phase() -> None:
+    async def scenario() -> None:
+        peers = [MetadataPeer("good"), MetadataPeer("good")]
+        servers, addresses = await start(peers)
+        pool = PeerPool(INFO_HASH)
+        await pool.dial_all(addresses)
+        assert await fetch_metadata(INFO_HASH, addresses, pool) == METADATA
+        assert await fetch_metadata(INFO_HASH, addresses, pool) == METADATA
+        assert [peer.connections for peer in peers] == [1, 1]
+        assert len(pool) == 2
+        await pool.close()
+        for server in servers:
+            server.close()
+
+    asyncio.run(scenario())
+
+
+def test_peers_still_waiting_for_an_answer_go_back_to_the_pool() -> None:
+    async def scenario() -> None:
+        peers = [MetadataPeer("good"), MetadataPeer("silent")]
+        servers, addresses = await start(peers)
+        pool = PeerPool(INFO_HASH)
+        await pool.dial_all(addresses)
+        assert len(pool) == 2
+        assert await fetch_metadata(INFO_HASH, addresses, pool) == METADATA
+        assert len(pool) == 2
+        assert [peer.connections for peer in peers] == [1, 1]
+        await pool.close()
+        for server in servers:
+            server.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,72 @@
+import asyncio
+import io
+import random
+
+from app.bencode import Dict, Integer, String
+from app.ordered_writer import OrderedWriter
+from app.torrent_file import TorrentFile
+
+PIECE_LENGTH = 1024
+DATA = random.Random(11).randbytes(10 * PIECE_LENGTH + 100)
+
+
+def make_torrent() -> TorrentFile:
+    info = Dict(
+        {
+            "length": Integer(len(DATA)),
+            "name": String(b"data.bin"),
+            "piece length": Integer(PIECE_LENGTH),
+            "pieces": String(bytes(20 * 11)),
+        }
+    )
+    return TorrentFile.from_bytes(Dict({"announce": String(b"http://localhost/"), "info": info}).to_bytes)
+
+
+class RecordingSink(io.BytesIO):
+    def __init__(self) -> None:
+        super().__init__()
+        self.writes: list[int] = []
+
+    def write(self, data: bytes) -> int:  # type: ignore[override]
+        self.writes.append(len(data))
+        return super().write(data)
+
+
+def read(offset: int, length: int) -> bytes:
+    return DATA[offset : offset + length]
+
+
+def test_pieces_are_written_in_order_as_the_watermark_advances() -> None:
+    async def scenario() -> None:
+        sink = RecordingSink()
+        writer = OrderedWriter(read, make_torrent(), sink, range(11), write_bytes=3 * PIECE_LENGTH)
+        task = asyncio.create_task(writer.run())
+        for piece_index in (2, 1, 5, 4, 3):
+            writer.piece_verified(piece_index)
+        await asyncio.sleep(0.05)
+        assert writer.watermark == 0
+        assert not sink.getvalue()
+        writer.piece_verified(0)
+        while writer.watermark < 6:
+            await asyncio.sleep(0.01)
+        assert sink.getvalue() == DATA[: 6 * PIECE_LENGTH]
+        assert sink.writes == [3 * PIECE_LENGTH, 3 * PIECE_LENGTH]
+        for piece_index in (10, 9, 8, 7, 6):
+            writer.piece_verified(piece_index)
+        await asyncio.wait_for(task, 5)
+        assert sink.getvalue() == DATA
+        assert writer.written == len(DATA)
+
+    asyncio.run(scenario())
+
+
+def test_one_piece_is_written_at_its_offset_in_storage() -> None:
+    async def scenario() -> None:
+        sink = io.BytesIO()
+        piece = DATA[7 * PIECE_LENGTH : 8 * PIECE_LENGTH]
+        writer = OrderedWriter(lambda offset, length: piece[offset : offset + length], make_torrent(), sink, range(7, 8))
+        writer.piece_verified(7)
+        await asyncio.wait_for(writer.run(), 5)
+        assert sink.getvalue() == piece
+
+    asyncio.run(scenario())
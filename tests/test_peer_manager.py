@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import random
+import struct
+from pathlib import Path
+
+from app.bencode import Dict, Integer, String
+from app.const import BLOCK_SIZE_BYTES, MAX_PEER_BACKOFF_SECONDS, PEER_BACKOFF_SECONDS, MessageType
+from app.packets import HandshakePacket
+from app.peer.manager import ConnectionManager, PeerBook
+from app.peer.peer import Peer
+from app.pieces import Pieces
+from app.storage import Storage
+from app.torrent_file import TorrentFile
+
+PIECE_LENGTH = 4 * BLOCK_SIZE_BYTES
+DATA = random.Random(13).randbytes(4 * PIECE_LENGTH)
+TORRENT = TorrentFile.from_bytes(
+    Dict(
+        {
+            "announce": String(b"http://localhost/"),
+            "info": Dict(
+                {
+                    "length": Integer(len(DATA)),
+                    "name": String(b"data.bin"),
+                    "piece length": Integer(PIECE_LENGTH),
+                    "pieces": String(
+                        b"".join(
+                            hashlib.sha1(DATA[start : start + PIECE_LENGTH]).digest()
+                            for start in range(0, len(DATA), PIECE_LENGTH)
+                        )
+                    ),
+                }
+            ),
+        }
+    ).to_bytes
+)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_backoff_doubles_and_is_capped() -> None:
+    clock = FakeClock()
+    book = PeerBook(clock)
+    book.add("10.0.0.1", 1)
+    retries = []
+    for _ in range(12):
+        book.failed("[10.0.0.1:1]")
+        retries.append(book["[10.0.0.1:1]"].retry_at - clock.now)
+    assert retries[:3] == [PEER_BACKOFF_SECONDS, 2 * PEER_BACKOFF_SECONDS, 4 * PEER_BACKOFF_SECONDS]
+    assert retries[-1] == MAX_PEER_BACKOFF_SECONDS
+    assert book.candidates(exclude=[]) == []
+    assert book.next_retry(exclude=[]) == MAX_PEER_BACKOFF_SECONDS
+    clock.now += MAX_PEER_BACKOFF_SECONDS
+    assert [record.peername for record in book.candidates(exclude=[])] == ["[10.0.0.1:1]"]
+
+
+def test_delivering_resets_failures_but_not_errors() -> None:
+    book = PeerBook(FakeClock())
+    book.add("10.0.0.1", 1)
+    book.failed("[10.0.0.1:1]")
+    book.failed("[10.0.0.1:1]")
+    book.connected("[10.0.0.1:1]", seconds=10, downloaded=1000, corrupt=0)
+    record = book["[10.0.0.1:1]"]
+    assert record.failures == 0
+    assert record.errors == 2
+    assert record.score == 100 / 3
+
+
+def test_candidates_best_first_and_worst_replaced() -> None:
+    book = PeerBook(FakeClock())
+    for port in (1, 2, 3):
+        book.add("10.0.0.1", port)
+    assert not book.add("10.0.0.1", 1)
+    book.connected("[10.0.0.1:1]", seconds=10, downloaded=10_000, corrupt=0)
+    book.connected("[10.0.0.1:2]", seconds=10, downloaded=100_000, corrupt=0)
+    book.connected("[10.0.0.1:3]", seconds=10, downloaded=100_000, corrupt=1)
+    order = [record.peername for record in book.candidates(exclude=[])]
+    assert order == ["[10.0.0.1:2]", "[10.0.0.1:3]", "[10.0.0.1:1]"]
+    assert book.worst(["[10.0.0.1:1]", "[10.0.0.1:2]"]) == "[10.0.0.1:1]"
+    assert book.worst(["[10.0.0.1:2]", "[10.0.0.1:3]"]) is None
+
+
+class FakePieces:
+    def __init__(self) -> None:
+        self.is_done = False
+        self.corrupt_suppliers: dict[str, int] = dict()
+
+    def return_in_queue(self, peername: str) -> None:
+        return
+
+
+class FakePeer:
+    dialing = 0
+    max_dialing = 0
+    attempts: dict[str, int] = dict()
+
+    def __init__(self, ip: str, port: int, release: asyncio.Event, fail: bool) -> None:
+        self.peername = f"[{ip}:{port}]"
+        self.downloaded = 0
+        self._release = release
+        self._fail = fail
+
+    async def connect(self, pieces: FakePieces) -> None:
+        FakePeer.attempts[self.peername] = FakePeer.attempts.get(self.peername, 0) + 1
+        FakePeer.dialing += 1
+        FakePeer.max_dialing = max(FakePeer.max_dialing, FakePeer.dialing)
+        try:
+            if self._fail:
+                raise ConnectionRefusedError
+            await self._release.wait()
+        finally:
+            FakePeer.dialing -= 1
+
+    async def exchange(self) -> None:
+        await asyncio.Event().wait()
+
+    async def close(self) -> None:
+        return
+
+
+def test_dials_are_capped_and_failures_backed_off() -> None:
+    async def scenario() -> None:
+        release = asyncio.Event()
+        manager = ConnectionManager(
+            FakePieces(),  # type: ignore[arg-type]
+            info_hash=bytes(20),
+            max_active=4,
+            max_dialing=2,
+            peer_factory=lambda ip, port: FakePeer(ip, port, release, fail=port == 1),  # type: ignore
+        )
+        manager.add_addresses([("10.0.0.1", port) for port in range(1, 7)])
+        task = asyncio.create_task(manager.run())
+        await asyncio.sleep(0.05)
+        assert FakePeer.max_dialing == 2
+        release.set()
+        await asyncio.sleep(0.05)
+        assert manager.active == 4
+        assert FakePeer.attempts["[10.0.0.1:1]"] == 1
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(scenario())
+
+
+
+class ChokingSeed:
+    """Has every piece, chokes after a few blocks and unchokes a moment later"""
+
+    def __init__(self, choke_after: int) -> None:
+        self.choke_after = choke_after
+        self.choked = False
+        self.connections = 0
+        self.port = 0
+        self._server: asyncio.Server | None = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            await reader.readexactly(68)
+            writer.write(HandshakePacket(TORRENT.info_hash, bytes(20), extension_enabled=False).to_bytes)
+            writer.write(struct.pack(">IBB", 2, MessageType.BITFIELD, 0xF0))
+            writer.write(struct.pack(">IB", 1, MessageType.UNCHOKE))
+            sent = 0
+            while True:
+                length = struct.unpack(">I", await reader.readexactly(4))[0]
+                message = await reader.readexactly(length)
+                if not message or message[0] != MessageType.REQUEST or self.choked:
+                    # Requests that come in while choked are dropped, as the protocol says
+                    continue
+                piece_index, offset, size = struct.unpack(">III", message[1:])
+                start = piece_index * PIECE_LENGTH + offset
+                header = struct.pack(">IBII", 9 + size, MessageType.PIECE, piece_index, offset)
+                writer.write(header + DATA[start : start + size])
+                sent += 1
+                if sent == self.choke_after:
+                    self.choked = True
+                    writer.write(struct.pack(">IB", 1, MessageType.CHOKE))
+                    asyncio.get_running_loop().call_later(0.05, self._unchoke, writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    def _unchoke(self, writer: asyncio.StreamWriter) -> None:
+        self.choked = False
+        writer.write(struct.pack(">IB", 1, MessageType.UNCHOKE))
+
+
+def test_choke_mid_download_pauses_the_peer_without_failing_it(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        seed = ChokingSeed(choke_after=3)
+        await seed.start()
+        storage = Storage(str(tmp_path / "data.bin"), len(DATA))
+        pieces = Pieces(TORRENT, storage)
+        verifier = asyncio.create_task(pieces.run_verifier())
+        manager = ConnectionManager(
+            pieces,
+            info_hash=TORRENT.info_hash,
+            peer_factory=lambda ip, port: Peer(ip, port, TORRENT.info_hash, extension_enabled=False),
+        )
+        manager.add_addresses([("127.0.0.1", seed.port)])
+        task = asyncio.create_task(manager.run())
+        await asyncio.wait_for(pieces.wait_done(), timeout=5)
+        # The blocks dropped by the choke were asked again on the same connection
+        assert seed.connections == 1
+        record = manager.book[f"[127.0.0.1:{seed.port}]"]
+        assert record.failures == 0 and record.errors == 0
+        for service in (task, verifier):
+            service.cancel()
+        await asyncio.gather(task, verifier, return_exceptions=True)
+        storage.close()
+        seed.close()
+
+    asyncio.run(scenario())
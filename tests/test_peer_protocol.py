@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from app.const import MAX_MESSAGE_BYTES, MY_ID, MessageType
+from app.exceptions import ReaderClosedError, WrongPacketFormatError
+from app.packets import HandshakePacket, PeerPacket
+from app.peer.protocol import PeerProtocol
+
+HANDSHAKE = HandshakePacket(info_hash=bytes(range(20)), peer_id_bytes=MY_ID, extension_enabled=True)
+PACKETS = [
+    PeerPacket(message_type=MessageType.UNCHOKE, payload=b""),
+    PeerPacket(message_type=MessageType.HAVE, payload=(7).to_bytes(4)),
+    PeerPacket(message_type=MessageType.PIECE, payload=bytes(8) + bytes(range(256)) * 100),
+    PeerPacket(message_type=MessageType.BITFIELD, payload=b"\xff\x80"),
+]
+STREAM = HANDSHAKE.to_bytes + b"".join(packet.to_bytes for packet in PACKETS) + bytes(4)
+
+
+class FakeTransport(asyncio.Transport):
+    def __init__(self) -> None:
+        super().__init__()
+        self.closing = False
+        self.reading = True
+
+    def is_closing(self) -> bool:
+        return self.closing
+
+    def is_reading(self) -> bool:
+        return self.reading
+
+    def pause_reading(self) -> None:
+        self.reading = False
+
+    def resume_reading(self) -> None:
+        self.reading = True
+
+    def close(self) -> None:
+        self.closing = True
+
+
+def deliver(protocol: PeerProtocol, data: bytes) -> None:
+    while data:
+        buffer = protocol.get_buffer(len(data))
+        size = min(len(buffer), len(data))
+        buffer[:size] = data[:size]
+        protocol.buffer_updated(size)
+        data = data[size:]
+
+
+async def read_all(chunks: list[bytes], chunk_size: int) -> tuple[HandshakePacket, list[PeerPacket]]:
+    protocol = PeerProtocol("test", chunk_size=chunk_size)
+    protocol.connection_made(FakeTransport())
+    for chunk in chunks:
+        deliver(protocol, chunk)
+    handshake = await protocol.read_handshake()
+    packets = [await protocol.read_packet() for _ in range(len(PACKETS) + 1)]
+    return handshake, packets
+
+
+def check(handshake: HandshakePacket, packets: list[PeerPacket]) -> None:
+    assert handshake == HANDSHAKE
+    assert [(packet.message_type, bytes(packet.payload)) for packet in packets[:-1]] == [
+        (packet.message_type, packet.payload) for packet in PACKETS
+    ]
+    assert packets[-1].message_type == MessageType.KEEPALIVE
+
+
+@pytest.mark.parametrize("split", range(0, len(STREAM) + 1, 97))
+def test_split_at_offsets(split: int) -> None:
+    check(*asyncio.run(read_all([STREAM[:split], STREAM[split:]], chunk_size=64 * 1024)))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 100, 4096])
+def test_small_chunks_keep_payload_views_valid(chunk_size: int) -> None:
+    check(*asyncio.run(read_all([STREAM[index : index + 1] for index in range(len(STREAM))], chunk_size)))
+
+
+def test_read_after_connection_lost() -> None:
+    async def scenario() -> None:
+        protocol = PeerProtocol("test")
+        protocol.connection_made(FakeTransport())
+        deliver(protocol, HANDSHAKE.to_bytes)
+        assert await protocol.read_handshake() == HANDSHAKE
+        waiter = asyncio.create_task(protocol.read_packet())
+        await asyncio.sleep(0)
+        protocol.connection_lost(None)
+        with pytest.raises(ReaderClosedError):
+            await waiter
+
+    asyncio.run(scenario())
+
+
+def test_oversized_length_prefix_is_refused_before_allocating() -> None:
+    async def scenario() -> None:
+        protocol = PeerProtocol("test", chunk_size=4096)
+        transport = FakeTransport()
+        protocol.connection_made(transport)
+        deliver(protocol, HANDSHAKE.to_bytes + (MAX_MESSAGE_BYTES + 1).to_bytes(4) + bytes(100))
+        assert await protocol.read_handshake() == HANDSHAKE
+        with pytest.raises(WrongPacketFormatError):
+            await protocol.read_packet()
+        assert transport.closing
+        assert len(protocol._chunk) < MAX_MESSAGE_BYTES  # noqa: WPS437
+
+    asyncio.run(scenario())
+
+
+def test_pausing_reading_leaves_bytes_in_the_socket() -> None:
+    async def scenario() -> None:
+        protocol = PeerProtocol("test")
+        transport = FakeTransport()
+        protocol.connection_made(transport)
+        protocol.pause_reading()
+        assert not transport.is_reading()
+        protocol.resume_reading()
+        assert transport.is_reading()
+        transport.close()
+        # A closing transport is left alone
+        protocol.pause_reading()
+        assert transport.is_reading()
+
+    asyncio.run(scenario())
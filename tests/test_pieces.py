@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import random
+from pathlib import Path
+
+from app.bencode import Dict, Integer, String
+from app.const import BLOCK_SIZE_BYTES, MessageType
+from app.packets import RequestPayload, RequestPeerPacket, pack_request_into
+from app.pieces import Pieces
+from app.storage import Storage
+from app.torrent_file import TorrentFile
+
+PIECE_LENGTH = 2 * BLOCK_SIZE_BYTES
+DATA = random.Random(7).randbytes(PIECE_LENGTH + 1000)
+
+
+def make_torrent() -> TorrentFile:
+    hashes = b"".join(
+        hashlib.sha1(DATA[start : start + PIECE_LENGTH]).digest() for start in range(0, len(DATA), PIECE_LENGTH)
+    )
+    info = Dict(
+        {
+            "length": Integer(len(DATA)),
+            "name": String(b"data.bin"),
+            "piece length": Integer(PIECE_LENGTH),
+            "pieces": String(hashes),
+        }
+    )
+    return TorrentFile.from_bytes(Dict({"announce": String(b"http://localhost/"), "info": info}).to_bytes)
+
+
+def block_of(request: tuple[int, int, int]) -> bytes:
+    piece_index, offset, length = request
+    start = piece_index * PIECE_LENGTH + offset
+    return DATA[start : start + length]
+
+
+def test_requests_are_made_on_demand_and_cancelled_in_endgame(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        storage = Storage(str(tmp_path / "data.bin"), len(DATA))
+        pieces = Pieces(make_torrent(), storage)
+        verifier = asyncio.create_task(pieces.run_verifier())
+        cancelled: list[tuple[int, int, int]] = []
+        pieces.add_peer("a", b"\x80")
+        pieces.add_peer("b", b"\xc0")
+        pieces.attach_peer("a", cancel=lambda *request: None, depth=lambda: 2)
+        pieces.attach_peer("b", cancel=lambda *request: cancelled.append(request), depth=lambda: 2)
+        assert pieces.left == len(DATA)
+        first = pieces.next_request("a")
+        second = pieces.next_request("a")
+        assert [first, second] == [(0, 0, BLOCK_SIZE_BYTES), (0, BLOCK_SIZE_BYTES, BLOCK_SIZE_BYTES)]
+        last = pieces.next_request("b")
+        assert last == (1, 0, 1000)
+        assert not pieces.in_endgame
+        # Every remaining block is in flight, so b duplicates one of a's
+        duplicate = pieces.next_request("b")
+        assert pieces.in_endgame
+        assert duplicate in {first, second}
+        pieces.put_processed(*duplicate[:2], block_of(duplicate), "a")
+        assert cancelled == [duplicate]
+        pieces.return_in_queue("a")
+        other = pieces.next_request("b")
+        assert other is not None and {other, duplicate} == {first, second}
+        pieces.put_processed(*other[:2], block_of(other), "b")
+        pieces.put_processed(*last[:2], block_of(last), "b")
+        await asyncio.wait_for(pieces.wait_done(), 5)
+        assert pieces.left == 0
+        assert storage.read(0, len(DATA)) == DATA
+        verifier.cancel()
+        await asyncio.gather(verifier, return_exceptions=True)
+        storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_unrequested_and_misaligned_blocks_are_ignored(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        storage = Storage(str(tmp_path / "data.bin"), len(DATA))
+        pieces = Pieces(make_torrent(), storage)
+        pieces.add_peer("a", b"\x80")
+        request = pieces.next_request("a")
+        assert request is not None
+        pieces.put_processed(*request[:2], block_of(request), "b")
+        pieces.put_processed(0, 1, b"x", "a")
+        pieces.put_processed(9, 0, b"x", "a")
+        assert pieces.next_request("b") is None
+        assert pieces.left == len(DATA)
+        storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_packed_request_matches_the_packet() -> None:
+    buffer = bytearray()
+    end = pack_request_into(buffer, 0, MessageType.REQUEST, 1, BLOCK_SIZE_BYTES, 1000)
+    end = pack_request_into(buffer, end, MessageType.REQUEST, 3, 0, BLOCK_SIZE_BYTES)
+    packets = [
+        RequestPeerPacket(payload=RequestPayload(piece_index=1, offset=BLOCK_SIZE_BYTES, length=1000).to_bytes),
+        RequestPeerPacket(payload=RequestPayload(piece_index=3, offset=0, length=BLOCK_SIZE_BYTES).to_bytes),
+    ]
+    assert bytes(buffer[:end]) == b"".join(packet.to_bytes for packet in packets)
+
+
+def test_sequential_mode_asks_again_for_overdue_blocks(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        now = [0.0]
+        storage = Storage(str(tmp_path / "data.bin"), len(DATA))
+        pieces = Pieces(make_torrent(), storage, sequential=True, deadline_seconds=2, clock=lambda: now[0])
+        verifier = asyncio.create_task(pieces.run_verifier())
+        cancelled: list[tuple[int, int, int]] = []
+        pieces.add_peer("a", b"\xc0")
+        pieces.add_peer("b", b"\xc0")
+        pieces.attach_peer("a", cancel=lambda *request: None, depth=lambda: 8)
+        pieces.attach_peer("b", cancel=lambda *request: cancelled.append(request), depth=lambda: 8)
+        assert pieces.cursor == 0
+        first = pieces.next_request("a")
+        assert first == (0, 0, BLOCK_SIZE_BYTES)
+        now[0] = 1
+        last = pieces.next_request("b")
+        assert last == (1, 0, 1000)
+        now[0] = 3
+        # a's block at the cursor is past its deadline, so b is asked for it too
+        assert pieces.next_request("b") == first
+        assert not pieces.in_endgame
+        pieces.put_processed(0, 0, block_of(first), "a")
+        assert cancelled == [first]
+        second = pieces.next_request("a")
+        assert second == (0, BLOCK_SIZE_BYTES, BLOCK_SIZE_BYTES)
+        pieces.put_processed(*second[:2], block_of(second), "a")
+        pieces.put_processed(*last[:2], block_of(last), "b")
+        await asyncio.wait_for(pieces.wait_done(), 5)
+        assert pieces.cursor == 1
+        assert storage.read(0, len(DATA)) == DATA
+        verifier.cancel()
+        await asyncio.gather(verifier, return_exceptions=True)
+        storage.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,101 @@
+import asyncio
+import hashlib
+import random
+from pathlib import Path
+from typing import Optional
+
+import pytest
+
+from app.bencode import Dict, Integer, String
+from app.const import BLOCK_SIZE_BYTES
+from app.exceptions import RangeNotSatisfiableError
+from app.pieces import Pieces
+from app.range_server import ByteRange, RangeServer, parse_range
+from app.storage import Storage
+from app.torrent_file import TorrentFile
+
+PIECE_LENGTH = BLOCK_SIZE_BYTES
+DATA = random.Random(13).randbytes(4 * PIECE_LENGTH - 100)
+
+
+def make_torrent() -> TorrentFile:
+    hashes = b"".join(
+        hashlib.sha1(DATA[start : start + PIECE_LENGTH]).digest() for start in range(0, len(DATA), PIECE_LENGTH)
+    )
+    info = Dict(
+        {
+            "length": Integer(len(DATA)),
+            "name": String(b"movie.mp4"),
+            "piece length": Integer(PIECE_LENGTH),
+            "pieces": String(hashes),
+        }
+    )
+    return TorrentFile.from_bytes(Dict({"announce": String(b"http://localhost/"), "info": info}).to_bytes)
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        (None, None),
+        ("bytes=0-99", ByteRange(0, 100)),
+        ("bytes=100-", ByteRange(100, 1000)),
+        ("bytes=-10", ByteRange(990, 1000)),
+        ("bytes=900-5000", ByteRange(900, 1000)),
+        ("bytes=0-1,5-6", None),
+        ("items=0-1", None),
+        ("bytes=5-1", None),
+    ],
+)
+def test_range_header_is_parsed(header: Optional[str], expected: Optional[ByteRange]) -> None:
+    assert parse_range(header, 1000) == expected
+
+
+def test_range_past_the_end_is_not_satisfiable() -> None:
+    with pytest.raises(RangeNotSatisfiableError):
+        parse_range("bytes=1000-", 1000)
+
+
+async def get(port: int, request: bytes) -> tuple[bytes, bytes]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(request)
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = int(head.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+    body = await reader.readexactly(length)
+    writer.close()
+    return head, body
+
+
+def test_response_waits_only_for_missing_pieces(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        storage = Storage(str(tmp_path / "movie.mp4"), len(DATA))
+        pieces = Pieces(make_torrent(), storage, sequential=True)
+        verifier = asyncio.create_task(pieces.run_verifier())
+        server = RangeServer(make_torrent(), storage.read, pieces)
+        await server.start("127.0.0.1", 0)
+        start = 2 * PIECE_LENGTH + 10
+        request = f"GET /movie.mp4 HTTP/1.1\r\nRange: bytes={start}-\r\n\r\n".encode()
+        response = asyncio.create_task(get(server.port, request))
+        await asyncio.sleep(0.05)
+        assert not response.done()
+        # The player's position became the download cursor
+        assert pieces.cursor == 2
+        pieces.add_peer("a", b"\xf0")
+        for _ in range(2):
+            piece_index, offset, length = pieces.next_request("a") or (0, 0, 0)
+            assert piece_index in {2, 3}
+            begin = piece_index * PIECE_LENGTH + offset
+            pieces.put_processed(piece_index, offset, DATA[begin : begin + length], "a")
+        head, body = await asyncio.wait_for(response, 5)
+        assert head.startswith(b"HTTP/1.1 206 Partial Content\r\n")
+        assert f"Content-Range: bytes {start}-{len(DATA) - 1}/{len(DATA)}".encode() in head
+        assert b"Content-Type: video/mp4" in head
+        assert body == DATA[start:]
+        assert not pieces.verified[0]
+        head, _ = await get(server.port, b"HEAD /other HTTP/1.1\r\n\r\n")
+        assert head.startswith(b"HTTP/1.1 404")
+        await server.close()
+        verifier.cancel()
+        await asyncio.gather(verifier, return_exceptions=True)
+        storage.close()
+
+    asyncio.run(scenario())
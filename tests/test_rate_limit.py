@@ -0,0 +1,256 @@
+import asyncio
+import hashlib
+import random
+import struct
+from pathlib import Path
+
+from app.bencode import Dict, Integer, String
+from app.bitfield import Bitfield
+from app.const import BLOCK_SIZE_BYTES, MY_ID, MessageType
+from app.packets import HandshakePacket
+from app.peer.peer import Peer
+from app.pieces import Pieces
+from app.rate_limit import TokenBucket, nested_bucket
+from app.seeding.block_cache import BlockCache
+from app.seeding.server import SeedServer
+from app.storage import Storage
+from app.torrent_file import TorrentFile
+
+BLOCK = BLOCK_SIZE_BYTES
+PIECE_LENGTH = 4 * BLOCK
+DATA = random.Random(25).randbytes(16 * PIECE_LENGTH)
+TORRENT = TorrentFile.from_bytes(
+    Dict(
+        {
+            "announce": String(b"http://localhost/"),
+            "info": Dict(
+                {
+                    "length": Integer(len(DATA)),
+                    "name": String(b"data.bin"),
+                    "piece length": Integer(PIECE_LENGTH),
+                    "pieces": String(
+                        b"".join(
+                            hashlib.sha1(DATA[start : start + PIECE_LENGTH]).digest()
+                            for start in range(0, len(DATA), PIECE_LENGTH)
+                        )
+                    ),
+                }
+            ),
+        }
+    ).to_bytes
+)
+
+
+class VirtualClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+async def read_message(reader: asyncio.StreamReader) -> bytes:
+    length = struct.unpack(">I", await reader.readexactly(4))[0]
+    return await reader.readexactly(length)
+
+
+def piece_message(piece_index: int, offset: int, length: int) -> bytes:
+    start = piece_index * PIECE_LENGTH + offset
+    header = struct.pack(">IBII", 9 + length, MessageType.PIECE, piece_index, offset)
+    return header + DATA[start : start + length]
+
+
+class StubPeer:
+    """Has every piece, records the REQUESTs it gets and answers them unless told not to"""
+
+    def __init__(self, answer: bool = True) -> None:
+        self.answer = answer
+        self.requests: list[tuple[int, int, int]] = []
+        self.writer: asyncio.StreamWriter | None = None
+        self.port = 0
+        self._server: asyncio.Server | None = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.writer = writer
+        try:
+            await reader.readexactly(68)
+            writer.write(HandshakePacket(TORRENT.info_hash, bytes(20), extension_enabled=False).to_bytes)
+            have = Bitfield(len(TORRENT.piece_hashes))
+            for piece_index in range(len(have)):
+                have.set(piece_index)
+            writer.write(struct.pack(">IB", 1 + len(have.to_bytes), MessageType.BITFIELD) + have.to_bytes)
+            writer.write(struct.pack(">IB", 1, MessageType.UNCHOKE))
+            while True:
+                message = await read_message(reader)
+                if not message or message[0] != MessageType.REQUEST:
+                    continue
+                request = struct.unpack(">III", message[1:])
+                self.requests.append(request)
+                if self.answer:
+                    writer.write(piece_message(*request))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+
+async def settle() -> None:
+    """Real time for throttled peers to poll the virtual clock a few times"""
+    await asyncio.sleep(0.1)
+
+
+async def connect(stub: StubPeer, pieces: Pieces, bucket: TokenBucket) -> tuple[Peer, asyncio.Task[None]]:
+    peer = Peer("127.0.0.1", stub.port, TORRENT.info_hash, extension_enabled=False, rate_limit=bucket)
+    await peer.connect(pieces)
+    return peer, asyncio.create_task(peer.exchange())
+
+
+def test_token_bucket_allows_a_burst_then_the_rate() -> None:
+    now = [0.0]
+    bucket = TokenBucket(rate=BLOCK_SIZE_BYTES, burst=2 * BLOCK_SIZE_BYTES, clock=lambda: now[0])
+    assert bucket.delay(BLOCK_SIZE_BYTES) == 0
+    bucket.take(2 * BLOCK_SIZE_BYTES)
+    assert bucket.delay(BLOCK_SIZE_BYTES) == 1
+    now[0] = 0.5
+    assert bucket.delay(BLOCK_SIZE_BYTES) == 0.5
+    now[0] = 10
+    bucket.take(BLOCK_SIZE_BYTES)
+    # Idle time only refills up to the burst
+    assert bucket.delay(BLOCK_SIZE_BYTES) == 0
+    bucket.take(BLOCK_SIZE_BYTES)
+    assert bucket.delay(BLOCK_SIZE_BYTES) == 1
+
+
+def test_buckets_pass_bytes_only_when_every_level_can_pay() -> None:
+    clock = VirtualClock()
+    parent = TokenBucket(rate=BLOCK, burst=2 * BLOCK, clock=clock)
+    child = TokenBucket(rate=10 * BLOCK, burst=4 * BLOCK, clock=clock, parent=parent)
+    assert child.delay(2 * BLOCK) == 0
+    assert child.delay(3 * BLOCK) == 1
+    child.take(2 * BLOCK)
+    assert parent.delay(BLOCK) == 1
+    assert child.delay(BLOCK) == 1
+    clock.now = 0.5
+    child.give_back(BLOCK)
+    # The child has refilled to its burst already, only the parent gains from the refund
+    assert child.delay(4 * BLOCK) == 2.5
+    assert parent.delay(2 * BLOCK) == 0.5
+    child.take(3 * BLOCK)
+    assert child.delay(0) == parent.delay(0) == 1.5
+    assert nested_bucket(parent, None) is parent
+    assert nested_bucket(None, None) is None
+    nested = nested_bucket(parent, 3 * BLOCK)
+    assert nested is not None and nested.clock is clock and nested.rate == 3 * BLOCK
+
+
+def test_requests_follow_the_tightest_level(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        clock = VirtualClock()
+        stubs = [StubPeer(), StubPeer()]
+        for stub in stubs:
+            await stub.start()
+        storage = Storage(str(tmp_path / "data.bin"), len(DATA))
+        pieces = Pieces(TORRENT, storage)
+        verifier = asyncio.create_task(pieces.run_verifier())
+        torrent = TokenBucket(rate=20 * BLOCK, burst=4 * BLOCK, clock=clock)
+        buckets = [TokenBucket(rate=100 * BLOCK, burst=3 * BLOCK, clock=clock, parent=torrent) for _ in stubs]
+        connected = [await connect(stub, pieces, bucket) for stub, bucket in zip(stubs, buckets)]
+        await settle()
+        counts = [len(stub.requests) for stub in stubs]
+        # Each peer may burst 3 blocks, but the torrent only 4 between them
+        assert sum(counts) == 4 and max(counts) <= 3
+        clock.now = 0.1
+        await settle()
+        counts = [len(stub.requests) for stub in stubs]
+        assert sum(counts) == 6 and max(counts) <= 6
+        clock.now = 10
+        await settle()
+        # Idle time refills no more than the burst
+        assert sum(len(stub.requests) for stub in stubs) == 10
+        assert pieces.downloaded == 10 * BLOCK
+        for peer, task in connected:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await peer.close()
+        verifier.cancel()
+        await asyncio.gather(verifier, return_exceptions=True)
+        storage.close()
+        for stub in stubs:
+            stub.close()
+
+    asyncio.run(scenario())
+
+
+def test_reader_pauses_while_unasked_blocks_are_in_debt(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        clock = VirtualClock()
+        stub = StubPeer(answer=False)
+        await stub.start()
+        storage = Storage(str(tmp_path / "data.bin"), len(DATA))
+        pieces = Pieces(TORRENT, storage)
+        torrent = TokenBucket(rate=100 * BLOCK, burst=4 * BLOCK, clock=clock)
+        bucket = TokenBucket(rate=100 * BLOCK, burst=2 * BLOCK, clock=clock, parent=torrent)
+        peer, task = await connect(stub, pieces, bucket)
+        await settle()
+        assert len(stub.requests) == 2
+        unasked = [(index, 0, BLOCK) for index in range(len(TORRENT.piece_hashes))]
+        unasked = [request for request in unasked if request not in stub.requests][:3]
+        if stub.writer is None:
+            raise NotImplementedError
+        for request in unasked:
+            stub.writer.write(piece_message(*request))
+        await settle()
+        # The first one put the peer a block in debt, the others wait in the socket
+        assert peer.downloaded == BLOCK
+        clock.now = 0.01
+        await settle()
+        assert peer.downloaded == 2 * BLOCK
+        assert len(stub.requests) == 2
+        # The two blocks asked for never come: closing refunds them to the torrent
+        assert torrent.delay(3 * BLOCK) > 0
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await peer.close()
+        assert torrent.delay(3 * BLOCK) == 0
+        storage.close()
+        stub.close()
+
+    asyncio.run(scenario())
+
+
+def test_seeder_stops_reading_requests_over_the_upload_budget() -> None:
+    async def scenario() -> None:
+        clock = VirtualClock()
+        have = Bitfield(len(TORRENT.piece_hashes))
+        for piece_index in range(len(have)):
+            have.set(piece_index)
+        cache = BlockCache(
+            lambda offset, length: DATA[offset : offset + length], PIECE_LENGTH, TORRENT.piece_size
+        )
+        upload = TokenBucket(rate=100 * BLOCK, burst=2 * BLOCK, clock=clock)
+        server = SeedServer(TORRENT.info_hash, have, cache, TORRENT.piece_size, rate_limit=upload)
+        await server.start("127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(HandshakePacket(TORRENT.info_hash, MY_ID, extension_enabled=False).to_bytes)
+        await reader.readexactly(68)
+        await read_message(reader)
+        writer.write(struct.pack(">IB", 1, MessageType.INTERESTED))
+        assert await read_message(reader) == bytes([MessageType.UNCHOKE])
+        for offset in range(0, PIECE_LENGTH, BLOCK):
+            writer.write(struct.pack(">IBIII", 13, MessageType.REQUEST, 0, offset, BLOCK))
+        await settle()
+        # Served until the budget went into debt, the next REQUEST is left unread
+        assert server.uploaded == 3 * BLOCK
+        clock.now = 0.01
+        await settle()
+        assert server.uploaded == 4 * BLOCK
+        writer.close()
+        await server.close()
+
+    asyncio.run(scenario())
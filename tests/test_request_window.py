@@ -0,0 +1,42 @@
+from app.const import BLOCK_SIZE_BYTES
+from app.peer.window import RequestWindow
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def run(window: RequestWindow, clock: FakeClock, rtt: float, blocks_per_second: int) -> None:
+    step = 1 / blocks_per_second
+    events: list[tuple[float, bool, int]] = []
+    for index in range(blocks_per_second * 5):
+        events.append((index * step, False, index))
+        events.append((index * step + rtt, True, index))
+    for now, is_received, index in sorted(events):
+        clock.now = now
+        if is_received:
+            window.received(index, BLOCK_SIZE_BYTES)
+        else:
+            window.sent(index)
+
+
+def test_depth_follows_bandwidth_delay_product() -> None:
+    clock = FakeClock()
+    window = RequestWindow(min_depth=2, max_depth=500, clock=clock)
+    run(window, clock, rtt=0.1, blocks_per_second=640)
+    assert 120 <= window.depth <= 130
+
+
+def test_depth_stays_within_bounds() -> None:
+    clock = FakeClock()
+    window = RequestWindow(min_depth=3, max_depth=20, clock=clock)
+    run(window, clock, rtt=0.5, blocks_per_second=1000)
+    assert window.depth == 20
+    clock = FakeClock()
+    window = RequestWindow(min_depth=3, max_depth=20, clock=clock)
+    run(window, clock, rtt=0.001, blocks_per_second=10)
+    assert window.depth == 3
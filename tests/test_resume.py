@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import os
+from pathlib import Path
+
+from app.bencode import Dict, Integer, String
+from app.bitfield import Bitfield
+from app.recheck import recheck, verify_stream
+from app.resume import ResumeFile
+from app.storage import FileReader
+from app.torrent_file import TorrentFile
+
+INFO_HASH = bytes(range(20))
+PIECE_LENGTH = 1024
+DATA = os.urandom(10 * PIECE_LENGTH + 100)
+
+
+def make_torrent() -> TorrentFile:
+    hashes = b"".join(
+        hashlib.sha1(DATA[offset : offset + PIECE_LENGTH]).digest()
+        for offset in range(0, len(DATA), PIECE_LENGTH)
+    )
+    info = Dict(
+        {
+            "length": Integer(len(DATA)),
+            "name": String(b"data.bin"),
+            "piece length": Integer(PIECE_LENGTH),
+            "pieces": String(hashes),
+        }
+    )
+    return TorrentFile.from_bytes(Dict({"announce": String(b"http://localhost/"), "info": info}).to_bytes)
+
+
+def verified(*indices: int) -> Bitfield:
+    bitfield = Bitfield(11)
+    for index in indices:
+        bitfield.set(index)
+    return bitfield
+
+
+def load(resume: ResumeFile, data_path: Path) -> tuple[list[int], bool]:
+    pieces, trusted = resume.load(str(data_path))
+    return list(pieces), trusted
+
+
+def test_round_trip_and_atomic_replace(tmp_path: Path) -> None:
+    data_path = tmp_path / "data.part"
+    data_path.write_bytes(DATA)
+    resume = ResumeFile(str(tmp_path / "data.resume"), INFO_HASH, 11)
+    assert load(resume, data_path) == ([], True)
+    resume.save(verified(0, 3, 10), str(data_path))
+    resume.save(verified(0, 3, 7, 10), str(data_path))
+    pieces, trusted = resume.load(str(data_path))
+    assert list(pieces) == [0, 3, 7, 10]
+    assert trusted
+    assert sorted(os.listdir(tmp_path)) == ["data.part", "data.resume"]
+    resume.remove()
+    resume.remove()
+
+
+def test_modified_data_is_not_trusted(tmp_path: Path) -> None:
+    data_path = tmp_path / "data.part"
+    data_path.write_bytes(DATA)
+    resume = ResumeFile(str(tmp_path / "data.resume"), INFO_HASH, 11)
+    resume.save(verified(1, 2), str(data_path))
+    stat = data_path.stat()
+    os.utime(data_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    pieces, trusted = resume.load(str(data_path))
+    assert list(pieces) == [1, 2]
+    assert not trusted
+
+
+def test_other_torrent_size_or_garbage_start_over(tmp_path: Path) -> None:
+    data_path = tmp_path / "data.part"
+    data_path.write_bytes(DATA)
+    ResumeFile(str(tmp_path / "data.resume"), bytes(20), 11).save(verified(1), str(data_path))
+    assert load(ResumeFile(str(tmp_path / "data.resume"), INFO_HASH, 11), data_path) == ([], True)
+    resume = ResumeFile(str(tmp_path / "data.resume"), INFO_HASH, 11)
+    resume.save(verified(1), str(data_path))
+    data_path.write_bytes(DATA[:-1])
+    assert load(resume, data_path) == ([], True)
+    (tmp_path / "data.resume").write_bytes(b"d4:info")
+    assert load(resume, data_path) == ([], True)
+
+
+def test_recheck_finds_damaged_pieces() -> None:
+    torrent_file = make_torrent()
+    damaged = bytearray(DATA)
+    damaged[3 * PIECE_LENGTH] ^= 1
+    damaged[-1] ^= 1
+
+    def read(offset: int, length: int) -> bytes:
+        return bytes(damaged[offset : offset + length])
+
+    good = asyncio.run(recheck(read, torrent_file, range(11), max_workers=3))
+    assert list(good) == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+    good = asyncio.run(recheck(read, torrent_file, [3, 4], max_workers=1))
+    assert list(good) == [4]
+
+
+def test_verify_stream_reports_bad_and_missing_pieces(tmp_path: Path) -> None:
+    torrent_file = make_torrent()
+    damaged = bytearray(DATA)
+    damaged[5 * PIECE_LENGTH + 7] ^= 1
+    for read_bytes in (1, PIECE_LENGTH, 3 * PIECE_LENGTH + 5, 1 << 20):
+        report = verify_stream(
+            lambda offset, length: bytes(damaged[offset : offset + length]),
+            torrent_file,
+            max_workers=2,
+            read_bytes=read_bytes,
+        )
+        assert report.bad_pieces == [5]
+        assert report.hashed_bytes == len(DATA)
+    short = tmp_path / "short.bin"
+    short.write_bytes(DATA[: 8 * PIECE_LENGTH])
+    with FileReader(str(short), len(DATA)) as reader:
+        assert len(reader.mismatches) == 1
+        report = verify_stream(reader.read, torrent_file, read_bytes=PIECE_LENGTH)
+    assert report.bad_pieces == [8, 9, 10]
@@ -0,0 +1,109 @@
+import pytest
+
+from app.bitfield import Bitfield
+from app.scheduler import MAX_SKIPPED_CANDIDATES, PieceBlock, PieceScheduler
+
+PIECE_COUNT = 8
+BLOCKS_PER_PIECE = 2
+
+
+def make_scheduler() -> PieceScheduler:
+    return PieceScheduler(
+        piece_count=PIECE_COUNT,
+        wanted=range(PIECE_COUNT),
+        blocks_count=lambda piece_index: BLOCKS_PER_PIECE,
+    )
+
+
+def bitfield(*pieces: int) -> Bitfield:
+    result = Bitfield(PIECE_COUNT)
+    for piece_index in pieces:
+        result.set(piece_index)
+    return result
+
+
+def test_rarest_piece_first() -> None:
+    scheduler = make_scheduler()
+    scheduler.add_peer("seed", bitfield(*range(PIECE_COUNT)))
+    scheduler.add_peer("a", bitfield(0, 1, 2, 3, 4, 5, 7))
+    scheduler.add_peer("b", bitfield(0, 1, 2, 3, 4, 5))
+    assert scheduler.next_block("seed") == PieceBlock(6, 0)
+    assert scheduler.next_block("a") == PieceBlock(7, 0)
+
+
+def test_whole_piece_stays_with_one_peer() -> None:
+    scheduler = make_scheduler()
+    scheduler.add_peer("a", bitfield(*range(PIECE_COUNT)))
+    scheduler.add_peer("b", bitfield(*range(PIECE_COUNT)))
+    first = scheduler.next_block("a")
+    assert first is not None
+    other = scheduler.next_block("b")
+    assert other is not None and other.piece_index != first.piece_index
+    assert scheduler.next_block("a") == PieceBlock(first.piece_index, 1)
+
+
+def test_orphaned_piece_is_finished_by_another_peer() -> None:
+    scheduler = make_scheduler()
+    scheduler.add_peer("a", bitfield(3))
+    scheduler.add_peer("b", bitfield(3))
+    block = scheduler.next_block("a")
+    assert block == PieceBlock(3, 0)
+    scheduler.remove_peer("a")
+    scheduler.return_block(block)
+    assert scheduler.next_block("b") == PieceBlock(3, 0)
+    assert scheduler.next_block("b") == PieceBlock(3, 1)
+    assert scheduler.next_block("b") is None
+
+
+def test_have_and_reset_make_piece_available() -> None:
+    scheduler = make_scheduler()
+    scheduler.add_peer("a")
+    assert scheduler.next_block("a") is None
+    scheduler.peer_has("a", 5)
+    assert scheduler.next_block("a") == PieceBlock(5, 0)
+    assert scheduler.next_block("a") == PieceBlock(5, 1)
+    scheduler.piece_finished(5)
+    scheduler.reset_piece(5)
+    assert scheduler.next_block("a") == PieceBlock(5, 0)
+
+
+def test_cursor_window_comes_first_and_every_fourth_pick_is_rarest() -> None:
+    scheduler = PieceScheduler(
+        piece_count=PIECE_COUNT,
+        wanted=range(PIECE_COUNT),
+        blocks_count=lambda piece_index: 1,
+        window=3,
+        rarest_every=4,
+    )
+    scheduler.add_peer("seed", bitfield(*range(PIECE_COUNT)))
+    scheduler.add_peer("b", bitfield(*range(7)))
+    scheduler.set_cursor(2)
+    picks = [scheduler.next_block("seed") for _ in range(5)]
+    assert [block.piece_index for block in picks if block is not None][:4] == [2, 3, 4, 7]
+    # The window is all started, so the next piece comes from rarest first again
+    assert picks[4] is not None and picks[4].piece_index in {0, 1, 5, 6}
+
+
+def test_pieces_nobody_has_do_not_push_picks_to_a_scan(monkeypatch: pytest.MonkeyPatch) -> None:
+    piece_count = 4 * MAX_SKIPPED_CANDIDATES
+    missing = 2 * MAX_SKIPPED_CANDIDATES
+    scheduler = PieceScheduler(piece_count, wanted=range(piece_count), blocks_count=lambda piece_index: 1)
+
+    def scan(have: Bitfield) -> None:
+        raise AssertionError("picked by a scan of all pieces")
+
+    monkeypatch.setattr(scheduler, "_scan_rarest", scan)
+    common = Bitfield(piece_count)
+    for piece_index in range(missing, piece_count):
+        common.set(piece_index)
+    rare = Bitfield(piece_count)
+    for piece_index in range(missing, missing + 10):
+        rare.set(piece_index)
+    scheduler.add_peer("a", common)
+    scheduler.add_peer("b", common)
+    scheduler.add_peer("c", rare)
+    picks = [scheduler.next_block("a") for _ in range(missing - 10)]
+    picked = {block.piece_index for block in picks if block is not None}
+    assert picked == set(range(missing + 10, piece_count))
+    scheduler.peer_has("c", 0)
+    assert scheduler.next_block("c") == PieceBlock(0, 0)
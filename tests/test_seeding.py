@@ -0,0 +1,85 @@
+import asyncio
+import random
+import struct
+
+from app.bitfield import Bitfield
+from app.const import MY_ID, MessageType
+from app.packets import HandshakePacket
+from app.seeding.block_cache import BlockCache
+from app.seeding.choker import Choker, LeecherStats
+from app.seeding.server import SeedServer
+
+PIECE_LENGTH = 32 * 1024
+DATA = random.Random(1).randbytes(3 * PIECE_LENGTH + 1000)
+INFO_HASH = bytes(range(20))
+
+
+def piece_size(piece_index: int) -> int:
+    return min(PIECE_LENGTH, len(DATA) - piece_index * PIECE_LENGTH)
+
+
+def read(offset: int, length: int) -> bytes:
+    return DATA[offset : offset + length]
+
+
+def test_cache_reads_each_piece_once_and_evicts_lru() -> None:
+    cache = BlockCache(read, PIECE_LENGTH, piece_size, capacity_bytes=2 * PIECE_LENGTH)
+    for offset in range(0, PIECE_LENGTH, 16384):
+        assert cache.get(0, offset, 16384) == DATA[offset : offset + 16384]
+    assert (cache.misses, cache.hits) == (1, 1)
+    cache.get(1, 0, 10)
+    cache.get(0, 0, 10)
+    cache.get(2, 0, 10)
+    cache.get(0, 0, 10)
+    assert cache.misses == 3
+    assert cache.get(3, 0, 1000) == DATA[3 * PIECE_LENGTH :]
+
+
+def test_choker_prefers_fast_peers_and_rotates_optimistic() -> None:
+    choker = Choker(slots=3, rng=random.Random(0))
+    leechers = {f"p{index}": LeecherStats(interested=True, rate=index) for index in range(10)}
+    leechers["idle"] = LeecherStats(interested=False, rate=100)
+    optimistic = set()
+    for _ in range(30):
+        unchoked = choker.rechoke(leechers)
+        assert len(unchoked) == 3
+        assert {"p9", "p8"} <= unchoked
+        assert "idle" not in unchoked
+        optimistic.add(choker.optimistic)
+    assert len(optimistic) > 2
+
+
+def test_choker_unchokes_everyone_when_slots_suffice() -> None:
+    leechers = {"a": LeecherStats(interested=True, rate=0), "b": LeecherStats(interested=False, rate=0)}
+    assert Choker(slots=4).rechoke(leechers) == {"a"}
+
+
+async def read_message(reader: asyncio.StreamReader) -> bytes:
+    length = struct.unpack(">I", await reader.readexactly(4))[0]
+    return await reader.readexactly(length)
+
+
+def test_serves_requests_after_unchoke() -> None:
+    async def scenario() -> None:
+        have = Bitfield(4)
+        for piece_index in (0, 3):
+            have.set(piece_index)
+        server = SeedServer(INFO_HASH, have, BlockCache(read, PIECE_LENGTH, piece_size), piece_size)
+        await server.start("127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(HandshakePacket(info_hash=INFO_HASH, peer_id_bytes=MY_ID, extension_enabled=False).to_bytes)
+        assert HandshakePacket.from_bytes(await reader.readexactly(68)).info_hash == INFO_HASH
+        assert await read_message(reader) == bytes([MessageType.BITFIELD]) + have.to_bytes
+        writer.write(struct.pack(">IB", 1, MessageType.INTERESTED))
+        assert await read_message(reader) == bytes([MessageType.UNCHOKE])
+        writer.write(struct.pack(">IBIII", 13, MessageType.REQUEST, 3, 500, 400))
+        message = await read_message(reader)
+        assert message[:9] == struct.pack(">BII", MessageType.PIECE, 3, 500)
+        assert message[9:] == DATA[3 * PIECE_LENGTH + 500 : 3 * PIECE_LENGTH + 900]
+        server.have_piece(1)
+        assert await read_message(reader) == struct.pack(">BI", MessageType.HAVE, 1)
+        assert server.uploaded == 400
+        writer.close()
+        await server.close()
+
+    asyncio.run(scenario())
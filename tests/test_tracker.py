@@ -0,0 +1,123 @@
+import asyncio
+from typing import Awaitable, Callable
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from app.bencode import Dict, Integer, List, String
+from app.exceptions import TrackerError
+from app.tracker.announce import Announcer
+from app.tracker.models import AnnounceEvent, AnnounceResponse, TransferStats
+from app.tracker.http_pool import HttpPool
+
+COMPACT_PEERS = bytes([127, 0, 0, 1, 0x1A, 0xE1, 10, 0, 0, 2, 0x1A, 0xE2])
+RESPONSE = Dict(
+    {"interval": Integer(900), "min interval": Integer(1200), "peers": String(COMPACT_PEERS)}
+).to_bytes
+
+Handler = Callable[[asyncio.StreamReader, asyncio.StreamWriter], Awaitable[None]]
+
+
+class StubTracker:
+    """Keep-alive HTTP/1.1 tracker that records every request and connection"""
+
+    def __init__(self, body: bytes = RESPONSE, chunked: bool = False) -> None:
+        self.body = body
+        self.chunked = chunked
+        self.connections = 0
+        self.queries: list[dict[str, list[str]]] = []
+        self.url = ""
+        self._server: asyncio.Server | None = None
+
+    async def __aenter__(self) -> "StubTracker":
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        port = self._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/announce"
+        return self
+
+    async def __aexit__(self, *args: object) -> None:
+        if self._server is not None:
+            self._server.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            while request_line := await reader.readline():
+                while await reader.readline() != b"\r\n":
+                    continue
+                target = request_line.split()[1].decode()
+                self.queries.append(parse_qs(urlsplit(target).query))
+                writer.write(self._response())
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def _response(self) -> bytes:
+        if not self.chunked:
+            return b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(self.body) + self.body
+        half = len(self.body) // 2
+        chunks = b"".join(b"%x\r\n%s\r\n" % (len(part), part) for part in (self.body[:half], self.body[half:]))
+        return b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n" + chunks + b"0\r\n\r\n"
+
+
+def test_parse_compact_and_dict_peers() -> None:
+    response = AnnounceResponse.from_bytes(RESPONSE)
+    assert response.peers == [("127.0.0.1", 6881), ("10.0.0.2", 6882)]
+    assert response.next_announce == 1200
+    peer = Dict({"ip": String(b"::1"), "peer id": String(bytes(20)), "port": Integer(51413)})
+    response = AnnounceResponse.from_bytes(Dict({"peers": List([peer])}).to_bytes)
+    assert response.peers == [("::1", 51413)]
+
+
+def test_failure_reason() -> None:
+    with pytest.raises(TrackerError, match="unregistered"):
+        AnnounceResponse.from_bytes(Dict({"failure reason": String(b"unregistered")}).to_bytes)
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_pool_reuses_connection(chunked: bool) -> None:
+    async def scenario() -> None:
+        pool = HttpPool()
+        async with StubTracker(chunked=chunked) as tracker:
+            for _ in range(3):
+                assert await pool.get(tracker.url, {"info_hash": b"\x00\xff", "left": 5}) == RESPONSE
+            await pool.close()
+        assert tracker.connections == 1
+        assert pool.opened == 1
+        assert tracker.queries[0]["left"] == ["5"]
+
+    asyncio.run(scenario())
+
+
+def test_tier_fallback_and_promotion() -> None:
+    async def scenario() -> None:
+        found: list[list[tuple[str, int]]] = []
+        async with StubTracker() as tracker:
+            dead = "http://127.0.0.1:1/announce"
+            announcer = Announcer(
+                info_hash=bytes(20),
+                tiers=[[dead], [dead, tracker.url]],
+                stats=lambda: TransferStats(left=10),
+                on_peers=found.append,
+            )
+            response = await announcer.announce(AnnounceEvent.STARTED)
+            await announcer.close()
+        assert response.peers == found[0]
+        assert announcer.tiers[1][0] == tracker.url
+        assert tracker.queries[0]["event"] == ["started"]
+
+    asyncio.run(scenario())
+
+
+def test_all_trackers_fail() -> None:
+    async def scenario() -> None:
+        announcer = Announcer(
+            info_hash=bytes(20),
+            tiers=[["http://127.0.0.1:1/announce"], ["wss://127.0.0.1:1/announce"]],
+            stats=TransferStats,
+            on_peers=lambda _: None,
+        )
+        with pytest.raises(TrackerError):
+            await announcer.announce()
+
+    asyncio.run(scenario())
@@ -0,0 +1,131 @@
+import asyncio
+import struct
+
+import pytest
+
+from app.exceptions import TrackerError
+from app.tracker.announce import Announcer
+from app.tracker.models import AnnounceEvent, TransferStats
+from app.tracker.udp import PROTOCOL_ID, Action, ScrapeResult, UdpTrackerClient
+
+CONNECTION_ID = 0x1122334455667788
+PEERS = bytes([127, 0, 0, 1, 0x1A, 0xE1])
+
+
+class StubTracker(asyncio.DatagramProtocol):
+    def __init__(self, drop_first: int = 0, error: bytes = b"") -> None:
+        self.drop_first = drop_first
+        self.error = error
+        self.received: list[int] = []
+        self.events: list[int] = []
+        self.transport: asyncio.DatagramTransport | None = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport  # type: ignore[assignment]
+
+    def datagram_received(self, data: bytes, addr: tuple[str, int]) -> None:
+        connection_id, action, transaction_id = struct.unpack_from(">QII", data)
+        self.received.append(action)
+        if self.drop_first:
+            self.drop_first -= 1
+            return
+        if self.error:
+            self._send(struct.pack(">II", Action.ERROR, transaction_id) + self.error, addr)
+        elif action == Action.CONNECT:
+            assert connection_id == PROTOCOL_ID
+            self._send(struct.pack(">IIQ", Action.CONNECT, transaction_id, CONNECTION_ID), addr)
+        elif action == Action.ANNOUNCE:
+            assert connection_id == CONNECTION_ID
+            self.events.append(struct.unpack_from(">I", data, 80)[0])
+            self._send(struct.pack(">IIIII", Action.ANNOUNCE, transaction_id, 1800, 3, 7) + PEERS, addr)
+        elif action == Action.SCRAPE:
+            count = (len(data) - 16) // 20
+            entries = b"".join(struct.pack(">III", 5, 10 + index, 2) for index in range(count))
+            self._send(struct.pack(">II", Action.SCRAPE, transaction_id) + entries, addr)
+
+    def _send(self, data: bytes, addr: tuple[str, int]) -> None:
+        if self.transport is not None:
+            self.transport.sendto(data, addr)
+
+
+async def start(stub: StubTracker) -> str:
+    transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+        lambda: stub, local_addr=("127.0.0.1", 0)
+    )
+    return f"udp://127.0.0.1:{transport.get_extra_info('sockname')[1]}/announce"
+
+
+def test_announce_caches_connection_id() -> None:
+    async def scenario() -> None:
+        stub = StubTracker()
+        url = await start(stub)
+        client = UdpTrackerClient(retry_seconds=0.05)
+        for event in (AnnounceEvent.STARTED, AnnounceEvent.NONE):
+            response = await client.announce(url, bytes(20), TransferStats(left=1), event)
+            assert response.peers == [("127.0.0.1", 6881)]
+            assert response.interval == 1800
+        assert await client.scrape(url, [bytes(20), bytes(range(20))]) == [
+            ScrapeResult(seeders=5, completed=10, leechers=2),
+            ScrapeResult(seeders=5, completed=11, leechers=2),
+        ]
+        client.close()
+        assert client.connects == 1
+        assert stub.received == [Action.CONNECT, Action.ANNOUNCE, Action.ANNOUNCE, Action.SCRAPE]
+        assert stub.events == [2, 0]
+
+    asyncio.run(scenario())
+
+
+def test_retransmits_lost_requests() -> None:
+    async def scenario() -> None:
+        stub = StubTracker(drop_first=2)
+        url = await start(stub)
+        client = UdpTrackerClient(retry_seconds=0.02)
+        response = await client.announce(url, bytes(20), TransferStats(), AnnounceEvent.NONE)
+        client.close()
+        assert response.peers == [("127.0.0.1", 6881)]
+        assert stub.received == [Action.CONNECT, Action.CONNECT, Action.CONNECT, Action.ANNOUNCE]
+
+    asyncio.run(scenario())
+
+
+def test_gives_up_after_attempts() -> None:
+    async def scenario() -> None:
+        stub = StubTracker(drop_first=10)
+        url = await start(stub)
+        client = UdpTrackerClient(retry_seconds=0.01, attempts=3)
+        with pytest.raises(TrackerError, match="no answer"):
+            await client.announce(url, bytes(20), TransferStats(), AnnounceEvent.NONE)
+        client.close()
+        assert len(stub.received) == 3
+
+    asyncio.run(scenario())
+
+
+def test_error_action() -> None:
+    async def scenario() -> None:
+        url = await start(StubTracker(error=b"torrent not registered"))
+        client = UdpTrackerClient(retry_seconds=0.05)
+        with pytest.raises(TrackerError, match="not registered"):
+            await client.announce(url, bytes(20), TransferStats(), AnnounceEvent.NONE)
+        client.close()
+
+    asyncio.run(scenario())
+
+
+def test_announcer_picks_udp_for_udp_urls() -> None:
+    async def scenario() -> None:
+        url = await start(StubTracker())
+        found: list[list[tuple[str, int]]] = []
+        announcer = Announcer(
+            info_hash=bytes(20),
+            tiers=[[url]],
+            stats=TransferStats,
+            on_peers=found.append,
+            udp=UdpTrackerClient(retry_seconds=0.05),
+        )
+        await announcer.announce(AnnounceEvent.STARTED)
+        await announcer.close()
+        assert found == [[("127.0.0.1", 6881)]]
+
+    asyncio.run(scenario())